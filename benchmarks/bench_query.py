@@ -0,0 +1,370 @@
+"""
+Query Benchmarks
+----------------
+
+Benchmarks of wikirepo.data.query against a synthetic stand-in for Wikidata.
+
+Each axis (number of locations, depth, interval, timespan length and number of properties) is varied
+from a baseline case while the others are held constant, with the wall time, entity fetch count and
+peak memory of each query being written as JSON so that versions can be compared.
+
+Usage
+    python benchmarks/bench_query.py --out bench_results.json
+    python benchmarks/bench_query.py --axes depth interval --quick
+    python benchmarks/bench_query.py --compare bench_old.json bench_new.json
+
+Contents
+    CountingTransport Class
+        __init__,
+        get,
+        get_sized,
+        get_many
+
+    _clear_shared_caches,
+    _serve,
+    bench_props,
+    gen_cases,
+    case_key,
+    run_case,
+    run_benchmarks,
+    compare_results,
+    main
+"""
+
+import argparse
+import json
+import multiprocessing
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import date
+
+import pandas as pd
+import wikirepo
+from dateutil.rrule import DAILY, MONTHLY, WEEKLY, YEARLY, rrule
+from wikidata.client import Client
+from wikirepo.data import fetch_utils, lctn_utils, synth_utils, wd_utils
+
+start_date = date(2000, 1, 1)
+
+baseline = {
+    "n_locations": 4,
+    "depth": 1,
+    "interval": "yearly",
+    "timespan_years": 2,
+    "n_props": 2,
+}
+
+axes = {
+    "n_locations": [1, 4, 16, 64],
+    "depth": [0, 1, 2, 3],
+    "interval": ["yearly", "monthly", "weekly", "daily"],
+    "timespan_years": [1, 2, 4, 8, 16],
+    "n_props": [1, 2, 4, 8],
+}
+
+quick_axes = {
+    "n_locations": [1, 4],
+    "depth": [0, 1],
+    "interval": ["yearly", "monthly"],
+    "timespan_years": [1, 2],
+    "n_props": [1, 2],
+}
+
+# The number of sub-locations of each location, with depth 3 giving 8 leaves for each country.
+n_sub_lctns = 2
+
+# Timed runs can be repeated, but memory is only traced once as tracemalloc slows queries down.
+default_repeat = 1
+
+
+class CountingTransport:
+    """
+    Counts the entities that are fetched through another transport.
+    """
+
+    def __init__(self, transport):
+        self.transport = transport
+        self.n_fetches = 0
+        self.n_calls = 0
+
+    def get(self, pq_id):
+        return self.get_sized(pq_id)[0]
+
+    def get_sized(self, pq_id):
+        self.n_fetches += 1
+        self.n_calls += 1
+        return fetch_utils.get_sized(self.transport, pq_id)
+
+    def get_many(self, pq_ids, props=None, languages=None):
+        ents = self.transport.get_many(pq_ids, props=props, languages=languages)
+        self.n_fetches += len(ents)
+        self.n_calls += 1
+        return ents
+
+
+def _clear_shared_caches():
+    """
+    Clears the property entities and labels that wd_utils shares between queries so that each run is cold.
+    """
+    wd_utils.pid_ents.clear()
+    wd_utils.lbls_dict.clear()
+
+
+def _serve(ents, conn):
+    """
+    Runs a SynthServer in a separate process so that it isn't included in memory measurements.
+    """
+    with synth_utils.SynthServer(ents) as server:
+        conn.send(server.url)
+        conn.recv()  # blocks until the benchmarks are finished
+
+
+def bench_props(n_props):
+    """
+    Returns query kwargs for the first n_props of a fixed ordering of properties.
+    """
+    prop_order = [
+        ("demographic_props", "population"),
+        ("institutional_props", "capital"),
+        ("economic_props", "gdp_ppp"),
+        ("geographic_props", "area"),
+        ("demographic_props", "life_expectancy"),
+        ("economic_props", "nom_gdp"),
+        ("institutional_props", "human_dev_idx"),
+        ("economic_props", "unemployment"),
+    ]
+    assert n_props <= len(prop_order), f"n_props can be at most {len(prop_order)}."
+
+    prop_kwargs = {
+        "climate_props": None,
+        "demographic_props": False,
+        "economic_props": False,
+        "electoral_poll_props": False,
+        "electoral_result_props": False,
+        "geographic_props": False,
+        "institutional_props": False,
+        "political_props": False,
+        "misc_props": False,
+    }
+    for arg, prop in prop_order[:n_props]:
+        if prop_kwargs[arg] == False:
+            prop_kwargs[arg] = []
+        prop_kwargs[arg].append(prop)
+
+    return prop_kwargs
+
+
+def gen_cases(axes_to_run=None, quick=False):
+    """
+    Generates the cases that vary each axis from the baseline.
+    """
+    axis_vals = quick_axes if quick else axes
+    if axes_to_run is None:
+        axes_to_run = list(axis_vals.keys())
+
+    cases = []
+    for axis in axes_to_run:
+        for val in axis_vals[axis]:
+            case = dict(baseline, axis=axis)
+            case[axis] = val
+            cases.append(case)
+
+    return cases
+
+
+def case_key(case):
+    """
+    A key that identifies a case across result files.
+    """
+    return "|".join(f"{k}={case[k]}" for k in ["axis"] + list(baseline.keys()))
+
+
+def run_case(case, repeat=default_repeat):
+    """
+    Runs a benchmark case against a synthetic server in a separate process.
+
+    Returns
+    -------
+        result : dict
+            The case with wall_s, n_fetches, n_requests, peak_mem_mb and n_rows.
+    """
+    freq = {"yearly": YEARLY, "monthly": MONTHLY, "weekly": WEEKLY, "daily": DAILY}[
+        case["interval"]
+    ]
+    end_date = date(start_date.year + case["timespan_years"] - 1, 1, 1)
+    n_claims = len(list(rrule(freq, dtstart=start_date, until=end_date)))
+    timespan = (start_date, end_date)
+
+    ents = synth_utils.gen_synth_ents(
+        n_countries=case["n_locations"],
+        depth=case["depth"],
+        n_sub_lctns=n_sub_lctns,
+        n_claims=n_claims,
+        start_date=start_date,
+        interval=case["interval"],
+    )
+    country_qids = synth_utils.synth_country_qids(ents)
+
+    parent_conn, child_conn = multiprocessing.Pipe()
+    server_process = multiprocessing.Process(
+        target=_serve, args=(ents, child_conn), daemon=True
+    )
+    server_process.start()
+    url = parent_conn.recv()
+
+    transport = CountingTransport(fetch_utils.ClientTransport(Client(base_url=url)))
+    old_transport = wd_utils.set_transport(transport)
+    # Property entities aren't read from disk so that runs are cold.
+    old_pid_cache_dir = wd_utils.set_pid_cache_dir(None)
+    try:
+        lctns_dict = lctn_utils.gen_lctns_dict(
+            ents_dict=wd_utils.EntitiesDict(),
+            locations=country_qids,
+            depth=case["depth"],
+            timespan=timespan,
+            interval=case["interval"],
+            verbose=False,
+        )
+        query_kwargs = dict(
+            locations=lctns_dict,
+            depth=case["depth"],
+            timespan=timespan,
+            interval=case["interval"],
+            verbose=False,
+            **bench_props(case["n_props"]),
+        )
+
+        wall_times = []
+        for _ in range(repeat):
+            transport.n_fetches = 0
+            transport.n_calls = 0
+            _clear_shared_caches()
+            t0 = time.perf_counter()
+            df = wikirepo.data.query(ents_dict=wd_utils.EntitiesDict(), **query_kwargs)
+            wall_times.append(time.perf_counter() - t0)
+
+        n_fetches = transport.n_fetches
+        n_requests = transport.n_calls
+
+        _clear_shared_caches()
+        tracemalloc.start()
+        wikirepo.data.query(ents_dict=wd_utils.EntitiesDict(), **query_kwargs)
+        _, peak_mem = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    finally:
+        wd_utils.set_pid_cache_dir(old_pid_cache_dir)
+        wd_utils.set_transport(old_transport)
+        parent_conn.send("stop")
+        server_process.join(timeout=10)
+
+    return dict(
+        case,
+        wall_s=round(min(wall_times), 4),
+        n_fetches=n_fetches,
+        n_requests=n_requests,
+        peak_mem_mb=round(peak_mem / 1024**2, 3),
+        n_rows=len(df),
+    )
+
+
+def run_benchmarks(cases, repeat=default_repeat, verbose=True):
+    """
+    Runs benchmark cases and returns the results along with information on the environment.
+    """
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    results = []
+    for case in cases:
+        result = run_case(case, repeat=repeat)
+        results.append(result)
+        if verbose:
+            print(
+                f"{case['axis']:>14} = {str(case[case['axis']]):<8}"
+                f" wall_s={result['wall_s']:<9} n_fetches={result['n_fetches']:<6}"
+                f" peak_mem_mb={result['peak_mem_mb']:<9} n_rows={result['n_rows']}"
+            )
+
+    return {
+        "meta": {
+            "commit": commit,
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "platform": platform.platform(),
+            "date": date.today().isoformat(),
+            "repeat": repeat,
+            "baseline": baseline,
+        },
+        "results": results,
+    }
+
+
+def compare_results(old, new, threshold=1.1):
+    """
+    Compares two result files, returning the cases where a metric increased by more than threshold.
+    """
+    metrics = ["wall_s", "n_fetches", "peak_mem_mb"]
+    old_results = {case_key(r): r for r in old["results"]}
+
+    regressions = []
+    for r in new["results"]:
+        key = case_key(r)
+        if key not in old_results:
+            continue
+
+        for m in metrics:
+            old_val, new_val = old_results[key][m], r[m]
+            ratio = new_val / old_val if old_val else float(new_val > 0) + 1
+            print(f"{key} {m}: {old_val} -> {new_val} ({ratio:.2f}x)")
+            if ratio > threshold:
+                regressions.append({"case": key, "metric": m, "ratio": ratio})
+
+    return regressions
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("Usage")[0])
+    parser.add_argument("--out", default="bench_results.json")
+    parser.add_argument("--axes", nargs="+", choices=list(axes.keys()), default=None)
+    parser.add_argument("--quick", action="store_true")
+    parser.add_argument("--repeat", type=int, default=default_repeat)
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), default=None)
+    parser.add_argument("--threshold", type=float, default=1.1)
+    args = parser.parse_args(args)
+
+    if args.compare:
+        with open(args.compare[0]) as f_old, open(args.compare[1]) as f_new:
+            regressions = compare_results(
+                json.load(f_old), json.load(f_new), threshold=args.threshold
+            )
+
+        for r in regressions:
+            print(f"Regression: {r['case']} {r['metric']} {r['ratio']:.2f}x")
+
+        return 1 if regressions else 0
+
+    results = run_benchmarks(
+        gen_cases(axes_to_run=args.axes, quick=args.quick), repeat=args.repeat
+    )
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+
+    print(f"Results written to {args.out}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -40,6 +40,7 @@
     ],
     python_requires=">=3.6",
     install_requires=requirements,
+    extras_require={"parquet": ["pyarrow>=1.0.0"]},
     description="Python based Wikidata framework for easy dataframe extraction",
     long_description=long_description,
     long_description_content_type="text/markdown",
@@ -1,2 +1,4 @@
 # from wikirepo.data.upload import upload # function call wikirepo.data.upload()
 from wikirepo.data.query import query  # function call wikirepo.data.query()
+from wikirepo.data.plan_utils import estimate_query  # wikirepo.data.estimate_query()
+from wikirepo.data.refresh import refresh  # function call wikirepo.data.refresh()
@@ -0,0 +1,318 @@
+"""
+Cache Utilities
+---------------
+
+A persistent cache of query results.
+
+Results are written as Parquet files that are keyed by a hash of the normalized query, with the
+revision ids of the entities that a result was derived from and its attrs being stored alongside it
+as JSON. A result is
+only read while none of these entities has a new revision, which is checked in batched requests
+that only fetch revision ids.
+
+Parquet requires pyarrow (pip install wikirepo[parquet]), with frames otherwise being pickled.
+
+The states that wikirepo.data.refresh needs of results, such as their LocationsDicts and the revisions
+that each location's rows depend on, are kept in memory and indexed by a key in the results' attrs, as
+pandas copies attrs whenever a frame is derived.
+
+Warning: reading a pickle can execute arbitrary code, so the cache directory (including one set by
+WIKIREPO_QUERY_CACHE_DIR) should only be writable by trusted users.
+
+Contents
+    set_cache_dir,
+    _canonical_timespan,
+    spec_key,
+    fetch_revisions,
+    store_refresh_state,
+    load_refresh_state,
+    _entry_paths,
+    _write_df,
+    _read_df,
+    read_result,
+    write_result
+"""
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+from wikirepo.data import data_utils, fetch_utils, prof_utils, time_utils, wd_utils
+
+# The directory in which query results are cached, with None for no caching.
+cache_dir = os.environ.get("WIKIREPO_QUERY_CACHE_DIR")
+
+# The states of results for wikirepo.data.refresh, with the least recently used being dropped first.
+refresh_states = OrderedDict()
+max_refresh_states = 64
+_refresh_states_lock = threading.Lock()
+
+
+def set_cache_dir(new_cache_dir=None):
+    """
+    Sets the directory in which query results are cached.
+
+    Parameters
+    ----------
+        new_cache_dir : str (default=None: no caching)
+            The directory to cache results in, which is created if needed.
+
+            Note: cached frames can be pickles, so the directory should only be writable by trusted users.
+
+    Returns
+    -------
+        old_cache_dir : str or None
+            The previous directory so that it can be reset.
+    """
+    global cache_dir
+    old_cache_dir = cache_dir
+    cache_dir = new_cache_dir
+
+    return old_cache_dir
+
+
+def _canonical_timespan(timespan=None, interval=None):
+    """
+    Returns the first and last dates of the rows of a query as ISO strings, or None for the most recent data.
+    """
+    dates = time_utils.make_timespan(timespan=timespan, interval=interval)
+    if not dates:
+        return
+
+    return [dates[0].isoformat(), dates[-1].isoformat()]
+
+
+def spec_key(
+    locations=None,
+    depth=None,
+    timespan=None,
+    interval=None,
+    typed=False,
+    dir_indexes=None,
+):
+    """
+    Hashes the normalized spec of a query.
+
+    Notes
+    -----
+        Locations are resolved to QIDs, timespans to the dates of their first and last rows, and
+        directories that query all indexes to their indexes.
+
+        The order of locations and indexes is kept as it determines the order of rows and columns.
+
+    Returns
+    -------
+        key : str
+            A hex digest that identifies the query.
+    """
+    if isinstance(locations, str):
+        locations = [locations]
+
+    if isinstance(locations, dict):
+        # Includes the labels and sub-locations of a lctn_utils.LocationsDict.
+        lctns_spec = json.loads(json.dumps(locations, default=str))
+    else:
+        lctns_spec = data_utils._lctns_to_qids(locations=locations, depth=0)
+
+    spec = {
+        "locations": lctns_spec,
+        "depth": depth,
+        "timespan": _canonical_timespan(timespan=timespan, interval=interval),
+        "interval": interval.lower() if interval is not None else None,
+        "typed": bool(typed),
+        "props": {
+            dir_name: (
+                indexes
+                if indexes is not None
+                else data_utils.incl_dir_idxs(dir_name=dir_name)
+            )
+            for dir_name, indexes in sorted((dir_indexes or {}).items())
+        },
+        "lbl_languages": list(wd_utils.lbl_languages),
+    }
+
+    return hashlib.sha256(
+        json.dumps(spec, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+def fetch_revisions(qids):
+    """
+    Fetches the current revision ids of entities in batches, with None for those that don't exist.
+    """
+    infos = wd_utils.transport.get_many(list(qids), props=["info"])
+
+    return {q: infos.get(q, {}).get("lastrevid") for q in qids}
+
+
+def store_refresh_state(state):
+    """
+    Keeps the state of a query result for wikirepo.data.refresh, returning the key for its attrs.
+
+    Note: only the cache_utils.max_refresh_states most recently used states are kept.
+    """
+    key = hashlib.sha256(
+        json.dumps(state, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+    with _refresh_states_lock:
+        refresh_states[key] = state
+        refresh_states.move_to_end(key)
+        while len(refresh_states) > max_refresh_states:
+            refresh_states.popitem(last=False)
+
+    return key
+
+
+def load_refresh_state(key):
+    """
+    Returns the state of a query result from cache_utils.store_refresh_state, or None if it isn't kept.
+    """
+    with _refresh_states_lock:
+        state = refresh_states.get(key)
+        if state is not None:
+            refresh_states.move_to_end(key)
+
+    return state
+
+
+def _entry_paths(cache_dir, key):
+    """
+    Returns the paths of the metadata of a cache entry and of its frame without an extension.
+    """
+    return os.path.join(cache_dir, f"{key}.json"), os.path.join(cache_dir, key)
+
+
+def _write_df(df, path):
+    """
+    Writes a df without its attrs as Parquet given a path without an extension, returning the path that was written.
+
+    Note: frames are pickled if pyarrow isn't installed or if columns have values of mixed types.
+    """
+    df = df.copy(deep=False)
+    df.attrs = {}
+
+    try:
+        import pyarrow
+    except ImportError:
+        pyarrow = None
+
+    df_path = f"{path}.parquet"
+    if pyarrow is not None:
+        try:
+            df.to_parquet(f"{df_path}.tmp", engine="pyarrow")
+
+        except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError):
+            # Columns of values of mixed types can't be converted to Arrow.
+            if os.path.exists(f"{df_path}.tmp"):
+                os.remove(f"{df_path}.tmp")
+
+            pyarrow = None
+
+    if pyarrow is None:
+        df_path = f"{path}.pkl"
+        df.to_pickle(f"{df_path}.tmp")
+
+    os.replace(f"{df_path}.tmp", df_path)
+
+    return df_path
+
+
+def _read_df(df_path):
+    """
+    Reads a df written by cache_utils._write_df.
+
+    Warning: pickles can execute arbitrary code when read, so they should only be read from trusted directories.
+    """
+    if df_path.endswith(".parquet"):
+        return pd.read_parquet(df_path)
+
+    return pd.read_pickle(df_path)
+
+
+def read_result(cache_dir, key):
+    """
+    Reads the cached result of a query if none of the entities it was derived from have changed.
+
+    Parameters
+    ----------
+        cache_dir : str
+            The directory that results are cached in.
+
+        key : str
+            The key of the query from cache_utils.spec_key.
+
+    Returns
+    -------
+        df or None : pd.DataFrame or None
+            The cached result, or None if there isn't one or it's stale.
+    """
+    meta_path, _ = _entry_paths(cache_dir, key)
+    if not os.path.exists(meta_path):
+        return
+
+    with open(meta_path) as f:
+        meta = json.load(f)
+
+    with prof_utils.stage("read_cache") as cache_stage:
+        if fetch_revisions(meta["revisions"].keys()) != meta["revisions"]:
+            return
+
+        df = _read_df(os.path.join(cache_dir, meta["file"]))
+        df.attrs = meta["attrs"]
+        cache_stage.rows = len(df)
+
+    return df
+
+
+def write_result(cache_dir, key, df, qids, ents_dict=None):
+    """
+    Caches the result of a query along with the revision ids of the entities it was derived from.
+
+    Parameters
+    ----------
+        cache_dir : str
+            The directory that results are cached in.
+
+        key : str
+            The key of the query from cache_utils.spec_key.
+
+        df : pd.DataFrame
+            The result of the query.
+
+            Note: its attrs need to be JSON-serializable, as they're stored with the revision ids.
+
+        qids : list (contains strs)
+            The QIDs of the entities that the result was derived from.
+
+        ents_dict : wd_utils.EntitiesDict (default=None)
+            A dictionary whose revision ids are used, with those of other entities being fetched.
+    """
+    qids = list(dict.fromkeys(qids))
+    revisions = {}
+    for q in qids:
+        if ents_dict is not None and q in ents_dict and ents_dict[q] is not None:
+            revisions[q] = ents_dict[q].get("lastrevid")
+
+    qids_to_fetch = [q for q in qids if revisions.get(q) is None]
+    if qids_to_fetch:
+        revisions.update(fetch_revisions(qids_to_fetch))
+
+    os.makedirs(cache_dir, exist_ok=True)
+    meta_path, path = _entry_paths(cache_dir, key)
+    df_path = _write_df(df, path)
+
+    meta = json.dumps(
+        {
+            "file": os.path.basename(df_path),
+            "revisions": {q: revisions[q] for q in qids},
+            "attrs": df.attrs,
+        }
+    )
+    tmp_path = f"{meta_path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(meta)
+
+    os.replace(tmp_path, meta_path)
@@ -0,0 +1,116 @@
+"""
+Coverage Utilities
+------------------
+
+Structured reporting of data that is missing from Wikidata.
+
+Missing data is recorded by ids only, so reporting never fetches an entity. Records are logged to
+the 'wikirepo.data.coverage_utils' logger at DEBUG level, and are collected while a MissingData
+collector is active.
+
+Contents
+    collecting,
+    record_missing
+
+    MissingData Class
+        __init__,
+        __repr__,
+        add,
+        report
+"""
+
+import contextvars
+import logging
+from contextlib import contextmanager
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# The collector that missing data is recorded to, with None meaning that it's only logged.
+# Each thread and task has its own, so concurrent queries don't collect each other's missing data.
+_active_collector = contextvars.ContextVar("wikirepo_active_collector", default=None)
+
+# Reasons that data can be missing.
+missing_reasons = {
+    "missing_property": "the location does not have the property",
+    "no_values_in_timespan": "the property has no values within the timespan",
+    "missing_sub_lctns": "the location does not have sub-locations",
+}
+
+
+class MissingData(list):
+    """
+    A list of (qid, pid, reason) tuples for data that is missing from Wikidata.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, *args, **kwargs):
+        super(MissingData, self).__init__(*args, **kwargs)
+
+    def __repr__(self):
+        return "%s" % self.__class__
+
+    def add(self, qid, pid, reason):
+        """
+        Adds a record of missing data.
+        """
+        self.append((qid, pid, reason))
+
+    def report(self):
+        """
+        Provides a df of the missing data, with each (qid, pid, reason) appearing once.
+        """
+        return pd.DataFrame(list(dict.fromkeys(self)), columns=["qid", "pid", "reason"])
+
+
+@contextmanager
+def collecting(collector=None):
+    """
+    Activates a collector for missing data within the context.
+
+    Parameters
+    ----------
+        collector : coverage_utils.MissingData (default=None: a new collector)
+            The collector to which missing data should be added.
+
+    Yields
+    ------
+        collector : coverage_utils.MissingData
+            The active collector.
+    """
+    if collector is None:
+        collector = MissingData()
+
+    token = _active_collector.set(collector)
+    try:
+        yield collector
+
+    finally:
+        _active_collector.reset(token)
+
+
+def record_missing(qid, pid, reason):
+    """
+    Records that the data of a property is missing for a location.
+
+    Parameters
+    ----------
+        qid : str
+            Wikidata QID for a location.
+
+        pid : str
+            The Wikidata property that is missing.
+
+        reason : str
+            Why the data is missing (see coverage_utils.missing_reasons).
+    """
+    assert (
+        reason in missing_reasons
+    ), f"Please choose a reason from the following: {', '.join(missing_reasons)}."
+
+    logger.debug("%s %s %s", qid, pid, reason)
+    collector = _active_collector.get()
+    if collector is not None:
+        collector.add(qid, pid, reason)
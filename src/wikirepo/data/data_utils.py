@@ -9,7 +9,14 @@
     _get_dir_fxns_dict,
     _check_data_assertions,
     _get_max_workers,
+    _to_typed_series,
+    _select_most_recent,
+    _interp_linear_by_group,
+    _props_arg_to_dir,
     incl_dir_idxs,
+    incl_dir_props,
+    incl_dir_pids,
+    _lctns_to_qids,
     gen_base_df,
     assign_to_column,
     gen_base_and_assign_to_column,
@@ -19,14 +26,15 @@
     query_repo_dir,
     interp_by_subset,
     sum_df_prop_vals,
+    rollup_df_prop_vals,
     split_col_val_dates,
-    count_df_prop_vals
+    count_df_prop_vals,
+    set_df_dtypes
 """
 
 import importlib
 import inspect
 import os
-from ast import literal_eval
 
 import numpy as np
 
@@ -34,7 +42,7 @@
 import pandas as pd
 from tqdm.auto import tqdm
 from wikirepo import utils
-from wikirepo.data import lctn_utils, time_utils, wd_utils
+from wikirepo.data import lctn_utils, prof_utils, sparql_utils, time_utils, wd_utils
 
 
 def _get_dir_fxns_dict(dir_name=None):
@@ -144,6 +152,131 @@ def _get_max_workers(multicore):
         return multicore
 
 
+def _to_typed_series(series):
+    """
+    Converts a value series to a nullable numeric, boolean or categorical dtype where possible.
+    """
+    if series.dtype.name in ["Int64", "Float64", "boolean", "category"]:
+        return series
+
+    non_null = series.dropna()
+    if len(non_null) == 0:
+        return series.astype("Float64")
+
+    if non_null.map(lambda x: isinstance(x, (bool, np.bool_))).all():
+        return series.astype("boolean")
+
+    numeric = pd.to_numeric(series, errors="coerce")
+    if numeric.notnull().sum() == len(non_null):
+        if (numeric.dropna() % 1 == 0).all():
+            return numeric.astype("Int64")
+
+        return numeric.astype("Float64")
+
+    try:
+        n_unique = non_null.nunique()
+    except TypeError:  # unhashable values such as lists can't be categories
+        return series
+
+    if n_unique <= len(non_null) / 2:
+        return series.astype("category")
+
+    return series
+
+
+def _select_most_recent(qids, props):
+    """
+    Selects the most recent value and its date for each QID in a t_to_prop_val_dict output.
+
+    Notes
+    -----
+        Dated values are preferred over 'no date' values, of which the first is selected if there are no dated values.
+
+    Parameters
+    ----------
+        qids : list or np.array (contains strs)
+            The QIDs for which values should be selected.
+
+        props : dict
+            A dictionary of property values indexed by QIDs and then times.
+
+    Returns
+    -------
+        df_most_recent : pd.DataFrame
+            A df indexed by QID with 'val' and 'date' columns.
+    """
+    long_rows = [
+        (q, t, v)
+        for q in qids
+        if isinstance(q, str) and q in props  # is a valid location
+        for t, v in props[q].items()
+    ]
+    df_long = pd.DataFrame(long_rows, columns=["qid", "date", "val"])
+    df_long["order"] = range(len(df_long))
+    df_long["is_dated"] = df_long["date"] != "no date"
+    # Dates are datetime.date objects or truncated strings, both of which sort in ISO format.
+    df_long["sort_date"] = df_long["date"].where(df_long["is_dated"], "").map(str)
+    df_long["date"] = df_long["date"].where(df_long["is_dated"], np.nan)
+
+    df_most_recent = (
+        df_long.sort_values(
+            by=["is_dated", "sort_date", "order"], ascending=[False, False, True]
+        )
+        .groupby("qid", sort=False)
+        .head(1)
+        .set_index("qid")
+    )
+
+    return df_most_recent[["val", "date"]]
+
+
+def _interp_linear_by_group(series, group_ids, limit_direction=None):
+    """
+    Linearly interpolates a numeric series within groups without iterating over the groups.
+
+    Notes
+    -----
+        Equivalent to applying pd.Series.interpolate(method='linear') to each group.
+    """
+    vals = series.astype(float)
+    pos = group_ids.groupby(group_ids).cumcount().astype(float)
+    valid_pos = pos.where(vals.notnull())
+
+    prev_pos = valid_pos.groupby(group_ids).ffill()
+    next_pos = valid_pos.groupby(group_ids).bfill()
+    prev_val = vals.groupby(group_ids).ffill()
+    next_val = vals.groupby(group_ids).bfill()
+
+    is_missing = vals.isnull()
+    inside = is_missing & prev_pos.notnull() & next_pos.notnull()
+    after = is_missing & prev_pos.notnull() & next_pos.isnull()
+    before = is_missing & prev_pos.isnull() & next_pos.notnull()
+
+    interpolated = vals.copy()
+    interpolated[inside] = (
+        prev_val + (next_val - prev_val) * (pos - prev_pos) / (next_pos - prev_pos)
+    )[inside]
+
+    if limit_direction in [None, "forward", "both"]:
+        interpolated[after] = prev_val[after]
+
+    if limit_direction in ["backward", "both"]:
+        interpolated[before] = next_val[before]
+
+    return interpolated
+
+
+def _props_arg_to_dir(arg):
+    """
+    Converts a directory argument of a query (ex: electoral_poll_props) into the name of its directory.
+    """
+    dir_name = arg[: -len("_props")]
+    if dir_name in ["electoral_poll", "electoral_result"]:
+        dir_name += "s"
+
+    return dir_name
+
+
 def incl_dir_idxs(dir_name=None, descriptions=False):
     """
     Returns the included indexes in the given directory - the file names of its scripts.
@@ -164,6 +297,95 @@ def incl_dir_idxs(dir_name=None, descriptions=False):
     return list(_get_dir_fxns_dict(dir_name).keys())
 
 
+def incl_dir_props(dir_name=None, indexes=None):
+    """
+    Returns the Wikidata properties that each of the given indexes of a directory queries.
+
+    Parameters
+    ----------
+        dir_name : str (default=None)
+            The name of the directory within wikirepo.data.
+
+        indexes : list (contains strs) (default=None: all indexes)
+            The indexes of the directory.
+
+    Returns
+    -------
+        props : list (contains tuples)
+            The index, 'pid' and 'sub_pid' of each index, with None for a 'pid' that isn't a str or an invalid index.
+    """
+    fxns_dict = _get_dir_fxns_dict(dir_name)
+    if indexes is None:
+        indexes = list(fxns_dict.keys())
+
+    props = []
+    for idx in indexes:
+        if not fxns_dict.get(idx):
+            props.append((idx, None, None))
+            continue
+
+        script = importlib.import_module(next(iter(fxns_dict[idx].values())).__module__)
+        pid = getattr(script, "pid", None)
+        props.append(
+            (
+                idx,
+                pid if isinstance(pid, str) else None,
+                getattr(script, "sub_pid", None),
+            )
+        )
+
+    return props
+
+
+def incl_dir_pids(dir_name=None, indexes=None):
+    """
+    Returns the Wikidata properties that the given indexes of a directory query.
+
+    Parameters
+    ----------
+        dir_name : str (default=None)
+            The name of the directory within wikirepo.data.
+
+        indexes : list (contains strs) (default=None: all indexes)
+            The indexes of the directory.
+
+    Returns
+    -------
+        pids : list or None
+            The 'pid' and 'sub_pid' of each index, or None if an index doesn't have a 'pid'.
+    """
+    pids = []
+    for _, pid, sub_pid in incl_dir_props(dir_name=dir_name, indexes=indexes):
+        if pid is None:
+            return
+
+        pids.append(pid)
+        if isinstance(sub_pid, str):
+            pids.append(sub_pid)
+
+    return pids
+
+
+def _lctns_to_qids(locations=None, depth=None):
+    """
+    Returns the QIDs of locations at the given depth.
+    """
+    if isinstance(locations, str):
+        locations = [locations]
+
+    if isinstance(locations, list):
+        qids = [
+            lctn_utils.lctn_lbl_to_qid(lctn) if not wd_utils.is_wd_id(lctn) else lctn
+            for lctn in locations
+        ]
+
+    elif isinstance(locations, dict):
+        # Includes lctn_utils.LocationsDict.
+        qids = lctn_utils.get_qids_at_depth(lctns_dict=locations, depth=depth)
+
+    return utils._make_var_list(qids)[0]
+
+
 def gen_base_df(
     locations=None, depth=None, timespan=None, interval=None, col_name="data"
 ):
@@ -233,7 +455,7 @@ def gen_base_df(
     for col in qid_cols:
         base_df[col] = base_df[col].astype(object)
 
-    if depth == 0:
+    if depth == 0 and isinstance(locations, list):
         base_df[lctn_utils.depth_to_col_name(depth=depth)] = locations
 
     current_depth = 0
@@ -260,34 +482,24 @@ def gen_base_df(
         assign_qid_col = lctn_utils.depth_to_qid_col_name(depth=current_depth + 1)
         assign_lbl_col = lctn_utils.depth_to_col_name(depth=current_depth + 1)
 
-        for q in [qid for qid in current_depth_qids if qid != np.nan]:
-            # Assign a list that will directly be exploded.
+        sub_qids_dict = {}
+        sub_lbls_dict = {}
+        for q in [qid for qid in current_depth_qids if qid != "nan"]:
             key_items = list(lctn_utils.iter_key_items(node=locations, kv=q))[0]
             key_subs = list(lctn_utils.iter_key_items(node=key_items, kv="sub_lctns"))[
                 0
             ]
-            key_sub_qids = list(key_subs.keys())
-            if key_sub_qids == []:
-                # Assign to locations that don't have sub_lctns for pd.explode.
-                key_sub_qids = np.nan
-
-            base_df.at[
-                base_df[base_df[current_qid_col] == q].index[0], assign_qid_col
-            ] = key_sub_qids
-
-            base_df = base_df.explode(assign_qid_col)
-            base_df.reset_index(drop=True, inplace=True)
-            base_df[assign_qid_col] = base_df[assign_qid_col].astype(str)
-
-            if isinstance(key_sub_qids, list):
-                for sub_q in base_df.loc[base_df[current_qid_col] == q, assign_qid_col]:
-                    # For each sub_qid, assign the lbl.
-                    base_df.loc[
-                        base_df[base_df[assign_qid_col] == sub_q].index[0],
-                        assign_lbl_col,
-                    ] = list(lctn_utils.iter_key_items(node=locations, kv=sub_q))[0][
-                        "lbl"
-                    ]
+            sub_qids_dict[q] = list(key_subs.keys())
+            sub_lbls_dict.update({sub_q: v["lbl"] for sub_q, v in key_subs.items()})
+
+        # Assign lists that are directly exploded, with locations that don't have sub_lctns being NaN.
+        base_df[assign_qid_col] = [
+            sub_qids_dict.get(q) or np.nan for q in base_df[current_qid_col]
+        ]
+        base_df = base_df.explode(assign_qid_col)
+        base_df.reset_index(drop=True, inplace=True)
+        base_df[assign_qid_col] = base_df[assign_qid_col].astype(str)
+        base_df[assign_lbl_col] = base_df[assign_qid_col].map(sub_lbls_dict)
 
         current_depth_qids = list(base_df[assign_qid_col])
         current_qid_col = assign_qid_col
@@ -300,16 +512,23 @@ def gen_base_df(
         if isinstance(locations, (lctn_utils.LocationsDict, dict)):
             # Find the valid times for the sub_lctn and assign them.
             final_sub_lctn_qid_col = lctn_utils.depth_to_qid_col_name(depth=depth)
+            # Depth 0 locations don't have a valid_timespan, so the full timespan is used.
+            full_timespan = [
+                time_utils.truncate_date(d=t, interval=interval)
+                for t in time_utils.make_timespan(interval=interval, timespan=timespan)
+            ]
+            vts_dict = {}
             for q in base_df[final_sub_lctn_qid_col]:
                 if q != "nan":  # is str because of astype(str)
                     key_items = list(lctn_utils.iter_key_items(node=locations, kv=q))[0]
                     key_vts = list(
                         lctn_utils.iter_key_items(node=key_items, kv="valid_timespan")
-                    )[0]
+                    )
+                    vts_dict[q] = key_vts[0] if key_vts else full_timespan
 
-                    base_df.at[
-                        base_df[base_df[final_sub_lctn_qid_col] == q].index[0], time_col
-                    ] = key_vts
+            base_df[time_col] = [
+                vts_dict.get(q, np.nan) for q in base_df[final_sub_lctn_qid_col]
+            ]
 
             base_df = base_df.explode(time_col)
 
@@ -324,7 +543,8 @@ def gen_base_df(
             )
 
     if col_name != None:
-        base_df[col_name] = [np.nan] * len(base_df)
+        # Object dtype so that values of any type can be assigned row by row.
+        base_df[col_name] = pd.Series(np.nan, index=base_df.index, dtype=object)
 
     # Drop all columns except for the last to allow for assignment.
     for col in qid_cols[:-1]:
@@ -429,49 +649,26 @@ def assign_to_column(
                             col_name,
                         ] = props[q][t]
 
-    elif assign == "most_recent":  # interval and timespan are None
-        # Assign the most recent value formatted with the date it's coming from.
-        for q in df[assignment_col].unique():
-            if isinstance(q, str):  # is a valid location
-                if len(props[q].keys()) == 1:
-                    # Select the singular value even if it is 'no date'.
-                    assignment_times = list(props[q].keys())
-                else:
-                    # Select the documented times.
-                    assignment_times = sorted(
-                        [k for k in props[q].keys() if k != "no date"]
-                    )[::-1]
-
-                if assignment_times == []:
-                    # There were multiple 'no date' values, so select the first.
-                    assignment_times = list(list(props[q].keys())[0])
-
-                most_recent_t = assignment_times[0]
-                if isinstance(props[q][most_recent_t], list):
-                    # Multiple values to assign.
-                    if span:
-                        # We don't want the time for most recent span values.
-                        df.loc[
-                            df.loc[df[assignment_col] == q].index, col_name
-                        ] = ", ".join(str(i) for i in props[q][most_recent_t])
-
-                    else:
-                        df.loc[df.loc[df[assignment_col] == q].index, col_name] = (
-                            ", ".join(str(i) for i in props[q][most_recent_t])
-                            + f" ({most_recent_t})"
-                        )
+        df[col_name] = df[col_name].infer_objects()
 
-                else:
-                    if span:
-                        # We don't want the time for most recent span values.
-                        df.loc[df.loc[df[assignment_col] == q].index, col_name] = props[
-                            q
-                        ][most_recent_t]
+    elif assign == "most_recent":  # interval and timespan are None
+        # Assign the most recent value to col_name and its date to a separate column.
+        df_most_recent = _select_most_recent(
+            qids=df[assignment_col].unique(), props=props
+        )
+        df[col_name] = df[assignment_col].map(
+            df_most_recent["val"].map(
+                lambda v: ", ".join(str(i) for i in v) if isinstance(v, list) else v
+            )
+        )
 
-                    else:
-                        df.loc[
-                            df.loc[df[assignment_col] == q].index, col_name
-                        ] = f"{props[q][most_recent_t]} ({most_recent_t})"
+        if not span:
+            # We don't want the time for most recent span values.
+            df.insert(
+                df.columns.get_loc(col_name) + 1,
+                f"{col_name}_date",
+                df[assignment_col].map(df_most_recent["date"]),
+            )
 
     elif assign == "repeat":
         # Assign one value over multiple rows.
@@ -489,6 +686,8 @@ def assign_to_column(
                         indexes_to_assign
                     )
 
+        df[col_name] = df[col_name].infer_objects()
+
     else:
         valid_assigns = ["all", "most_recent", "repeat"]
 
@@ -517,24 +716,28 @@ def gen_base_and_assign_to_column(
     """
     Combines data_utils.gen_base_df and data_utils.assign_to_column.
     """
-    df = gen_base_df(
-        locations=locations,
-        depth=depth,
-        timespan=timespan,
-        interval=interval,
-        col_name=col_name,
-    )
+    with prof_utils.stage("gen_base_df") as base_stage:
+        df = gen_base_df(
+            locations=locations,
+            depth=depth,
+            timespan=timespan,
+            interval=interval,
+            col_name=col_name,
+        )
+        base_stage.rows = len(df)
 
-    df = assign_to_column(
-        df=df,
-        locations=locations,
-        depth=depth,
-        interval=interval,
-        col_name=col_name,
-        props=props,
-        assign=assign,
-        span=span,
-    )
+    with prof_utils.stage("assign_to_column") as assign_stage:
+        df = assign_to_column(
+            df=df,
+            locations=locations,
+            depth=depth,
+            interval=interval,
+            col_name=col_name,
+            props=props,
+            assign=assign,
+            span=span,
+        )
+        assign_stage.rows = len(df)
 
     return df
 
@@ -621,7 +824,9 @@ def assign_to_cols(
                     for k in props[q][t].keys():
                         sub_col = col_prefix + "_" + k.replace(" ", "_").lower()
                         if sub_col not in df.columns:
-                            df[sub_col] = [np.nan] * len(df)
+                            df[sub_col] = pd.Series(
+                                np.nan, index=df.index, dtype=object
+                            )
 
                         df.loc[
                             df[
@@ -631,41 +836,27 @@ def assign_to_cols(
                             sub_col,
                         ] = props[q][t][k]
 
-    elif assign == "most_recent":  # interval and timespan are None
-        # Assign the most recent value formatted with the date it's coming from.
-        for q in df[assignment_col]:
-            if isinstance(q, str):  # is a valid location
-                if len(props[q].keys()) == 1:
-                    # Select the singular value even if it is 'no date'.
-                    assignment_times = list(props[q].keys())
-                else:
-                    # Select the documented times.
-                    assignment_times = sorted(
-                        [k for k in props[q].keys() if k != "no date"]
-                    )[::-1]
+        sub_cols = [c for c in df.columns if c.startswith(col_prefix + "_")]
+        df[sub_cols] = df[sub_cols].infer_objects()
 
-                if assignment_times == []:
-                    # There were multiple 'no date' values, so select the first.
-                    assignment_times = list(list(props[q].keys())[0])
-
-                most_recent_t = assignment_times[0]
-
-                # props[q][most_recent_t] is a dictionary qualified values.
-                for k in props[q][most_recent_t].keys():
-                    sub_col = col_prefix + "_" + k.replace(" ", "_").lower()
-                    if sub_col not in df.columns:
-                        df[sub_col] = [np.nan] * len(df)
+    elif assign == "most_recent":  # interval and timespan are None
+        # Assign the most recent values to prefixed columns and their date to a separate column.
+        df_most_recent = _select_most_recent(
+            qids=df[assignment_col].unique(), props=props
+        )
+        df_sub_cols = pd.DataFrame(
+            list(df_most_recent["val"]), index=df_most_recent.index
+        )
+        df_sub_cols.columns = [
+            col_prefix + "_" + k.replace(" ", "_").lower() for k in df_sub_cols.columns
+        ]
 
-                    if span == True and sub_pid == bool:
-                        # We don't want the date if it's a spanned boolean value.
-                        df.loc[df[(df[assignment_col] == q)].index[0], sub_col] = props[
-                            q
-                        ][most_recent_t][k]
+        for sub_col in df_sub_cols.columns:
+            df[sub_col] = df[assignment_col].map(df_sub_cols[sub_col])
 
-                    else:
-                        df.loc[
-                            df[(df[assignment_col] == q)].index[0], sub_col
-                        ] = f"{props[q][most_recent_t][k]} ({most_recent_t})"
+        if not (span == True and sub_pid == bool):
+            # We don't want the date if it's a spanned boolean value.
+            df[f"{col_prefix}_date"] = df[assignment_col].map(df_most_recent["date"])
 
     else:
         valid_assigns = ["all", "most_recent"]
@@ -697,25 +888,29 @@ def gen_base_and_assign_to_cols(
     """
     Combines data_utils.gen_base_df and data_utils.assign_to_cols.
     """
-    df = gen_base_df(
-        locations=locations,
-        depth=depth,
-        timespan=timespan,
-        interval=interval,
-        col_name=None,
-    )  # col_name is None to prevent a data col
-
-    df = assign_to_cols(
-        df=df,
-        locations=locations,
-        depth=depth,
-        sub_pid=sub_pid,
-        interval=interval,
-        col_prefix=col_prefix,  # prefixed columns are instead assigned
-        props=props,
-        assign=assign,
-        span=span,
-    )
+    with prof_utils.stage("gen_base_df") as base_stage:
+        df = gen_base_df(
+            locations=locations,
+            depth=depth,
+            timespan=timespan,
+            interval=interval,
+            col_name=None,
+        )  # col_name is None to prevent a data col
+        base_stage.rows = len(df)
+
+    with prof_utils.stage("assign_to_cols") as assign_stage:
+        df = assign_to_cols(
+            df=df,
+            locations=locations,
+            depth=depth,
+            sub_pid=sub_pid,
+            interval=interval,
+            col_prefix=col_prefix,  # prefixed columns are instead assigned
+            props=props,
+            assign=assign,
+            span=span,
+        )
+        assign_stage.rows = len(df)
 
     return df
 
@@ -798,31 +993,28 @@ def query_wd_prop(
     if isinstance(locations, str):
         locations = [locations]
 
-    if isinstance(locations, list):
-        qids = [
-            lctn_utils.lctn_lbl_to_qid(lctn) if not wd_utils.is_wd_id(lctn) else lctn
-            for lctn in locations
-        ]
-
-    elif isinstance(locations, lctn_utils.LocationsDict):
-        qids = locations.get_keys_at_depth(depth)
-
-    elif isinstance(locations, dict):
-        qids = lctn_utils.get_qids_at_depth(lctns_dict=locations, depth=depth)
-    qids = utils._make_var_list(qids)[0]
+    qids = _lctns_to_qids(locations=locations, depth=depth)
 
     if col_prefix is None:
-        t_to_p_dict = wd_utils.t_to_prop_val_dict(
-            dir_name=dir_name,
-            ents_dict=ents_dict,
-            qids=qids,
-            pid=pid,
-            sub_pid=sub_pid,
-            timespan=timespan,
-            interval=interval,
-            ignore_char=ignore_char,
-            span=span,
-        )
+        if sparql_utils._active.get() and not isinstance(sub_pid, str):
+            # Values for all locations are queried at once rather than loading each entity.
+            t_to_prop_val_dict = sparql_utils.t_to_prop_val_dict
+        else:
+            t_to_prop_val_dict = wd_utils.t_to_prop_val_dict
+
+        with prof_utils.stage("t_to_prop_val_dict") as decode_stage:
+            t_to_p_dict = t_to_prop_val_dict(
+                dir_name=dir_name,
+                ents_dict=ents_dict,
+                qids=qids,
+                pid=pid,
+                sub_pid=sub_pid,
+                timespan=timespan,
+                interval=interval,
+                ignore_char=ignore_char,
+                span=span,
+            )
+            decode_stage.rows = len(t_to_p_dict)
 
         # Assignment via a single column col_name.
         if interval is not None:
@@ -850,17 +1042,19 @@ def query_wd_prop(
             )  # to remove the time from span props
 
     else:
-        t_to_p_dict = wd_utils.t_to_prop_val_dict_dict(
-            dir_name=dir_name,
-            ents_dict=ents_dict,
-            qids=qids,
-            pid=pid,
-            sub_pid=sub_pid,
-            timespan=timespan,
-            interval=interval,
-            ignore_char=ignore_char,
-            span=span,
-        )
+        with prof_utils.stage("t_to_prop_val_dict_dict") as decode_stage:
+            t_to_p_dict = wd_utils.t_to_prop_val_dict_dict(
+                dir_name=dir_name,
+                ents_dict=ents_dict,
+                qids=qids,
+                pid=pid,
+                sub_pid=sub_pid,
+                timespan=timespan,
+                interval=interval,
+                ignore_char=ignore_char,
+                span=span,
+            )
+            decode_stage.rows = len(t_to_p_dict)
 
         # Assignment via generated columns prefixed as col_prefix.
         if interval is not None:
@@ -946,7 +1140,7 @@ def query_repo_dir(
             A df of locations and data given timespan and demographic index arguments.
     """
     local_args = locals()
-    _check_data_assertions(**literal_eval(str(local_args)))
+    _check_data_assertions(timespan=timespan, interval=interval)
 
     modules_to_query = [
         arg
@@ -964,8 +1158,10 @@ def query_repo_dir(
             0
         ]  # there can only be one per module
 
-        if df_data is None:
-            df_data, ents_dict = module_fxns[query_fxn](
+        with prof_utils.stage(
+            "query_prop_data", module=f"{dir_name}.{mod}"
+        ) as mod_stage:
+            df_props, ents_dict = module_fxns[query_fxn](
                 dir_name=dir_name,
                 ents_dict=ents_dict,
                 locations=locations,
@@ -973,6 +1169,10 @@ def query_repo_dir(
                 timespan=timespan,
                 interval=interval,
             )
+            mod_stage.rows = len(df_props)
+
+        if df_data is None:
+            df_data = df_props
 
         else:
             if interval:
@@ -982,28 +1182,26 @@ def query_repo_dir(
             else:
                 merge_on = lctn_utils.depth_to_cols(depth)
 
-            df_props, ents_dict = module_fxns[query_fxn](
-                dir_name=dir_name,
-                ents_dict=ents_dict,
-                locations=locations,
-                depth=depth,
-                timespan=timespan,
-                interval=interval,
-            )
-
-            df_data = pd.merge(df_data, df_props, on=merge_on)
+            with prof_utils.stage("pd.merge", module=dir_name) as merge_stage:
+                # The qid column is the same for all properties, so only the first is kept.
+                df_data = pd.merge(
+                    df_data, df_props.drop(columns="qid", errors="ignore"), on=merge_on
+                )
+                merge_stage.rows = len(df_data)
 
     return df_data, ents_dict
 
 
 def interp_by_subset(df=None, depth=None, col_name="data", **kwargs):
     """
-    Subsets a df by a given geo_lvl and interpolates the given column.
+    Subsets a df by the locations of a given depth and interpolates the given column(s).
 
     Notes
     -----
         pd.DataFrame.interpolate and scipy.interpolate **kwargs are passed.
 
+        Interpolation is done over all location subsets at once via pd.DataFrame.groupby, and the row order of df is kept.
+
     Parameters
     ----------
         df : pd.DataFrame (default=None)
@@ -1014,42 +1212,53 @@ def interp_by_subset(df=None, depth=None, col_name="data", **kwargs):
 
             Note: this uses 'P150' (contains administrative territorial entity).
 
-        col_name : str
-            A column in df that is to be interpolated.
+        col_name : str or list (contains strs)
+            A column or columns in df that are to be interpolated.
 
     Returns
     -------
         df_interpolated : pd.DataFrame
-            The original df with the given column interpolated based on **kwargs.
+            The original df with the given column(s) interpolated based on **kwargs.
     """
-    df_interpolated = pd.DataFrame()
+    col_names = utils._make_var_list(col_name)[0]
+    lctn_cols = [c for c in lctn_utils.depth_to_cols(depth) if c in df.columns]
 
-    unique_lctns = list(df[lctn_utils.depth_to_col_name(depth)].unique())
+    df_interpolated = df.copy()
+    df_grouped = df_interpolated.groupby(lctn_cols, sort=False, dropna=False)[col_names]
 
-    if (
-        "method" in kwargs.keys()
-        and "limit_direction" in kwargs.keys()
-        and kwargs["method"] == "pad"
-        and kwargs["limit_direction"] == "both"
-    ):
-        for lctn in unique_lctns:
-            df_subset = df[df[lctn_utils.depth_to_col_name(depth)] == lctn].copy()
-            unique_val = [
-                val
-                for val in df_subset[col_name].unique()
-                if isinstance(val, str) or not np.isnan(val)
-            ][0]
+    method = kwargs.get("method", "linear")
+    limit_direction = kwargs.get("limit_direction", None)
+    limit = kwargs.get("limit", None)
 
-            df_subset[col_name] = [unique_val] * len(df_subset)
+    if method == "pad" and limit_direction == "both":
+        # Assign the first valid value of each location to all of its rows.
+        df_interpolated[col_names] = df_grouped.transform("first")
 
-            df_interpolated = df_interpolated.append(df_subset)
+    elif method in ["pad", "ffill"] and limit_direction in [None, "forward"]:
+        df_interpolated[col_names] = df_grouped.ffill(limit=limit)
 
-    else:
-        for lctn in unique_lctns:
-            df_subset = df[df[lctn_utils.depth_to_col_name(depth)] == lctn].copy()
-            df_subset.loc[:, col_name].interpolate(inplace=True, **kwargs)
+    elif method in ["backfill", "bfill"] and limit_direction in [None, "backward"]:
+        df_interpolated[col_names] = df_grouped.bfill(limit=limit)
 
-            df_interpolated = df_interpolated.append(df_subset)
+    elif (
+        method == "linear"
+        and set(kwargs.keys()) <= {"method", "limit_direction"}
+        and all(pd.api.types.is_numeric_dtype(df[c]) for c in col_names)
+    ):
+        group_ids = df_interpolated.groupby(
+            lctn_cols, sort=False, dropna=False
+        ).ngroup()
+        for col in col_names:
+            df_interpolated[col] = _interp_linear_by_group(
+                series=df_interpolated[col],
+                group_ids=group_ids,
+                limit_direction=limit_direction,
+            )
+
+    else:
+        df_interpolated[col_names] = df_grouped.transform(
+            lambda s: s.interpolate(**kwargs)
+        )
 
     return df_interpolated
 
@@ -1173,9 +1382,156 @@ def sum_df_prop_vals(
     return df_new
 
 
+def rollup_df_prop_vals(
+    df=None,
+    lctns_dict=None,
+    prop_cols=None,
+    time_col=None,
+    agg="sum",
+    weight_col=None,
+):
+    """
+    Aggregates property values of the deepest locations of a df to their parents at every depth.
+
+    Notes
+    -----
+        The parents of locations are derived from the sub_lctns of the given LocationsDict.
+
+        Each depth is aggregated over all parents and times at once, with coverage columns counting contributing locations.
+
+    Parameters
+    ----------
+        df : pd.DataFrame (default=None)
+            A df from wikirepo.data.query with a 'qid' column for its deepest locations.
+
+        lctns_dict : lctn_utils.LocationsDict (default=None)
+            The LocationsDict that df was queried for.
+
+        prop_cols : str or list (contains strs) (default=None)
+            The names of the numeric columns that should be aggregated.
+
+        time_col : str (default=None)
+            The name of the column in which times are defined.
+
+            Note: derived from the columns of df if None.
+
+        agg : str (default=sum)
+            How values should be aggregated: 'sum', 'mean' or 'weighted_mean'.
+
+        weight_col : str (default=None)
+            The name of the column of weights for agg='weighted_mean' (ex: 'population').
+
+    Returns
+    -------
+        df_rollup : pd.DataFrame
+            A df of aggregated values for all parent locations with the following further columns:
+                - depth: the depth of the parent location
+                - n_sub_lctns: the number of deepest locations under the parent
+                - {prop_col}_n_sub_lctns: the number of these locations that had data for prop_col
+    """
+    agg = utils.check_str_args(
+        arguments=agg, valid_args=["sum", "mean", "weighted_mean"]
+    )
+    if agg == "weighted_mean":
+        assert (
+            weight_col is not None
+        ), "A 'weight_col' must be provided for a 'weighted_mean' aggregation."
+
+    prop_cols = utils._make_var_list(prop_cols)[0]
+
+    if time_col is None:
+        time_cols = [
+            time_utils.interval_to_col_name(i)
+            for i in time_utils.incl_intervals()
+            if time_utils.interval_to_col_name(i) in df.columns
+        ]
+        time_col = time_cols[0] if time_cols else None
+    group_time_cols = [time_col] if time_col is not None else []
+
+    qid_paths = {}
+    qid_lbls = {}
+    for q, path, lbl in lctn_utils.iter_qid_paths(lctns_dict):
+        qid_paths[q] = path
+        qid_lbls[q] = lbl
+
+    df_leaves = df[df["qid"].isin(qid_paths.keys())].copy()
+    leaf_depth = max(len(qid_paths[q]) - 1 for q in df_leaves["qid"].unique())
+
+    df_vals = df_leaves[group_time_cols].copy()
+    for col in prop_cols:
+        df_vals[col] = pd.to_numeric(df_leaves[col], errors="coerce")
+        df_vals[f"{col}_n_sub_lctns"] = df_vals[col].notnull().astype(int)
+
+    if agg == "weighted_mean":
+        weights = pd.to_numeric(df_leaves[weight_col], errors="coerce")
+        for col in prop_cols:
+            df_vals[f"{col}_weight"] = weights.where(df_vals[col].notnull())
+            df_vals[col] = df_vals[col] * df_vals[f"{col}_weight"]
+
+    df_vals["n_sub_lctns"] = 1
+
+    n_cols = ["n_sub_lctns"] + [f"{col}_n_sub_lctns" for col in prop_cols]
+    weight_cols = [c for c in df_vals.columns if c.endswith("_weight")]
+
+    depth_dfs = []
+    for depth in range(leaf_depth - 1, -1, -1):
+        parent_qids = df_leaves["qid"].map(
+            {q: path[depth] for q, path in qid_paths.items() if len(path) > depth + 1}
+        )
+        df_grouped = df_vals.groupby(
+            [parent_qids.rename("qid")] + group_time_cols, sort=False
+        )
+
+        if agg == "mean":
+            df_depth = df_grouped[prop_cols].mean()
+
+        else:
+            df_depth = df_grouped[prop_cols].sum(min_count=1)
+
+        df_depth[n_cols + weight_cols] = df_grouped[n_cols + weight_cols].sum()
+
+        if agg == "weighted_mean":
+            for col in prop_cols:
+                df_depth[col] = df_depth[col] / df_depth[f"{col}_weight"].where(
+                    df_depth[f"{col}_weight"] != 0
+                )
+            df_depth.drop(weight_cols, axis=1, inplace=True)
+
+        df_depth.reset_index(inplace=True)
+        for d, lctn_col in enumerate(lctn_utils.depth_to_cols(depth=depth)):
+            df_depth.insert(
+                d,
+                lctn_col,
+                df_depth["qid"].map(
+                    {
+                        q: qid_lbls[path[d]]
+                        for q, path in qid_paths.items()
+                        if len(path) > d
+                    }
+                ),
+            )
+        df_depth.insert(len(lctn_utils.depth_to_cols(depth=depth)) + 1, "depth", depth)
+
+        depth_dfs.append(df_depth)
+
+    df_rollup = pd.concat(depth_dfs, ignore_index=True)
+
+    # Order columns such that location columns come first.
+    lctn_cols = lctn_utils.depth_to_cols(depth=max(leaf_depth - 1, 0))
+    df_rollup = df_rollup[
+        lctn_cols + [c for c in df_rollup.columns if c not in lctn_cols]
+    ]
+
+    return df_rollup
+
+
 def split_col_val_dates(df=None, col=None):
     """
-    Adds or subtracts values in a dataframe for given locations.
+    Splits values formatted as 'value (date)' into a value column and a date column.
+
+    Notes
+    -----
+        Most recent queries assign dates to their own columns, so this is needed only for legacy dfs.
 
     Parameters
     ----------
@@ -1191,25 +1547,28 @@ def split_col_val_dates(df=None, col=None):
             The dataframe post splitting the date from the values.
     """
     df_new = df.copy()
+    date_col = f"{col}_date"
 
-    col_index = df_new.columns.get_loc(col)
-    df_new[f"{col}_date"] = [
-        val.split(" (")[1] if val != np.nan else np.nan for val in df_new[col]
-    ]
-    df_new[col] = [
-        val.split(" (")[0] if val != np.nan else np.nan for val in df_new[col]
-    ]
+    vals_dates = (
+        df_new[col].astype("string").str.extract(r"^(?P<val>.*) \((?P<date>[^()]*)\)$")
+    )
+    has_date = vals_dates["date"].notnull()
 
-    df_new[f"{col}_date"] = [
-        d.replace(")", "") if d != np.nan else np.nan for d in df_new[f"{col}_date"]
-    ]
-    df_new[col] = [utils.round_if_int(utils.try_float(val)) for val in df_new[col]]
+    vals = df_new[col].astype(object).where(~has_date, vals_dates["val"].astype(object))
+    numeric = pd.to_numeric(vals, errors="coerce")
+    is_numeric = numeric.notnull()
+    vals[is_numeric] = numeric[is_numeric]
+    is_int = is_numeric & (numeric % 1 == 0)
+    vals[is_int] = [int(v) for v in numeric[is_int]]
+    df_new[col] = vals
 
-    cols = list(df_new.columns)
-    cols.pop(df_new.columns.get_loc(f"{col}_date"))
-    cols.insert(col_index + 1, f"{col}_date")
+    dates = vals_dates["date"].astype(object).where(has_date, np.nan)
+    if date_col in df_new.columns:
+        # Only fill dates for values that were still formatted.
+        df_new[date_col] = dates.where(has_date, df_new[date_col])
 
-    df_new = df_new[cols]
+    else:
+        df_new.insert(df_new.columns.get_loc(col) + 1, date_col, dates)
 
     return df_new
 
@@ -1240,3 +1599,76 @@ def count_df_prop_vals(df=None, col=None, percent=False):
         return df[col].value_counts().sort_index() / len(df)
     else:
         return df[col].value_counts().sort_index()
+
+
+def set_df_dtypes(df=None, depth=None, interval=None):
+    """
+    Converts the columns of a queried df to typed, memory efficient dtypes.
+
+    Notes
+    -----
+        Location, QID and time columns are made categorical, numeric columns nullable Int64 or Float64,
+        and most recent values formatted as 'value (date)' are split into a value and a datetime column.
+
+    Parameters
+    ----------
+        df : pd.DataFrame (default=None)
+            A df as returned by wikirepo.data.query.
+
+        depth : int (default=None)
+            The depth from the given lbls or qids that data should go.
+
+            Note: derived from the location columns of df if None.
+
+        interval : str (default=None)
+            The time interval over which queries were made.
+
+            Note: if None, then there is no time column to be converted.
+
+    Returns
+    -------
+        df_typed : pd.DataFrame
+            The df with typed columns.
+    """
+    df_typed = df.copy()
+
+    if depth is None:
+        depth = len([c for c in df_typed.columns if c in lctn_utils.depth_to_cols(10)])
+        depth = max(depth - 1, 0)
+
+    categorical_cols = lctn_utils.depth_to_cols(depth=depth) + ["qid"]
+    if interval is not None:
+        categorical_cols += [time_utils.interval_to_col_name(interval=interval)]
+
+    for col in [c for c in categorical_cols if c in df_typed.columns]:
+        df_typed[col] = df_typed[col].astype("category")
+
+    date_cols = [c for c in df_typed.columns if c.endswith("_date")]
+    for col in date_cols:
+        if df_typed[col].dtype.kind == "O":
+            df_typed[col] = pd.to_datetime(
+                df_typed[col].replace("no date", np.nan).astype(str), errors="coerce"
+            )
+
+    val_cols = [c for c in df_typed.columns if c not in categorical_cols + date_cols]
+    for col in val_cols:
+        if df_typed[col].dtype.kind == "O" and f"{col}_date" not in df_typed.columns:
+            vals_dates = (
+                df_typed[col]
+                .astype("string")
+                .str.extract(r"^(?P<val>.*) \((?P<date>\d{4}-\d{2}-\d{2}|no date)\)$")
+            )
+            if vals_dates["date"].notnull().sum() == df_typed[col].notnull().sum() > 0:
+                # All values are formatted as 'value (date)' most recent values.
+                df_typed[col] = vals_dates["val"].astype(object)
+                df_typed.insert(
+                    df_typed.columns.get_loc(col) + 1,
+                    f"{col}_date",
+                    pd.to_datetime(
+                        vals_dates["date"].replace("no date", np.nan), errors="coerce"
+                    ),
+                )
+
+        df_typed[col] = _to_typed_series(df_typed[col])
+
+    return df_typed
@@ -0,0 +1,787 @@
+"""
+Fetch Utilities
+---------------
+
+Transports through which Wikidata entities are fetched.
+
+All transports have get(pq_id) and get_many(pq_ids, props=None, languages=None) methods, with
+get_many returning the found entities indexed by id and filtered to props and languages.
+
+Contents
+    MaxlagError,
+    filter_ent_props,
+    get_sized,
+    fixture_path,
+    write_fixture,
+    read_fixture
+
+    ClientTransport Class
+        __init__,
+        __repr__,
+        get,
+        get_sized,
+        get_many
+
+    RecordTransport Class
+        __init__,
+        __repr__,
+        get,
+        get_sized,
+        get_many
+
+    ReplayTransport Class
+        __init__,
+        __repr__,
+        get,
+        get_sized,
+        get_many,
+        recorded_ids
+
+    PooledTransport Class
+        __init__,
+        __repr__,
+        _connect,
+        _request,
+        get,
+        get_sized,
+        get_many,
+        close
+
+    ScheduledTransport Class
+        __init__,
+        __repr__,
+        _acquire,
+        _retry_delay,
+        _call,
+        get,
+        get_sized,
+        get_many
+"""
+
+import gzip
+import http.client
+import io
+import json
+import os
+import queue
+import random
+import socket
+import threading
+import time
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode, urljoin, urlsplit
+from urllib.request import Request
+
+from wikidata.client import Client
+
+# The maximum number of ids per wbgetentities request.
+wbgetentities_batch_size = 50
+
+# HTTP status codes of requests that can succeed if they're retried.
+retry_codes = [429, 500, 502, 503, 504]
+
+# HTTP status codes of redirects that PooledTransport follows, and the number it follows per request.
+redirect_codes = [301, 302, 303, 307]
+max_redirects = 5
+
+
+class MaxlagError(Exception):
+    """
+    Raised when a request is refused because the Wikidata database replication lag exceeds maxlag.
+    """
+
+    def __init__(self, info, retry_after=None):
+        super(MaxlagError, self).__init__(info)
+        self.retry_after = retry_after
+
+
+def filter_ent_props(ent, props=None, languages=None):
+    """
+    Filters an entity to the given wbgetentities props and languages.
+    """
+    if props is None:
+        filtered = dict(ent)
+
+    else:
+        filtered = {k: ent[k] for k in ["type", "id"] if k in ent}
+        for prop in props:
+            if prop == "info":
+                for k in ["lastrevid", "modified"]:
+                    filtered[k] = ent.get(k)
+
+            elif prop in ent:
+                filtered[prop] = ent[prop]
+
+    if languages is not None:
+        for prop in ["labels", "descriptions", "aliases"]:
+            if prop in filtered:
+                filtered[prop] = {
+                    lang: v for lang, v in filtered[prop].items() if lang in languages
+                }
+
+    return filtered
+
+
+def get_sized(transport, pq_id):
+    """
+    Fetches an entity through a transport along with the number of bytes downloaded.
+
+    Note: the size is estimated from the entity's JSON for transports that don't have a get_sized method.
+    """
+    if hasattr(transport, "get_sized"):
+        return transport.get_sized(pq_id)
+
+    ent = transport.get(pq_id)
+
+    return ent, len(json.dumps(ent, separators=(",", ":")).encode("utf-8"))
+
+
+def fixture_path(fixture_dir, pq_id):
+    """
+    Derives the path of the recorded entity of a Wikidata id.
+    """
+    return os.path.join(fixture_dir, f"{pq_id}.json.gz")
+
+
+def write_fixture(fixture_dir, pq_id, ent):
+    """
+    Writes an entity to a fixture directory as gzipped JSON.
+    """
+    os.makedirs(fixture_dir, exist_ok=True)
+    # mtime=0 and sorted keys so that recording the same entity gives identical files.
+    with open(fixture_path(fixture_dir, pq_id), "wb") as f:
+        with gzip.GzipFile(fileobj=f, mode="wb", mtime=0) as gz:
+            gz.write(json.dumps(ent, sort_keys=True).encode("utf-8"))
+
+
+def read_fixture(fixture_dir, pq_id, sized=False):
+    """
+    Reads a recorded entity from a fixture directory, optionally along with its size in bytes.
+    """
+    with gzip.open(fixture_path(fixture_dir, pq_id), "rb") as gz:
+        raw = gz.read()
+
+    ent = json.loads(raw.decode("utf-8"))
+    if sized:
+        return ent, len(raw)
+
+    return ent
+
+
+class ClientTransport:
+    """
+    Fetches entities from Wikidata with a wikidata.client.Client.
+
+    Parameters
+    ----------
+        client : wikidata.client.Client (default=None: Client())
+            The client whose base_url and opener requests are made with.
+
+        maxlag : int (default=None)
+            The replication lag in seconds above which wbgetentities requests are refused (see fetch_utils.MaxlagError).
+
+    Notes
+    -----
+        This is the transport of wd_utils by default, wrapped in a ScheduledTransport.
+    """
+
+    def __init__(self, client=None, maxlag=None):
+        if client is None:
+            client = Client()
+
+        self.client = client
+        self.maxlag = maxlag
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.client.base_url!r})"
+
+    def get(self, pq_id):
+        """
+        Fetches the entity of a Wikidata id.
+        """
+        return self.get_sized(pq_id)[0]
+
+    def get_sized(self, pq_id):
+        """
+        Fetches the entity of a Wikidata id along with the number of bytes downloaded.
+
+        Note: the entity is None if the id is invalid, as with wikidata.client.Client.get.
+        """
+        url = urljoin(self.client.base_url, f"./wiki/Special:EntityData/{pq_id}.json")
+        # Headers are set per request, as the opener can be shared with other clients.
+        request = Request(url, headers={"User-Agent": self.client.user_agent})
+        try:
+            response = self.client.opener.open(request)
+
+        except HTTPError as e:
+            if e.code == 400 and b"Invalid ID" in e.read():
+                return None, 0
+
+            raise e
+
+        raw = response.read()
+        ents = json.loads(raw.decode("utf-8"))["entities"]
+        if pq_id not in ents:
+            # The id has been redirected to another entity.
+            pq_id = next(iter(ents))
+
+        return ents[pq_id], len(raw)
+
+    def get_many(self, pq_ids, props=None, languages=None):
+        """
+        Fetches the entities of a list of Wikidata ids in batched wbgetentities requests.
+
+        Parameters
+        ----------
+            pq_ids : list (contains strs)
+                Wikidata ids of the entities to fetch.
+
+            props : list (contains strs) (default=None: all)
+                The parts of the entities to fetch (ex: ['labels'], ['info']).
+
+            languages : list (contains strs) (default=None: all)
+                The languages of labels, descriptions and aliases to fetch.
+
+        Returns
+        -------
+            ents : dict
+                A dictionary of the found entities indexed by their ids.
+        """
+        pq_ids = list(pq_ids)
+
+        ents = {}
+        for i in range(0, len(pq_ids), wbgetentities_batch_size):
+            params = {
+                "action": "wbgetentities",
+                "ids": "|".join(pq_ids[i : i + wbgetentities_batch_size]),
+                "format": "json",
+            }
+            if props is not None:
+                params["props"] = "|".join(props)
+            if languages is not None:
+                params["languages"] = "|".join(languages)
+            if self.maxlag is not None:
+                params["maxlag"] = self.maxlag
+
+            result = self.client.request("./w/api.php?" + urlencode(params))
+            if "error" in result:
+                if result["error"].get("code") == "maxlag":
+                    raise MaxlagError(
+                        result["error"].get("info"),
+                        retry_after=result["error"].get("lag"),
+                    )
+
+                raise ValueError(f"wbgetentities failed: {result['error']}")
+
+            for pq_id, ent in result["entities"].items():
+                if "missing" not in ent:
+                    ents[pq_id] = ent
+
+        return ents
+
+
+class RecordTransport:
+    """
+    Fetches entities through another transport and records them to a fixture directory.
+
+    Parameters
+    ----------
+        fixture_dir : str
+            The directory to which entities are written as '{id}.json.gz'.
+
+        transport : optional (default=None: ClientTransport())
+            The transport that entities are fetched with.
+    """
+
+    def __init__(self, fixture_dir, transport=None):
+        if transport is None:
+            transport = ClientTransport()
+
+        self.fixture_dir = fixture_dir
+        self.transport = transport
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.fixture_dir!r}, {self.transport!r})"
+
+    def get(self, pq_id):
+        """
+        Fetches and records the entity of a Wikidata id.
+        """
+        return self.get_sized(pq_id)[0]
+
+    def get_sized(self, pq_id):
+        """
+        Fetches and records the entity of a Wikidata id along with its size in bytes.
+        """
+        ent, n_bytes = get_sized(self.transport, pq_id)
+        write_fixture(self.fixture_dir, pq_id, ent)
+
+        return ent, n_bytes
+
+    def get_many(self, pq_ids, props=None, languages=None):
+        """
+        Fetches and records the entities of a list of Wikidata ids.
+
+        Note: partial entities from props or languages are fetched as full entities so that they can be recorded.
+        """
+        ents = self.transport.get_many(pq_ids)
+        for pq_id, ent in ents.items():
+            write_fixture(self.fixture_dir, pq_id, ent)
+
+        return {
+            pq_id: filter_ent_props(ent, props=props, languages=languages)
+            for pq_id, ent in ents.items()
+        }
+
+
+class ReplayTransport:
+    """
+    Loads entities deterministically from a fixture directory without network access.
+
+    Parameters
+    ----------
+        fixture_dir : str
+            A directory of entities recorded with RecordTransport.
+    """
+
+    def __init__(self, fixture_dir):
+        self.fixture_dir = fixture_dir
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.fixture_dir!r})"
+
+    def get(self, pq_id):
+        """
+        Loads the recorded entity of a Wikidata id.
+        """
+        return self.get_sized(pq_id)[0]
+
+    def get_sized(self, pq_id):
+        """
+        Loads the recorded entity of a Wikidata id along with its uncompressed size in bytes.
+        """
+        try:
+            return read_fixture(self.fixture_dir, pq_id, sized=True)
+
+        except FileNotFoundError:
+            raise FileNotFoundError(
+                f"'{pq_id}' has not been recorded in {self.fixture_dir}. Please record it with fetch_utils.RecordTransport, such as via 'WIKIREPO_FIXTURES=record pytest tests'."
+            )
+
+    def get_many(self, pq_ids, props=None, languages=None):
+        """
+        Loads the recorded entities of a list of Wikidata ids, filtered to props and languages.
+        """
+        return {
+            pq_id: filter_ent_props(self.get(pq_id), props=props, languages=languages)
+            for pq_id in pq_ids
+        }
+
+    def recorded_ids(self):
+        """
+        Provides a list of all Wikidata ids that have been recorded.
+        """
+        if not os.path.isdir(self.fixture_dir):
+            return []
+
+        return sorted(
+            f[: -len(".json.gz")]
+            for f in os.listdir(self.fixture_dir)
+            if f.endswith(".json.gz")
+        )
+
+
+class PooledTransport:
+    """
+    Fetches entities from Wikidata over a pool of persistent (keep-alive) connections with gzip transfer.
+
+    Parameters
+    ----------
+        base_url : str (default=https://www.wikidata.org/)
+            The URL of the Wikibase instance.
+
+        pool_size : int (default=10)
+            The maximum number of idle connections that are kept open for reuse.
+
+        timeout : float (default=30.0)
+            Seconds to wait for a connection or response.
+
+        maxlag : int (default=None)
+            The replication lag in seconds above which wbgetentities requests are refused (see fetch_utils.MaxlagError).
+
+        user_agent : str (default=None: that of wikidata.client.Client)
+            The User-Agent header of requests.
+
+    Notes
+    -----
+        Connections are created as needed, so more than pool_size requests can be made at once.
+
+        Redirects (ex: of entities that have been merged) are followed up to fetch_utils.max_redirects
+        times, with connections to other hosts not being pooled.
+    """
+
+    def __init__(
+        self,
+        base_url="https://www.wikidata.org/",
+        pool_size=10,
+        timeout=30.0,
+        maxlag=None,
+        user_agent=None,
+    ):
+        if user_agent is None:
+            user_agent = Client().user_agent
+
+        self.base_url = base_url
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.maxlag = maxlag
+        self.user_agent = user_agent
+        self.n_connections = 0
+
+        parts = urlsplit(base_url)
+        self._scheme = parts.scheme
+        self._netloc = parts.netloc
+        self._path_prefix = parts.path.rstrip("/")
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return (
+            f"{self.__class__.__name__}({self.base_url!r}, pool_size={self.pool_size})"
+        )
+
+    def _connect(self, scheme, netloc):
+        """
+        Takes an idle connection from the pool or opens a new one, with those to other hosts always being new.
+        """
+        pooled = (scheme, netloc) == (self._scheme, self._netloc)
+        if pooled:
+            try:
+                return self._pool.get_nowait(), True, pooled
+
+            except queue.Empty:
+                pass
+
+        with self._lock:
+            self.n_connections += 1
+
+        conn_cls = (
+            http.client.HTTPSConnection
+            if scheme == "https"
+            else http.client.HTTPConnection
+        )
+
+        return conn_cls(netloc, timeout=self.timeout), False, pooled
+
+    def _request(self, path):
+        """
+        Makes a GET request that follows redirects, returning the decompressed body and the number of bytes downloaded.
+
+        Note: requests on reused connections that the server has closed are retried once on a new connection.
+        """
+        url = f"{self._scheme}://{self._netloc}{self._path_prefix}{path}"
+        headers = {
+            "User-Agent": self.user_agent,
+            "Accept-Encoding": "gzip",
+            "Connection": "keep-alive",
+        }
+        n_bytes = 0
+        for _ in range(max_redirects + 1):
+            parts = urlsplit(url)
+            target = parts.path + (f"?{parts.query}" if parts.query else "")
+            while True:
+                conn, reused, pooled = self._connect(parts.scheme, parts.netloc)
+                try:
+                    conn.request("GET", target, headers=headers)
+                    response = conn.getresponse()
+                    raw = response.read()
+                    break
+
+                except (http.client.HTTPException, OSError) as e:
+                    conn.close()
+                    if not reused:
+                        raise URLError(e)
+
+            if response.will_close or not pooled:
+                conn.close()
+            else:
+                try:
+                    self._pool.put_nowait(conn)
+                except queue.Full:
+                    conn.close()
+
+            n_bytes += len(raw)
+            location = response.getheader("Location")
+            if response.status not in redirect_codes or location is None:
+                break
+
+            url = urljoin(url, location)
+
+        if response.getheader("Content-Encoding") == "gzip":
+            raw = gzip.decompress(raw)
+
+        if response.status != 200:
+            raise HTTPError(
+                url,
+                response.status,
+                response.reason,
+                response.msg,
+                io.BytesIO(raw),
+            )
+
+        return raw, n_bytes
+
+    def get(self, pq_id):
+        """
+        Fetches the entity of a Wikidata id.
+        """
+        return self.get_sized(pq_id)[0]
+
+    def get_sized(self, pq_id):
+        """
+        Fetches the entity of a Wikidata id along with the number of (compressed) bytes downloaded.
+
+        Note: the entity is None if the id is invalid, as with wikidata.client.Client.get.
+        """
+        try:
+            raw, n_bytes = self._request(f"/wiki/Special:EntityData/{pq_id}.json")
+
+        except HTTPError as e:
+            if e.code == 400 and b"Invalid ID" in e.read():
+                return None, 0
+
+            raise e
+
+        ents = json.loads(raw.decode("utf-8"))["entities"]
+        if pq_id not in ents:
+            # The id has been redirected to another entity.
+            pq_id = next(iter(ents))
+
+        return ents[pq_id], n_bytes
+
+    def get_many(self, pq_ids, props=None, languages=None):
+        """
+        Fetches the entities of a list of Wikidata ids in batched wbgetentities requests.
+
+        Note: see ClientTransport.get_many for the parameters.
+        """
+        pq_ids = list(pq_ids)
+
+        ents = {}
+        for i in range(0, len(pq_ids), wbgetentities_batch_size):
+            params = {
+                "action": "wbgetentities",
+                "ids": "|".join(pq_ids[i : i + wbgetentities_batch_size]),
+                "format": "json",
+            }
+            if props is not None:
+                params["props"] = "|".join(props)
+            if languages is not None:
+                params["languages"] = "|".join(languages)
+            if self.maxlag is not None:
+                params["maxlag"] = self.maxlag
+
+            raw, _ = self._request("/w/api.php?" + urlencode(params))
+            result = json.loads(raw.decode("utf-8"))
+            if "error" in result:
+                if result["error"].get("code") == "maxlag":
+                    raise MaxlagError(
+                        result["error"].get("info"),
+                        retry_after=result["error"].get("lag"),
+                    )
+
+                raise ValueError(f"wbgetentities failed: {result['error']}")
+
+            for pq_id, ent in result["entities"].items():
+                if "missing" not in ent:
+                    ents[pq_id] = ent
+
+        return ents
+
+    def close(self):
+        """
+        Closes all idle connections.
+        """
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class ScheduledTransport:
+    """
+    Schedules the requests of another transport with rate limiting and retries.
+
+    Parameters
+    ----------
+        transport : optional (default=None: ClientTransport())
+            The transport that requests are made with.
+
+        rate : float (default=10.0)
+            The sustained number of requests per second, with None for no limit.
+
+        burst : int (default=10)
+            The number of requests that can be made at once before rate applies (the token bucket size).
+
+        max_retries : int (default=5)
+            The number of times a failed request is retried before its error is raised.
+
+        backoff : float (default=1.0)
+            The delay in seconds before the first retry, which doubles for each further retry.
+
+        max_backoff : float (default=60.0)
+            The maximum delay before a retry.
+
+        seed : int (default=None)
+            The seed for the jitter of delays.
+
+    Notes
+    -----
+        Requests that fail with a status in fetch_utils.retry_codes, a dropped connection, a timeout or a
+        fetch_utils.MaxlagError are retried after a random delay of up to the backoff, or after
+        Retry-After (or the reported lag) if that's longer.
+    """
+
+    def __init__(
+        self,
+        transport=None,
+        rate=10.0,
+        burst=10,
+        max_retries=5,
+        backoff=1.0,
+        max_backoff=60.0,
+        seed=None,
+    ):
+        if transport is None:
+            transport = ClientTransport()
+
+        self.transport = transport
+        self.rate = rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self.n_requests = 0
+        self.n_retries = 0
+        self.wait_time_s = 0.0
+
+        self._tokens = float(burst)
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.transport!r}, rate={self.rate})"
+
+    def _acquire(self):
+        """
+        Waits for a token of the bucket.
+        """
+        if self.rate is None:
+            return
+
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._last_refill) * self.rate
+            )
+            self._last_refill = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+            self.wait_time_s += wait
+
+        if wait:
+            time.sleep(wait)
+
+    def _retry_delay(self, attempt, error):
+        """
+        Derives the delay before a retry given the number of attempts and the error.
+        """
+        delay = self._rng.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+
+        retry_after = None
+        if isinstance(error, MaxlagError):
+            retry_after = error.retry_after
+        elif isinstance(error, HTTPError) and error.headers is not None:
+            retry_after = error.headers.get("Retry-After")
+
+        try:
+            delay = max(delay, float(retry_after))
+        except (TypeError, ValueError):
+            pass  # Retry-After can also be an HTTP date, in which case the backoff is used
+
+        return min(delay, self.max_backoff)
+
+    def _call(self, fxn, *args, **kwargs):
+        """
+        Calls a method of the transport, retrying it if it fails with a retryable error.
+        """
+        for attempt in range(self.max_retries + 1):
+            self._acquire()
+            with self._lock:
+                self.n_requests += 1
+
+            try:
+                return fxn(*args, **kwargs)
+
+            # socket.timeout is only an alias of TimeoutError as of Python 3.10.
+            except (
+                URLError,
+                ConnectionError,
+                TimeoutError,
+                socket.timeout,
+                MaxlagError,
+            ) as e:
+                if isinstance(e, HTTPError):
+                    retryable = e.code in retry_codes
+                elif isinstance(e, URLError):
+                    # Dropped connections and timeouts, but not failures to resolve hosts.
+                    retryable = isinstance(
+                        e.reason, (ConnectionError, TimeoutError, socket.timeout)
+                    )
+                else:
+                    retryable = True
+
+                if not retryable or attempt == self.max_retries:
+                    raise e
+
+                with self._lock:
+                    delay = self._retry_delay(attempt, e)
+                    self.n_retries += 1
+                    self.wait_time_s += delay
+
+                time.sleep(delay)
+
+    def get(self, pq_id):
+        """
+        Fetches the entity of a Wikidata id.
+        """
+        return self.get_sized(pq_id)[0]
+
+    def get_sized(self, pq_id):
+        """
+        Fetches the entity of a Wikidata id along with the number of bytes downloaded.
+        """
+        return self._call(get_sized, self.transport, pq_id)
+
+    def get_many(self, pq_ids, props=None, languages=None):
+        """
+        Fetches the entities of a list of Wikidata ids, with each batch being scheduled.
+        """
+        pq_ids = list(pq_ids)
+
+        ents = {}
+        for i in range(0, len(pq_ids), wbgetentities_batch_size):
+            ents.update(
+                self._call(
+                    self.transport.get_many,
+                    pq_ids[i : i + wbgetentities_batch_size],
+                    props=props,
+                    languages=languages,
+                )
+            )
+
+        return ents
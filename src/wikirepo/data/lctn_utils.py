@@ -21,7 +21,8 @@
     gen_lctns_dict,
     derive_depth,
     merge_lctn_dicts,
-    find_key_items
+    find_key_items,
+    iter_qid_paths
 
     LocationsDict Class
         __init__,
@@ -32,13 +33,14 @@
         iter_key_items,
         iter_set,
         get_qids_at_depth,
+        get_qid_paths,
         _print
 """
 
 from pandas.core.common import flatten
 from tqdm.auto import tqdm
 from wikirepo import utils
-from wikirepo.data import wd_utils
+from wikirepo.data import coverage_utils, wd_utils
 
 
 def lctn_to_qid_dict():
@@ -893,6 +895,8 @@ def assign_another_iteration(
         sub_lctns = utils._make_var_list(sub_lctns)[0]
 
         depth_keys = get_qids_at_depth(lctns_dict=lctns_dict, depth=current_depth)
+        # Sub-location labels are resolved in one batch, with entities only being loaded for further depths.
+        wd_utils.prefetch_prop_lbls(ents_dict=ents_dict, qids=depth_keys, pid=pid)
 
         if interval == None:
             # Assuming that the user wants the current sub-locations.
@@ -932,11 +936,8 @@ def get_most_frequent_dict(ents_dict, lctns_dict, qid, pid):
                     }
 
                 else:
-                    wd_utils.print_not_available(
-                        ents_dict=ents_dict,
-                        qid=qid,
-                        pid=pid,
-                        extra_msg=" to derive sub_lctns",
+                    coverage_utils.record_missing(
+                        qid=qid, pid=pid, reason="missing_sub_lctns"
                     )
                     subs_info = {}
 
@@ -986,11 +987,8 @@ def get_valid_timespan_dict(ents_dict, lctns_dict, qid, pid):
                     }
 
                 else:
-                    wd_utils.print_not_available(
-                        ents_dict=ents_dict,
-                        qid=qid,
-                        pid=pid,
-                        extra_msg=" to derive sub_lctns",
+                    coverage_utils.record_missing(
+                        qid=qid, pid=pid, reason="missing_sub_lctns"
                     )
                     subs_info = {}
 
@@ -1100,6 +1098,22 @@ def iter_key_items(node, kv):
             yield from iter_key_items(j, kv)
 
 
+def iter_qid_paths(lctns_dict, path=None):
+    """
+    Finds the QIDs of a LocationsDict along with the QIDs of their parents and their labels.
+
+    Notes
+    -----
+        Yields tuples of (qid, [depth 0 qid, ..., qid], lbl).
+    """
+    path = path or []
+    for k, v in lctns_dict.items():
+        if wd_utils.is_wd_id(k) and isinstance(v, dict):
+            yield (k, path + [k], v.get("lbl"))
+            if isinstance(v.get("sub_lctns"), dict):
+                yield from iter_qid_paths(v["sub_lctns"], path=path + [k])
+
+
 class LocationsDict(dict):
     """
     A dictionary for storing WikiData locations.
@@ -1137,6 +1151,7 @@ def __str__(self):
         iter_set - finds and sets a key
         get_qids_at_depth - finds all QIDs at a given depth
         key_lbls_at_depth - the key labels at a given depth
+        get_qid_paths - the QIDs of all parents for each QID
         _print - prints the full LocationsDict
     """
 
@@ -1209,6 +1224,12 @@ def key_lbls_at_depth(self, ents_dict, depth):
 
         return [wd_utils.get_lbl(ents_dict=ents_dict, pq_id=q) for q in qids_at_depth]
 
+    def get_qid_paths(self):
+        """
+        Provides a dictionary of QIDs and the list of QIDs from depth 0 down to them.
+        """
+        return {q: path for q, path, _ in iter_qid_paths(self)}
+
     def _print(self):
         """
         Prints the full LocationsDict.
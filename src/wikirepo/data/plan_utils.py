@@ -0,0 +1,567 @@
+"""
+Plan Utilities
+--------------
+
+Planning of the entities that a query requires before data is extracted.
+
+A plan resolves the locations of a query, collects the properties of all queried modules, and finds
+the topic pages and values whose labels are needed, with each being deduplicated across directories.
+Executing a plan fetches the entities in batches so that extraction only reads from ents_dict.
+
+The costs of queries can also be estimated from their plans without extracting data.
+
+Contents
+    _time_points,
+    _claims_ent,
+    _claims_hashes,
+    _dir_indexes,
+    _count_lctns,
+    plan_query,
+    resolve_plan,
+    execute_plan,
+    estimate_query
+
+    QueryPlan Class
+        __init__,
+        __repr__,
+        __str__,
+        explain
+"""
+
+import hashlib
+import json
+import math
+
+from wikirepo import utils
+from wikirepo.data import (
+    data_utils,
+    fetch_utils,
+    lctn_utils,
+    prof_utils,
+    sparql_utils,
+    time_utils,
+    wd_utils,
+)
+
+# Defaults for estimates when ents_dict hasn't recorded any fetches: the seconds per entity of batched
+# fetches, the bytes of a location entity, the bytes of a df cell, and the seconds to assign a cell.
+default_fetch_latency_s = 0.05
+default_ent_bytes = 200000
+default_cell_bytes = 64
+default_cell_time_s = 2e-5
+
+
+class QueryPlan(dict):
+    """
+    A dictionary of the entities that a query requires.
+
+    Notes
+    -----
+        Keys are:
+            qids : the QIDs of the queried locations
+            props : the (index, pid, sub_pid) of each queried module indexed by directory
+            pids : the properties that are queried
+            topic_qids : the QIDs of topic pages that have properties locations don't have
+            deps : the QIDs of the location and topic pages that the rows of each location are derived from
+            val_qids : the QIDs of values whose labels are needed
+            n_unresolved : the number of entities that aren't loaded, and so whose requirements are unknown
+            n_fetches : the number of entities and labels that need to be fetched by kind
+            n_rows : the estimated number of rows of the query's df
+    """
+
+    __slots__ = ()
+
+    def __init__(self, *args, **kwargs):
+        super(QueryPlan, self).__init__(*args, **kwargs)
+
+    def __repr__(self):
+        return "%s" % self.__class__
+
+    def __str__(self):
+        return self.explain()
+
+    def explain(self):
+        """
+        Describes the plan with the estimated number of fetches, batches and rows.
+        """
+        batch_size = fetch_utils.wbgetentities_batch_size
+        lines = ["Query plan"]
+        for dir_name, props in self["props"].items():
+            lines.append(
+                f"  {dir_name}: "
+                + ", ".join(
+                    (
+                        f"{idx} ({pid}{'/' + sub_pid if isinstance(sub_pid, str) else ''})"
+                        if pid is not None
+                        else f"{idx} (no property)"
+                    )
+                    for idx, pid, sub_pid in props
+                )
+            )
+
+        lines += [
+            f"  locations: {len(self['qids'])}",
+            f"  properties: {len(self['pids'])} ({', '.join(self['pids'])})",
+            f"  topic pages: {len(self['topic_qids'])}",
+            f"  value labels: {len(self['val_qids'])}",
+        ]
+        for kind, n in self["n_fetches"].items():
+            lines.append(
+                f"  fetches of {kind}: {n} in {math.ceil(n / batch_size)} batch(es)"
+            )
+
+        if self["n_unresolved"]:
+            lines.append(
+                f"  unresolved: {self['n_unresolved']} entities aren't loaded, so topic pages and value labels are lower bounds"
+            )
+
+        lines.append(f"  estimated rows: {self['n_rows']}")
+
+        return "\n".join(lines)
+
+
+def _time_points(timespan=None, interval=None):
+    """
+    Returns the number of time points that each location has a row for.
+    """
+    if interval is None:
+        return 1
+
+    return len(time_utils.make_timespan(timespan=timespan, interval=interval))
+
+
+def _claims_ent(ents_dict, qid, dir_name, pid):
+    """
+    Returns the id of the entity whose claims of pid are used for a location, with None if it's unknown.
+
+    Note: this mirrors wd_utils.check_for_pid_topic_page without fetching entities.
+    """
+    if qid not in ents_dict:
+        return
+
+    claims = ents_dict[qid]["claims"]
+    if pid in claims or dir_name not in wd_utils.topic_pids:
+        return qid
+
+    topic_claims = claims.get(wd_utils.topic_pids[dir_name])
+    if not topic_claims:
+        return qid
+
+    return topic_claims[0]["mainsnak"]["datavalue"]["value"]["id"]
+
+
+def _claims_hashes(ents_dict, qids, props):
+    """
+    Returns the id of the entity whose claims each module uses for each location along with a hash of the claims.
+
+    Note: modules are indexed by 'dir_name.index', with hashes being None for modules without a single
+    property and for entities that aren't loaded.
+    """
+    claims_hashes = {}  # indexed by (entity id, pid) as topic pages are shared
+    hashes = {}
+    for q in qids:
+        hashes[q] = {}
+        for dir_name, dir_props in props.items():
+            for idx, pid, _ in dir_props:
+                claims_qid = None
+                if pid is not None:
+                    claims_qid = _claims_ent(ents_dict, q, dir_name, pid)
+
+                if (
+                    claims_qid is not None
+                    and claims_qid in ents_dict
+                    and (claims_qid, pid) not in claims_hashes
+                ):
+                    claims = ents_dict[claims_qid]["claims"].get(pid, [])
+                    claims_hashes[(claims_qid, pid)] = hashlib.sha1(
+                        json.dumps(claims, sort_keys=True).encode("utf-8")
+                    ).hexdigest()
+
+                hashes[q][f"{dir_name}.{idx}"] = [
+                    claims_qid,
+                    claims_hashes.get((claims_qid, pid)),
+                ]
+
+    return hashes
+
+
+def _dir_indexes(props_args):
+    """
+    Converts the directory arguments of a query into the indexes to query indexed by directory.
+    """
+    dir_indexes = {}
+    for arg, indexes in props_args.items():
+        if indexes is None or indexes == False:
+            continue
+
+        dir_indexes[data_utils._props_arg_to_dir(arg)] = (
+            None if indexes == True else utils._make_var_list(indexes)[0]
+        )
+
+    return dir_indexes
+
+
+def _count_lctns(ents_dict, qids, depth):
+    """
+    Finds the QIDs of locations at each depth from their 'P150' claims, with only the 'P150' values of those that aren't loaded being queried.
+
+    Note: entities in ents_dict (including those of its store) are used without being fetched, and the
+    values of others are queried with sparql_utils.fetch_prop_vals so that their full claims aren't downloaded.
+
+    Returns
+    -------
+        depth_qids, n_requests : list (contains lists), int
+            The QIDs at each depth, and the number of requests that were made.
+    """
+    depth_qids = [list(dict.fromkeys(qids))]
+    n_requests = 0
+    for _ in range(depth):
+        parent_qids = depth_qids[-1]
+        qids_to_query = [q for q in parent_qids if q not in ents_dict]
+        queried_sub_qids = {}
+        if qids_to_query:
+            n_scheduled = sparql_utils.scheduler.n_requests
+            prop_vals = sparql_utils.fetch_prop_vals(pid="P150", qids=qids_to_query)
+            n_requests += sparql_utils.scheduler.n_requests - n_scheduled
+            for q, val in zip(prop_vals["qid"], prop_vals["value"]):
+                if isinstance(val, dict) and "id" in val:
+                    queried_sub_qids.setdefault(q, []).append(val["id"])
+
+        sub_qids = []
+        for q in parent_qids:
+            if q in queried_sub_qids:
+                sub_qids += queried_sub_qids[q]
+
+            elif q in ents_dict and ents_dict[q] is not None:
+                for claim in ents_dict[q].get("claims", {}).get("P150", []):
+                    val = claim["mainsnak"].get("datavalue", {}).get("value")
+                    if isinstance(val, dict) and "id" in val:
+                        sub_qids.append(val["id"])
+
+        depth_qids.append(list(dict.fromkeys(sub_qids)))
+
+    return depth_qids, n_requests
+
+
+def plan_query(
+    ents_dict=None,
+    locations=None,
+    depth=None,
+    timespan=None,
+    interval=None,
+    dir_indexes=None,
+):
+    """
+    Plans the entities that a query requires without fetching any.
+
+    Parameters
+    ----------
+        ents_dict : wd_utils.EntitiesDict (default=None)
+            A dictionary with keys being Wikidata QIDs and values being their entities.
+
+        locations : str, list, or lctn_utils.LocationsDict (contains strs) : optional (default=None)
+            The locations to query.
+
+        depth : int (default=None)
+            The depth from the given lbls or qids that data should go.
+
+        timespan : two element tuple or list : contains datetime.date or tuple (default=None: (date.today(), date.today()))
+            A tuple or list that defines the start and end dates to be queried.
+
+        interval : str (default=None)
+            The time interval over which queries will be made.
+
+        dir_indexes : dict (default=None)
+            The indexes to query indexed by directory, with None for all indexes of a directory.
+
+    Returns
+    -------
+        plan : plan_utils.QueryPlan
+            The entities that the query requires.
+    """
+    if ents_dict is None:
+        ents_dict = wd_utils.EntitiesDict()
+
+    qids = [q for q in data_utils._lctns_to_qids(locations, depth) if q != "nan"]
+    props = {
+        dir_name: data_utils.incl_dir_props(dir_name=dir_name, indexes=indexes)
+        for dir_name, indexes in (dir_indexes or {}).items()
+    }
+    pids = list(
+        dict.fromkeys(pid for dir_props in props.values() for _, pid, _ in dir_props)
+    )
+
+    plan = QueryPlan(
+        qids=list(dict.fromkeys(qids)),
+        props=props,
+        pids=[pid for pid in pids if pid is not None],
+        n_rows=len(qids) * _time_points(timespan=timespan, interval=interval),
+    )
+
+    return resolve_plan(plan, ents_dict)
+
+
+def resolve_plan(plan, ents_dict):
+    """
+    Finds the topic pages and value labels that a plan requires given the loaded entities.
+
+    Note: entities and labels that aren't loaded are counted in plan['n_fetches'].
+    """
+    dir_pids = [
+        (dir_name, pid, sub_pid)
+        for dir_name, dir_props in plan["props"].items()
+        for _, pid, sub_pid in dir_props
+        if pid is not None
+    ]
+
+    topic_qids = []
+    deps = {q: [q] for q in plan["qids"]}
+    claims_ents = []  # (entity id, pid, sub_pid) of claims whose values are needed
+    for q in plan["qids"]:
+        for dir_name, pid, sub_pid in dir_pids:
+            claims_qid = _claims_ent(ents_dict, q, dir_name, pid)
+            if claims_qid is not None:
+                if claims_qid != q:
+                    topic_qids.append(claims_qid)
+                    if claims_qid not in deps[q]:
+                        deps[q].append(claims_qid)
+
+                claims_ents.append((claims_qid, pid, sub_pid))
+
+    val_qids = []
+    for claims_qid, pid, sub_pid in dict.fromkeys(claims_ents):
+        if claims_qid not in ents_dict:
+            continue
+
+        for claim in ents_dict[claims_qid]["claims"].get(pid, []):
+            snaks = [claim["mainsnak"]]
+            if isinstance(sub_pid, str):
+                snaks += claim.get("qualifiers", {}).get(sub_pid, [])
+
+            for snak in snaks:
+                val = snak.get("datavalue", {}).get("value")
+                if isinstance(val, dict) and "id" in val:
+                    val_qids.append(val["id"])
+
+    plan["topic_qids"] = list(dict.fromkeys(topic_qids))
+    plan["deps"] = deps
+    plan["val_qids"] = list(dict.fromkeys(val_qids))
+    plan["n_unresolved"] = len(
+        [q for q in plan["qids"] + plan["topic_qids"] if q not in ents_dict]
+    )
+    plan["n_fetches"] = {
+        "locations": len([q for q in plan["qids"] if q not in ents_dict]),
+        "topic pages": len([q for q in plan["topic_qids"] if q not in ents_dict]),
+        "labels": len(
+            [
+                q
+                for q in plan["val_qids"]
+                if q not in ents_dict and q not in wd_utils.lbls_dict
+            ]
+        ),
+    }
+
+    return plan
+
+
+def execute_plan(plan, ents_dict):
+    """
+    Fetches the entities and labels that a plan requires in batches, resolving the plan as it goes.
+
+    Parameters
+    ----------
+        plan : plan_utils.QueryPlan
+            A plan from plan_utils.plan_query.
+
+        ents_dict : wd_utils.EntitiesDict
+            A dictionary to which fetched entities are added.
+
+    Returns
+    -------
+        plan : plan_utils.QueryPlan
+            The plan with its requirements fully resolved.
+    """
+    with prof_utils.stage("plan") as plan_stage:
+        wd_utils.load_ents(ents_dict, plan["qids"])
+        resolve_plan(plan, ents_dict)
+
+        # Topic pages are only known once the locations are loaded.
+        wd_utils.load_ents(ents_dict, plan["topic_qids"])
+        resolve_plan(plan, ents_dict)
+
+        wd_utils.resolve_lbls(plan["val_qids"], ents_dict=ents_dict)
+        plan_stage.rows = len(plan["qids"]) + len(plan["topic_qids"])
+
+    return plan
+
+
+def estimate_query(
+    ents_dict=None,
+    locations=None,
+    depth=None,
+    timespan=None,
+    interval=None,
+    climate_props=None,
+    demographic_props=None,
+    economic_props=None,
+    electoral_poll_props=None,
+    electoral_result_props=None,
+    geographic_props=None,
+    institutional_props=None,
+    political_props=None,
+    misc_props=None,
+    fetch_latency_s=None,
+):
+    """
+    Estimates the rows, entity fetches, memory and wall time of a query without extracting data.
+
+    Notes
+    -----
+        Locations below depth 0 are counted from a lctn_utils.LocationsDict, or otherwise from the
+        'P150' (contains administrative territorial entity) claims of the locations above them, with
+        only the 'P150' values of those that aren't in ents_dict being queried via SPARQL (see sparql_utils.set_endpoint).
+
+        Topic pages are upper bounds for locations that aren't loaded, and value labels are only
+        counted for those that are.
+
+    Parameters
+    ----------
+        ents_dict : wd_utils.EntitiesDict : optional (default=None)
+            A dictionary with keys being Wikidata QIDs and values being their entities.
+
+            Note: its recorded fetches are used for the latency and size of entities.
+
+        locations : str, list, or lctn_utils.LocationsDict (contains strs) : optional (default=None)
+            The locations to query either as strings for indexed locations or Wikidata QIDs.
+
+        depth : int (default=None)
+            The depth from the given lbls or qids that data should go.
+
+        timespan : two element tuple or list : contains datetime.date or tuple (default=None: (date.today(), date.today()))
+            A tuple or list that defines the start and end dates to be queried.
+
+        interval : str (default=None)
+            The time interval over which queries will be made.
+
+        climate_props, ..., misc_props : str or list (contains strs) : optional (default=None)
+            The modules of each directory to query, as for wikirepo.data.query.
+
+        fetch_latency_s : float (default=None: that recorded by ents_dict, or plan_utils.default_fetch_latency_s)
+            The seconds per entity of fetches.
+
+    Returns
+    -------
+        estimate : dict
+            n_locations, n_times, n_rows : the locations at depth, time points and rows of the df
+            n_fetches : the number of entities and labels to fetch by kind, with 'hierarchy' being for lctn_utils.gen_lctns_dict
+            n_requests : the requests that the fetches would be made in
+            n_count_requests : the SPARQL requests that were made to count locations
+            memory_mb : the approximate memory of the df and fetched entities
+            wall_s : the approximate time of the fetches and of assigning values
+    """
+    if ents_dict is None:
+        ents_dict = wd_utils.EntitiesDict()
+
+    if isinstance(locations, str):
+        locations = [locations]
+
+    if isinstance(locations, dict):
+        if depth is None:
+            depth = lctn_utils.derive_depth(locations, depth=0)
+        depth_qids = [
+            lctn_utils.get_qids_at_depth(lctns_dict=locations, depth=d)
+            for d in range(depth + 1)
+        ]
+        # The hierarchy has already been built.
+        hierarchy_qids = []
+        n_count_requests = 0
+
+    else:
+        depth = depth or 0
+        depth_qids, n_count_requests = _count_lctns(
+            ents_dict=ents_dict,
+            qids=data_utils._lctns_to_qids(locations=locations, depth=0),
+            depth=depth,
+        )
+        hierarchy_qids = [q for qids in depth_qids[:-1] for q in qids]
+
+    dir_indexes = _dir_indexes(
+        dict(
+            climate_props=climate_props,
+            demographic_props=demographic_props,
+            economic_props=economic_props,
+            electoral_poll_props=electoral_poll_props,
+            electoral_result_props=electoral_result_props,
+            geographic_props=geographic_props,
+            institutional_props=institutional_props,
+            political_props=political_props,
+            misc_props=misc_props,
+        )
+    )
+    plan = plan_query(
+        ents_dict=ents_dict,
+        locations=depth_qids[-1],
+        depth=0,
+        timespan=timespan,
+        interval=interval,
+        dir_indexes=dir_indexes,
+    )
+
+    n_topic_dirs = len([d for d in dir_indexes if d in wd_utils.topic_pids])
+    n_fetches = {
+        "hierarchy": len([q for q in hierarchy_qids if q not in ents_dict]),
+        "locations": plan["n_fetches"]["locations"],
+        "topic pages": plan["n_fetches"]["topic pages"]
+        + plan["n_fetches"]["locations"] * n_topic_dirs,
+        # The labels of sub-locations are resolved by lctn_utils.gen_lctns_dict.
+        "labels": plan["n_fetches"]["labels"]
+        + (sum(len(qids) for qids in depth_qids[1:]) if hierarchy_qids else 0),
+    }
+    batch_size = fetch_utils.wbgetentities_batch_size
+    # Locations above depth are loaded one at a time, with all else being fetched in batches.
+    n_requests = n_fetches["hierarchy"] + sum(
+        math.ceil(n / batch_size)
+        for kind, n in n_fetches.items()
+        if kind != "hierarchy"
+    )
+
+    stats = ents_dict.stats() if isinstance(ents_dict, wd_utils.EntitiesDict) else {}
+    if fetch_latency_s is None:
+        fetch_latency_s = (
+            stats["fetch_time_s"] / stats["n_fetches"]
+            if stats.get("n_fetches")
+            else default_fetch_latency_s
+        )
+    # The decoded size of entities, as downloads can be compressed.
+    ent_bytes = (
+        stats["n_ent_bytes"] / stats["n_fetches"]
+        if stats.get("n_fetches") and stats.get("n_ent_bytes")
+        else default_ent_bytes
+    )
+
+    n_cols = (
+        2 * (depth + 1)  # the label and qid of each depth
+        + (1 if interval is not None else 0)
+        + sum(len(props) for props in plan["props"].values())
+    )
+    n_ents = n_fetches["hierarchy"] + n_fetches["locations"] + n_fetches["topic pages"]
+    ents_mem = n_ents * ent_bytes
+    if isinstance(ents_dict, wd_utils.EntitiesDict) and ents_dict._max_bytes:
+        ents_mem = min(ents_mem, ents_dict._max_bytes)
+
+    return {
+        "n_locations": len(depth_qids[-1]),
+        "n_times": _time_points(timespan=timespan, interval=interval),
+        "n_rows": plan["n_rows"],
+        "n_fetches": n_fetches,
+        "n_requests": n_requests,
+        "n_count_requests": n_count_requests,
+        "memory_mb": round(
+            (plan["n_rows"] * n_cols * default_cell_bytes + ents_mem) / 1024**2, 3
+        ),
+        "wall_s": round(
+            sum(n_fetches.values()) * fetch_latency_s
+            + plan["n_rows"] * n_cols * default_cell_time_s,
+            3,
+        ),
+    }
@@ -0,0 +1,179 @@
+"""
+Profiling Utilities
+-------------------
+
+Per-stage profiling of queries.
+
+Stages are timed only while a Profiler is active, and otherwise cost a single check.
+
+Contents
+    profiling,
+    stage
+
+    _Stage Class
+        __init__
+
+    Profiler Class
+        __init__,
+        __repr__,
+        record,
+        report
+"""
+
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+
+# The profiler that stages are recorded to, with None meaning that profiling is off.
+# Each thread and task has its own, so concurrent queries don't record to each other's profilers.
+_active_profiler = contextvars.ContextVar("wikirepo_active_profiler", default=None)
+
+
+class _Stage:
+    """
+    A handle for a running stage that allows for the rows it produces to be set.
+    """
+
+    __slots__ = ["rows"]
+
+    def __init__(self):
+        self.rows = None
+
+
+class Profiler(dict):
+    """
+    A dictionary of the time, call counts and rows produced by query stages.
+
+    Keys are (stage, module) tuples, and values are dictionaries of stage statistics.
+
+    Parameters
+    ----------
+        callback : callable (default=None)
+            A function that is called with a dictionary for each finished stage.
+    """
+
+    __slots__ = ["callback", "_lock", "_local"]
+
+    def __init__(self, callback=None):
+        super(Profiler, self).__init__()
+        self.callback = callback
+        self._lock = threading.Lock()
+        self._local = threading.local()  # stage stacks are per thread
+
+    def __repr__(self):
+        return "%s" % self.__class__
+
+    def _stack(self):
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+
+        return self._local.stack
+
+    def record(self, stage_name, module, time_s, self_s, rows):
+        """
+        Records a finished stage.
+        """
+        with self._lock:
+            stats = self.setdefault(
+                (stage_name, module),
+                {"calls": 0, "time_s": 0.0, "self_s": 0.0, "rows": 0},
+            )
+            stats["calls"] += 1
+            stats["time_s"] += time_s
+            stats["self_s"] += self_s
+            if rows is not None:
+                stats["rows"] += rows
+
+        if self.callback is not None:
+            self.callback(
+                {
+                    "stage": stage_name,
+                    "module": module,
+                    "time_s": time_s,
+                    "self_s": self_s,
+                    "rows": rows,
+                }
+            )
+
+    def report(self):
+        """
+        Provides a df of the recorded stages sorted by their total time.
+
+        Notes
+        -----
+            time_s includes nested stages (ex: 'fetch' within 't_to_prop_val_dict'), and self_s excludes them.
+        """
+        df_report = pd.DataFrame(
+            [
+                {"stage": stage_name, "module": module, **stats}
+                for (stage_name, module), stats in self.items()
+            ],
+            columns=["stage", "module", "calls", "time_s", "self_s", "rows"],
+        )
+
+        return df_report.sort_values("time_s", ascending=False, ignore_index=True)
+
+
+@contextmanager
+def profiling(profiler):
+    """
+    Activates a profiler for the stages within the context.
+    """
+    token = _active_profiler.set(profiler)
+    try:
+        yield profiler
+
+    finally:
+        _active_profiler.reset(token)
+
+
+@contextmanager
+def stage(stage_name, module=None):
+    """
+    Times a stage of a query if a profiler is active.
+
+    Parameters
+    ----------
+        stage_name : str
+            The name of the stage (ex: 'gen_base_df').
+
+        module : str (default=None: the module of the enclosing stage)
+            The property module that the stage is for (ex: 'demographic.population').
+
+    Yields
+    ------
+        stage_handle : prof_utils._Stage
+            A handle with a rows attribute that can be set to the rows the stage produced.
+    """
+    profiler = _active_profiler.get()
+    stage_handle = _Stage()
+    if profiler is None:
+        yield stage_handle
+        return
+
+    stack = profiler._stack()
+    if module is None and stack:
+        module = stack[-1][0]
+
+    frame = [module, 0.0]  # the module and the time of nested stages
+    stack.append(frame)
+    start = time.perf_counter()
+    try:
+        yield stage_handle
+
+    finally:
+        time_s = time.perf_counter() - start
+        stack.pop()
+        if stack:
+            stack[-1][1] += time_s
+
+        profiler.record(
+            stage_name=stage_name,
+            module=module,
+            time_s=time_s,
+            self_s=time_s - frame[1],
+            rows=stage_handle.rows,
+        )
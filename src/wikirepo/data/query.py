@@ -16,7 +16,17 @@
 import pandas as pd
 from tqdm.auto import tqdm
 from wikirepo import utils
-from wikirepo.data import data_utils, lctn_utils, time_utils, wd_utils
+from wikirepo.data import (
+    cache_utils,
+    coverage_utils,
+    data_utils,
+    lctn_utils,
+    plan_utils,
+    prof_utils,
+    sparql_utils,
+    time_utils,
+    wd_utils,
+)
 
 
 def query(
@@ -35,6 +45,13 @@ def query(
     political_props=None,
     misc_props=None,
     #   multicore=True,
+    typed=False,
+    profile=False,
+    coverage=False,
+    project=False,
+    sparql=False,
+    explain=False,
+    cache_dir=None,
     verbose=True,
 ):
     """
@@ -96,6 +113,55 @@ def query(
         misc_props : str or list (contains strs) : optional (default=None)
             String representations of data/misc (miscellaneous) modules for data_utils.query_repo_dir.
 
+        typed : bool (default=False)
+            Whether to return typed columns via data_utils.set_df_dtypes.
+
+            Note: location columns become categorical, values nullable Int64 or Float64, and most recent dates datetimes.
+
+        profile : bool or callable (default=False)
+            Whether to record the time, call counts and rows of each stage of the query via prof_utils.Profiler.
+
+            Note 1: if True, then a df report of the stages is returned along with the queried df.
+
+            Note 2: a callable is instead called with a dictionary for each stage as it finishes.
+
+        coverage : bool (default=False)
+            Whether to return a df of the (qid, pid, reason) of data that is missing from Wikidata.
+
+            Note: missing data is also logged to 'wikirepo.data.coverage_utils' at DEBUG level.
+
+        project : bool (default=False)
+            Whether to strip entities in ents_dict down to the claims and labels the query needs.
+
+            Note 1: see wd_utils.EntitiesDict.set_projection, with labels being those of wd_utils.lbl_languages.
+
+            Note 2: the projection of ents_dict is restored afterwards, with entities that were stripped
+            being removed so that they're fetched in full when next needed.
+
+        sparql : bool (default=False)
+            Whether to query single column properties for all locations at once with SPARQL rather than loading each entity.
+
+            Note: queries are made to sparql_utils.endpoint (see sparql_utils.set_endpoint).
+
+        explain : bool (default=False)
+            Whether to print and return the plan of the query via plan_utils.plan_query rather than querying data.
+
+            Note: nothing is fetched, with the plan's fetches being estimates given the entities in ents_dict.
+
+        cache_dir : str or False (default=None: cache_utils.cache_dir, which is set by WIKIREPO_QUERY_CACHE_DIR)
+            A directory in which the result is cached, and from which it's read if none of the entities
+            it was derived from have changed revision.
+
+            Note 1: see cache_utils.set_cache_dir, with caching being off if neither is set or if False is passed.
+
+            Note 2: results of queries with sparql=True are read from the cache but not written to it,
+            as the revisions that they depend on aren't known.
+
+            Note 3: results of queries with coverage=True are neither read from nor written to the cache,
+            as the missing data that they report isn't cached.
+
+            Note 4: results can be pickled, so the directory should only be writable by trusted users.
+
         verbose : bool (default=True)
             Whether to show a tqdm progress bar for the query
             Note: passing 'full' calls progress bars for each data_utils.query_repo_dir.
@@ -112,7 +178,45 @@ def query(
     -------
         df_merge : pd.DataFrame
             A df of locations and data given timespan and data source arguments.
+
+            Note: df_merge.attrs['wikirepo'] holds the spec of the query for wikirepo.data.refresh, with
+            timespans as the ISO dates of the first and last rows and locations as top-level QIDs.
+
+        report : pd.DataFrame (if profile=True)
+            A df of the time, calls and rows of each stage and property module.
+
+        missing : pd.DataFrame (if coverage=True)
+            A df of the qid, pid and reason of data that is missing.
+
+        plan : plan_utils.QueryPlan (if explain=True)
+            The entities that the query requires, in place of the above.
     """
+    if profile or coverage or sparql:
+        query_args = dict(locals(), profile=False, coverage=False, sparql=False)
+        if coverage:
+            # Missing data isn't cached, so results are recomputed when it's being collected.
+            query_args["cache_dir"] = False
+
+        profiler = None
+        if profile:
+            profiler = prof_utils.Profiler(
+                callback=None if profile == True else profile
+            )
+
+        with prof_utils.profiling(profiler), coverage_utils.collecting() as missing:
+            with sparql_utils.extracting(sparql):
+                with prof_utils.stage("query") as query_stage:
+                    df_merge = query(**query_args)
+                    query_stage.rows = len(df_merge)
+
+        results = [df_merge]
+        if profile == True:
+            results.append(profiler.report())
+        if coverage:
+            results.append(missing.report())
+
+        return tuple(results) if len(results) > 1 else df_merge
+
     local_args = locals()
 
     # Baseline args that do not have imbedded lower level functional arguments.
@@ -123,6 +227,13 @@ def query(
         "depth",
         "timespan",
         "interval",
+        "typed",
+        "profile",
+        "coverage",
+        "project",
+        "sparql",
+        "explain",
+        "cache_dir",
         "verbose",
     ]
 
@@ -150,15 +261,74 @@ def query(
     if isinstance(locations, str):
         locations = [locations]
 
+    arg_to_dir = {arg: data_utils._props_arg_to_dir(arg) for arg in query_args}
+    dir_indexes = plan_utils._dir_indexes({arg: local_args[arg] for arg in query_args})
+
+    if project:
+        assert isinstance(
+            ents_dict, wd_utils.EntitiesDict
+        ), "Projection requires ents_dict to be a wd_utils.EntitiesDict."
+
+        projection_pids = []
+        for dir_name, indexes in dir_indexes.items():
+            dir_pids = data_utils.incl_dir_pids(dir_name=dir_name, indexes=indexes)
+            if dir_pids is None:
+                # Modules without a single property keep all claims.
+                projection_pids = None
+                break
+
+            projection_pids += dir_pids
+
+        # The projection is only for this query, with ents_dict's own being restored afterwards.
+        old_projection = ents_dict.set_projection(
+            pids=projection_pids, languages=wd_utils.lbl_languages
+        )
+        try:
+            return query(**dict(local_args, ents_dict=ents_dict, project=False))
+
+        finally:
+            ents_dict.set_projection(**(old_projection or {}))
+
+    # The entities of all directories are planned so that they're deduplicated and fetched in batches.
+    plan = plan_utils.plan_query(
+        ents_dict=ents_dict,
+        locations=locations,
+        depth=depth,
+        timespan=timespan,
+        interval=interval,
+        dir_indexes=dir_indexes,
+    )
+    if explain:
+        print(plan.explain())
+        return plan
+
+    if cache_dir is None:
+        cache_dir = cache_utils.cache_dir
+
+    if cache_dir:
+        cache_key = cache_utils.spec_key(
+            locations=locations,
+            depth=depth,
+            timespan=timespan,
+            interval=interval,
+            typed=typed,
+            dir_indexes=dir_indexes,
+        )
+        df_cached = cache_utils.read_result(cache_dir=cache_dir, key=cache_key)
+        if df_cached is not None:
+            return df_cached
+
+    if not sparql_utils._active.get():
+        # SPARQL queries don't require the entities of locations.
+        plan_utils.execute_plan(plan, ents_dict)
+
     for arg in tqdm(
         query_args, desc="Directories queried", unit="dir", disable=not verbose
     ):
-        sub_directory = arg[: -len("_props")]
+        sub_directory = arg_to_dir[arg]
 
-        if sub_directory == "electoral_poll" or sub_directory == "electoral_result":
-            sub_directory += "s"
-
-        query_params["ents_dict"] = literal_eval(str(ents_dict._print()))
+        # The EntitiesDict itself is passed so that its entities and stats are updated.
+        query_params["ents_dict"] = ents_dict
         query_params["dir_name"] = sub_directory
         if isinstance(locations, lctn_utils.LocationsDict):
             query_params["locations"] = literal_eval(str(locations._print()))
@@ -210,16 +380,18 @@ def query(
             else:
                 merge_on = lctn_utils.depth_to_cols(depth=depth)
 
-            df_dir_props, new_ents_dict = data_utils.query_repo_dir(
-                **literal_eval(str(query_params))
-            )
+            df_dir_props, new_ents_dict = data_utils.query_repo_dir(**query_params)
 
-            df_merge = pd.merge(df_merge, df_dir_props, on=merge_on)
+            with prof_utils.stage("pd.merge") as merge_stage:
+                df_merge = pd.merge(
+                    df_merge,
+                    df_dir_props.drop(columns="qid", errors="ignore"),
+                    on=merge_on,
+                )
+                merge_stage.rows = len(df_merge)
 
         else:
-            df_merge, new_ents_dict = data_utils.query_repo_dir(
-                **literal_eval(str(query_params))
-            )
+            df_merge, new_ents_dict = data_utils.query_repo_dir(**query_params)
 
         for i in incl_indexes:
             query_params.pop(i, None)
@@ -241,4 +413,49 @@ def query(
 
     df_merge.rename(columns={"keep_this_col": "qid"}, inplace=True)
 
+    if typed:
+        with prof_utils.stage("set_df_dtypes") as dtypes_stage:
+            df_merge = data_utils.set_df_dtypes(
+                df=df_merge, depth=depth, interval=interval
+            )
+            dtypes_stage.rows = len(df_merge)
+
+    # The spec of the query is kept JSON-safe, with what refresh needs of the result being kept in memory.
+    dep_qids = list(dict.fromkeys(q for deps in plan["deps"].values() for q in deps))
+    refresh_state = {
+        "locations": local_args["locations"],
+        "deps": plan["deps"],
+        "hashes": plan_utils._claims_hashes(ents_dict, plan["qids"], plan["props"]),
+        "revisions": {
+            q: ents_dict[q].get("lastrevid")
+            for q in dep_qids
+            if q in ents_dict and ents_dict[q] is not None
+        },
+    }
+    df_merge.attrs["wikirepo"] = {
+        "locations": data_utils._lctns_to_qids(local_args["locations"], depth=0),
+        "depth": depth,
+        "timespan": (
+            local_args["timespan"]
+            if local_args["timespan"] in [None, True]
+            else cache_utils._canonical_timespan(
+                timespan=local_args["timespan"], interval=interval
+            )
+        ),
+        "interval": interval,
+        "typed": typed,
+        "props": {arg: local_args[arg] for arg in query_args},
+        "state": cache_utils.store_refresh_state(refresh_state),
+    }
+
+    # The entities of SPARQL queries aren't loaded, so the revisions their results depend on aren't known.
+    if cache_dir and not sparql_utils._active.get():
+        cache_utils.write_result(
+            cache_dir=cache_dir,
+            key=cache_key,
+            df=df_merge,
+            qids=plan["qids"] + plan["topic_qids"] + plan["val_qids"],
+            ents_dict=ents_dict,
+        )
+
     return df_merge
@@ -0,0 +1,335 @@
+"""
+Refresh
+-------
+
+A function that updates the result of a query with new time periods and locations.
+
+Only the rows of locations and times that a previous result doesn't have, and the columns of modules
+whose claims have changed for a location, are queried, with all other cells being kept.
+
+Note: the purpose of this module is for a wikirepo.data.refresh() function call.
+
+Contents
+    _prune_lctns,
+    refresh
+"""
+
+from datetime import date
+
+# import modin.pandas as pd
+import pandas as pd
+from wikirepo.data import (
+    cache_utils,
+    data_utils,
+    lctn_utils,
+    plan_utils,
+    prof_utils,
+    time_utils,
+    wd_utils,
+)
+from wikirepo.data.query import query
+
+
+def _prune_lctns(lctns_dict, qids, depth, c=0):
+    """
+    Returns the branches of a LocationsDict that lead to the given QIDs at a depth.
+    """
+    pruned = {}
+    for q, v in lctns_dict.items():
+        if c == depth:
+            if q in qids:
+                pruned[q] = v
+
+        elif isinstance(v.get("sub_lctns"), dict):
+            sub_lctns = _prune_lctns(v["sub_lctns"], qids=qids, depth=depth, c=c + 1)
+            if sub_lctns:
+                pruned[q] = dict(v, sub_lctns=sub_lctns)
+
+    return pruned
+
+
+def refresh(previous_df, timespan=None, locations=None, ents_dict=None, verbose=True):
+    """
+    Updates the result of wikirepo.data.query by only querying the rows that are missing or stale.
+
+    Parameters
+    ----------
+        previous_df : pd.DataFrame
+            A result of wikirepo.data.query, whose attrs hold the spec of the query.
+
+            Note: its state, such as the revisions of its rows, is kept in memory (see cache_utils.store_refresh_state),
+            with all rows being queried again if it isn't, as for a result from another session.
+
+        timespan : two element tuple or list : contains datetime.date or tuple (default=None: the timespan of previous_df)
+            The timespan of the refreshed df, with rows of times outside of it being dropped.
+
+        locations : str, list, or lctn_utils.LocationsDict (contains strs) : optional (default=None: the locations of previous_df)
+            The locations of the refreshed df, with rows of other locations being dropped.
+
+            Note: new locations at a depth greater than 0 need to be passed in a LocationsDict.
+
+        ents_dict : wd_utils.EntitiesDict : optional (default=None)
+            A dictionary with keys being Wikidata QIDs and values being their entities.
+
+            Note: entities with new revisions are discarded (see EntitiesDict.discard) so that they're fetched again.
+
+        verbose : bool (default=True)
+            Whether to show tqdm progress bars for the queries of missing and stale rows.
+
+    Notes
+    -----
+        Locations whose entities or topic pages have new revisions, which is checked in batched requests
+        that only fetch revision ids, are loaded again, with only the modules whose claims changed being
+        queried again for them. Entities whose revisions weren't recorded, as for queries with sparql=True,
+        are treated as having changed claims for all modules.
+
+        Changes to the labels of values aren't checked.
+
+    Returns
+    -------
+        df_refresh : pd.DataFrame
+            previous_df with the rows of new times and locations and the cells of stale modules queried.
+    """
+    spec = previous_df.attrs.get("wikirepo")
+    assert (
+        spec is not None
+    ), "'previous_df' needs to be a result of wikirepo.data.query, with its attrs being kept."
+
+    depth = spec["depth"]
+    interval = spec["interval"]
+    if ents_dict == None:
+        ents_dict = wd_utils.EntitiesDict()
+
+    state = cache_utils.load_refresh_state(spec["state"])
+    if state is None:
+        state = {"locations": None, "deps": {}, "hashes": {}, "revisions": {}}
+
+    if timespan is None:
+        timespan = spec["timespan"]
+        if isinstance(timespan, list):
+            # The dates of the first and last rows, with reversing them keeping the order of rows.
+            timespan = tuple(date.fromisoformat(d) for d in reversed(timespan))
+
+    if locations is None:
+        locations = state["locations"]
+    if locations is None:
+        locations = spec["locations"]
+        if depth:
+            locations = lctn_utils.gen_lctns_dict(
+                ents_dict=ents_dict, locations=locations, depth=depth, verbose=False
+            )
+    if isinstance(locations, str):
+        locations = [locations]
+
+    lctn_qids = [q for q in data_utils._lctns_to_qids(locations, depth) if q != "nan"]
+    previous_qids = set(previous_df["qid"])
+
+    with prof_utils.stage("refresh_revisions"):
+        revisions = state["revisions"]
+        changed = set()
+        if revisions:
+            changed = {
+                q
+                for q, r in cache_utils.fetch_revisions(revisions.keys()).items()
+                if r != revisions[q]
+            }
+
+    # Changed entities are dropped so that they're fetched again rather than read from memory or a store.
+    if isinstance(ents_dict, wd_utils.EntitiesDict):
+        ents_dict.discard(list(changed))
+    else:
+        for q in changed:
+            if dict.__contains__(ents_dict, q):
+                del ents_dict[q]
+
+    deps = dict(state["deps"])
+    hashes = dict(state["hashes"])
+    changed_qids = [
+        q
+        for q in lctn_qids
+        if q in previous_qids
+        and any(d in changed or d not in revisions for d in deps.get(q, [q]))
+    ]
+
+    # The claims of each module are compared for locations with changed entities, with modules being indexed by 'dir_name.index'.
+    dir_indexes = plan_utils._dir_indexes(spec["props"])
+    dir_to_arg = {data_utils._props_arg_to_dir(arg): arg for arg in spec["props"]}
+    stale_modules = {}
+    checked_qids = [q for q in changed_qids if q in hashes]
+    if checked_qids:
+        with prof_utils.stage("refresh_claims"):
+            plan = plan_utils.plan_query(
+                ents_dict=ents_dict,
+                locations=checked_qids,
+                depth=0,
+                dir_indexes=dir_indexes,
+            )
+            plan_utils.execute_plan(plan, ents_dict)
+            new_hashes = plan_utils._claims_hashes(
+                ents_dict, plan["qids"], plan["props"]
+            )
+
+        for q in checked_qids:
+            stale_modules[q] = [
+                m
+                for m, h in new_hashes[q].items()
+                if h[1] is None or hashes[q].get(m) != h
+            ]
+
+        revisions = dict(
+            revisions,
+            **{
+                d: ents_dict[d].get("lastrevid")
+                for q in checked_qids
+                for d in plan["deps"][q]
+                if d in ents_dict and ents_dict[d] is not None
+            },
+        )
+        deps.update({q: plan["deps"][q] for q in checked_qids})
+        hashes.update(new_hashes)
+
+    n_modules = sum(
+        len(data_utils.incl_dir_props(dir_name=dir_name, indexes=indexes))
+        for dir_name, indexes in dir_indexes.items()
+    )
+    stale_qids = [
+        q
+        for q in changed_qids
+        if q not in stale_modules or len(stale_modules[q]) == n_modules
+    ]
+    new_qids = [q for q in lctn_qids if q not in previous_qids]
+    kept_qids = [q for q in lctn_qids if q in previous_qids and q not in stale_qids]
+
+    time_col = None
+    if interval is not None:
+        time_col = time_utils.interval_to_col_name(interval=interval)
+        dates = time_utils.make_timespan(timespan=timespan, interval=interval)
+        times = [time_utils.truncate_date(d, interval=interval) for d in dates]
+        previous_times = set(previous_df[time_col])
+        new_dates = [d for d, t in zip(dates, times) if t not in previous_times]
+
+    sub_states = []
+
+    def query_lctns(qids, timespan, props=None):
+        if isinstance(locations, dict):
+            lctns = lctn_utils.LocationsDict(
+                _prune_lctns(locations, qids=set(qids), depth=depth)
+            )
+        else:
+            lctns = qids
+
+        df = query(
+            ents_dict=ents_dict,
+            locations=lctns,
+            depth=depth,
+            timespan=timespan,
+            interval=interval,
+            typed=spec["typed"],
+            verbose=verbose,
+            **(props or spec["props"]),
+        )
+        sub_states.append(cache_utils.load_refresh_state(df.attrs["wikirepo"]["state"]))
+
+        return df
+
+    kept_rows = previous_df["qid"].isin(kept_qids)
+    if time_col is not None:
+        kept_rows &= previous_df[time_col].isin(times)
+
+    df_kept = previous_df[kept_rows]
+
+    # The cells of stale modules are queried for the locations that share them, and replace those of the kept rows.
+    merge_on = ["qid"] + ([time_col] if time_col is not None else [])
+    lctn_cols = lctn_utils.depth_to_cols(depth=depth)
+    qids_by_modules = {}
+    for q in kept_qids:
+        if stale_modules.get(q):
+            qids_by_modules.setdefault(tuple(stale_modules[q]), []).append(q)
+
+    for modules, qids in qids_by_modules.items():
+        props = {}
+        for m in modules:
+            dir_name, idx = m.split(".", 1)
+            props.setdefault(dir_to_arg[dir_name], []).append(idx)
+
+        df_stale = query_lctns(qids, timespan=timespan, props=props)
+        val_cols = [c for c in df_stale.columns if c not in lctn_cols + merge_on]
+        stale_rows = df_kept["qid"].isin(qids)
+        df_kept = pd.concat(
+            [
+                df_kept[~stale_rows],
+                df_kept[stale_rows]
+                .drop(columns=val_cols)
+                .merge(df_stale[merge_on + val_cols], on=merge_on, how="left")[
+                    df_kept.columns
+                ],
+            ],
+            ignore_index=True,
+        )
+
+    dfs = [df_kept]
+    if new_qids or stale_qids:
+        dfs.append(query_lctns(new_qids + stale_qids, timespan=timespan))
+
+    if time_col is not None and kept_qids and new_dates:
+        # New dates are queried over the span between them, with rows of other times being dropped.
+        df_new_times = query_lctns(kept_qids, timespan=(min(new_dates), max(new_dates)))
+        dfs.append(
+            df_new_times[
+                df_new_times[time_col].isin(
+                    [t for t in times if t not in previous_times]
+                )
+            ]
+        )
+
+    with prof_utils.stage("refresh_merge") as merge_stage:
+        df_refresh = pd.concat(dfs, ignore_index=True)
+
+        # Rows are ordered as wikirepo.data.query orders them.
+        lctn_order = {q: i for i, q in enumerate(lctn_qids)}
+        df_order = pd.DataFrame(
+            {"lctn": df_refresh["qid"].astype(object).map(lctn_order)}
+        )
+        if time_col is not None:
+            time_order = {t: i for i, t in enumerate(times)}
+            df_order["time"] = df_refresh[time_col].astype(object).map(time_order)
+
+        df_refresh = df_refresh.loc[
+            df_order.sort_values(list(df_order.columns), kind="stable").index
+        ].reset_index(drop=True)
+
+        if spec["typed"]:
+            # Concatenated categories of differing values aren't kept.
+            df_refresh = data_utils.set_df_dtypes(
+                df=df_refresh, depth=depth, interval=interval
+            )
+
+        merge_stage.rows = len(df_refresh)
+
+    for sub_state in sub_states:
+        if sub_state is not None:
+            deps.update(sub_state["deps"])
+            revisions = dict(revisions, **sub_state["revisions"])
+            for q, q_hashes in sub_state["hashes"].items():
+                hashes[q] = dict(hashes.get(q, {}), **q_hashes)
+
+    deps = {q: deps[q] for q in lctn_qids if q in deps}
+    dep_qids = {q for q_deps in deps.values() for q in q_deps}
+    refresh_state = {
+        "locations": locations,
+        "deps": deps,
+        "hashes": {q: hashes[q] for q in lctn_qids if q in hashes},
+        "revisions": {q: r for q, r in revisions.items() if q in dep_qids},
+    }
+    df_refresh.attrs["wikirepo"] = dict(
+        spec,
+        locations=data_utils._lctns_to_qids(locations, depth=0),
+        timespan=(
+            timespan
+            if timespan in [None, True]
+            else cache_utils._canonical_timespan(timespan=timespan, interval=interval)
+        ),
+        state=cache_utils.store_refresh_state(refresh_state),
+    )
+
+    return df_refresh
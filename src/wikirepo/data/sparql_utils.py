@@ -0,0 +1,484 @@
+"""
+SPARQL Utilities
+----------------
+
+Bulk extraction of property values with the Wikidata Query Service.
+
+A property's values for many locations are queried with one paginated SPARQL query rather than by
+loading each location's entity. Results are columnar, and are converted into minimal entities so that
+they're assigned to dfs in the same way as fetched entities.
+
+Contents
+    set_endpoint,
+    set_scheduler,
+    extracting,
+    gen_prop_query,
+    _post,
+    _request,
+    _binding_to_val,
+    fetch_prop_vals,
+    val_qids,
+    prop_vals_to_ents,
+    _order_dependent_qids,
+    t_to_prop_val_dict
+"""
+
+import contextvars
+import json
+import os
+from contextlib import contextmanager
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+from wikidata.client import Client
+from wikirepo import utils
+from wikirepo.data import fetch_utils, prof_utils, time_utils, wd_utils
+
+endpoint = os.environ.get(
+    "WIKIREPO_SPARQL_ENDPOINT", "https://query.wikidata.org/sparql"
+)
+
+# The number of rows per page of results, and the number of QIDs per query.
+page_size = 10000
+values_batch_size = 1000
+
+# Queries are rate limited and retried as fetches are, with the Wikidata Query Service allowing
+# fewer requests than the API. Its transport isn't used, as queries are posted by sparql_utils._post.
+scheduler = fetch_utils.ScheduledTransport(rate=1.0, burst=5)
+# The time in seconds after which a request is abandoned and retried.
+timeout = 60.0
+
+# Qualifiers that are queried along with values, as these are used to derive the times of values.
+time_pids = ["P585", "P580", "P582"]
+
+# Whether data_utils.query_wd_prop should use SPARQL, which is set within extracting().
+# Each thread and task has its own, so concurrent queries don't change each other's backend.
+_active = contextvars.ContextVar("wikirepo_sparql_active", default=False)
+
+_entity_prefix = "http://www.wikidata.org/entity/"
+# The prefix of the skolem IRIs that the Wikidata Query Service gives unknown (somevalue) values.
+_genid_prefix = "http://www.wikidata.org/.well-known/genid/"
+# The unit of quantities without units, which the API gives as '1'.
+_no_unit = _entity_prefix + "Q199"
+
+
+def set_endpoint(new_endpoint=None):
+    """
+    Sets the SPARQL endpoint that queries are made to.
+
+    Parameters
+    ----------
+        new_endpoint : str (default=None: https://query.wikidata.org/sparql)
+            The URL of the endpoint (ex: that of a synth_utils.SynthServer).
+
+    Returns
+    -------
+        old_endpoint : str
+            The previous endpoint so that it can be reset.
+    """
+    global endpoint
+    old_endpoint = endpoint
+    if new_endpoint is None:
+        new_endpoint = "https://query.wikidata.org/sparql"
+
+    endpoint = new_endpoint
+
+    return old_endpoint
+
+
+def set_scheduler(new_scheduler=None):
+    """
+    Sets the scheduler that rate limits and retries queries.
+
+    Parameters
+    ----------
+        new_scheduler : fetch_utils.ScheduledTransport (default=None: one of 1 request per second with bursts of 5)
+            The scheduler whose rate limiting and retries queries are made with.
+
+            Note: ScheduledTransport(rate=None) allows for unlimited queries to local endpoints.
+
+    Returns
+    -------
+        old_scheduler : fetch_utils.ScheduledTransport
+            The previous scheduler so that it can be reset.
+    """
+    global scheduler
+    old_scheduler = scheduler
+    if new_scheduler is None:
+        new_scheduler = fetch_utils.ScheduledTransport(rate=1.0, burst=5)
+
+    scheduler = new_scheduler
+
+    return old_scheduler
+
+
+@contextmanager
+def extracting(active=True):
+    """
+    Has data_utils.query_wd_prop query single column properties with SPARQL within the context.
+    """
+    token = _active.set(active)
+    try:
+        yield
+
+    finally:
+        _active.reset(token)
+
+
+def gen_prop_query(pid, qids, limit=None, offset=0):
+    """
+    Generates a SPARQL query for the values of a property and their time qualifiers for the given QIDs.
+
+    Note: the units of quantities and the precisions of times are also queried so that values match those of entities.
+    """
+    time_vars = "".join(f" ?{t_pid} ?{t_pid}_precision" for t_pid in time_pids)
+    time_optionals = "".join(
+        f"  OPTIONAL {{ ?statement pqv:{t_pid} ?{t_pid}_node . "
+        f"?{t_pid}_node wikibase:timeValue ?{t_pid} ; wikibase:timePrecision ?{t_pid}_precision . }}\n"
+        for t_pid in time_pids
+    )
+    query = (
+        f"SELECT ?item ?statement ?value ?unit ?precision{time_vars} WHERE {{\n"
+        f"  VALUES ?item {{ {' '.join(f'wd:{q}' for q in qids)} }}\n"
+        f"  ?item p:{pid} ?statement .\n"
+        f"  ?statement ps:{pid} ?value .\n"
+        f"  OPTIONAL {{ ?statement psv:{pid} ?value_node . "
+        f"OPTIONAL {{ ?value_node wikibase:quantityUnit ?unit . }} "
+        f"OPTIONAL {{ ?value_node wikibase:timePrecision ?precision . }} }}\n"
+        f"{time_optionals}"
+        f"}}\n"
+        # Statements are ordered by their ids for stable pages, which isn't the order of claims.
+        f"ORDER BY ?item ?statement"
+    )
+    if limit is not None:
+        query += f"\nLIMIT {limit} OFFSET {offset}"
+
+    return query
+
+
+def _post(query):
+    """
+    Posts a query to the endpoint, returning its bindings.
+    """
+    request = Request(
+        endpoint,
+        data=urlencode({"query": query, "format": "json"}).encode("utf-8"),
+        headers={
+            "Accept": "application/sparql-results+json",
+            "User-Agent": Client().user_agent,
+        },
+    )
+    with urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read().decode("utf-8"))["results"]["bindings"]
+
+
+def _request(query):
+    """
+    Posts a query to the endpoint via sparql_utils.scheduler, which rate limits it and retries it if it fails.
+    """
+    return scheduler._call(_post, query)
+
+
+def _binding_to_val(binding, unit=None, precision=None):
+    """
+    Converts a SPARQL binding into the type and datavalue value of a Wikidata snak.
+
+    Notes
+    -----
+        The bindings of the unit of a quantity and the precision of a time are passed as unit and precision.
+
+        Unknown (somevalue) values are blank nodes, which are converted into (None, None).
+    """
+    if binding["type"] == "bnode" or binding["value"].startswith(_genid_prefix):
+        return None, None
+
+    if binding["type"] == "uri" and binding["value"].startswith(_entity_prefix):
+        qid = binding["value"][len(_entity_prefix) :]
+        return (
+            "wikibase-entityid",
+            {"entity-type": "item", "numeric-id": int(qid[1:]), "id": qid},
+        )
+
+    datatype = binding.get("datatype", "")
+    if datatype.endswith(("#decimal", "#integer", "#double", "#float")):
+        amount = binding["value"]
+        if not amount.startswith(("-", "+")):
+            amount = "+" + amount
+
+        unit = unit["value"] if unit is not None else _no_unit
+
+        return "quantity", {"amount": amount, "unit": "1" if unit == _no_unit else unit}
+
+    if datatype.endswith("#dateTime"):
+        t = binding["value"]
+        if not t.startswith(("-", "+")):
+            t = "+" + t
+
+        precision = int(precision["value"]) if precision is not None else 11
+
+        return "time", {"time": t, "precision": precision}
+
+    return "string", binding["value"]
+
+
+def fetch_prop_vals(pid, qids):
+    """
+    Queries the values of a property and their time qualifiers for QIDs with paginated SPARQL queries.
+
+    Parameters
+    ----------
+        pid : str
+            The Wikidata property to query.
+
+        qids : list (contains strs)
+            Wikidata QIDs for locations.
+
+    Returns
+    -------
+        prop_vals : dict
+            Lists of qid, statement, value_type and value, as well as a list for each of sparql_utils.time_pids.
+
+            Note: a statement is one row, with only the first value of each time qualifier being kept.
+    """
+    prop_vals = {
+        col: [] for col in ["qid", "statement", "value_type", "value"] + time_pids
+    }
+    row_idxs = (
+        {}
+    )  # rows of statements, as a statement has a row for each combination of qualifiers
+
+    qids = list(dict.fromkeys(qids))
+    for i in range(0, len(qids), values_batch_size):
+        offset = 0
+        while True:
+            bindings = _request(
+                gen_prop_query(
+                    pid=pid,
+                    qids=qids[i : i + values_batch_size],
+                    limit=page_size,
+                    offset=offset,
+                )
+            )
+            for b in bindings:
+                statement = b["statement"]["value"]
+                if statement not in row_idxs:
+                    row_idxs[statement] = len(prop_vals["qid"])
+                    value_type, value = _binding_to_val(
+                        b["value"], unit=b.get("unit"), precision=b.get("precision")
+                    )
+                    prop_vals["qid"].append(b["item"]["value"][len(_entity_prefix) :])
+                    prop_vals["statement"].append(statement)
+                    prop_vals["value_type"].append(value_type)
+                    prop_vals["value"].append(value)
+                    for t_pid in time_pids:
+                        prop_vals[t_pid].append(None)
+
+                row = row_idxs[statement]
+                for t_pid in time_pids:
+                    if t_pid in b and prop_vals[t_pid][row] is None:
+                        prop_vals[t_pid][row] = _binding_to_val(
+                            b[t_pid], precision=b.get(f"{t_pid}_precision")
+                        )[1]
+
+            if len(bindings) < page_size:
+                break
+
+            offset += page_size
+
+    return prop_vals
+
+
+def val_qids(prop_vals):
+    """
+    Returns the QIDs that are values in queried property values.
+    """
+    return [
+        val["id"] for val in prop_vals["value"] if isinstance(val, dict) and "id" in val
+    ]
+
+
+def prop_vals_to_ents(pid, prop_vals, val_lbls=None):
+    """
+    Converts queried property values into entities that only have the claims of the property.
+
+    Parameters
+    ----------
+        pid : str
+            The Wikidata property that was queried.
+
+        prop_vals : dict
+            Property values from sparql_utils.fetch_prop_vals.
+
+        val_lbls : dict (default=None)
+            Labels of the QIDs that are values (see wd_utils.resolve_lbls), which are added to the entities.
+
+    Returns
+    -------
+        ents_dict : wd_utils.EntitiesDict
+            Entities to be used in place of fetched entities by wd_utils.t_to_prop_val_dict.
+    """
+    ents_dict = wd_utils.EntitiesDict()
+    for row, qid in enumerate(prop_vals["qid"]):
+        if qid not in ents_dict:
+            ents_dict[qid] = {"id": qid, "labels": {}, "claims": {pid: []}}
+
+        if prop_vals["value_type"][row] is None:
+            mainsnak = {"snaktype": "somevalue", "property": pid}
+        else:
+            mainsnak = {
+                "snaktype": "value",
+                "property": pid,
+                "datavalue": {
+                    "value": prop_vals["value"][row],
+                    "type": prop_vals["value_type"][row],
+                },
+            }
+
+        claim = {"mainsnak": mainsnak, "type": "statement"}
+        qualifiers = {
+            t_pid: [
+                {
+                    "snaktype": "value",
+                    "property": t_pid,
+                    "datavalue": {"value": prop_vals[t_pid][row], "type": "time"},
+                }
+            ]
+            for t_pid in time_pids
+            if prop_vals[t_pid][row] is not None
+        }
+        if qualifiers:
+            claim["qualifiers"] = qualifiers
+
+        ents_dict[qid]["claims"][pid].append(claim)
+
+    for qid, lbl in (val_lbls or {}).items():
+        if lbl is None:
+            continue
+
+        if qid not in ents_dict:
+            ents_dict[qid] = {"id": qid, "labels": {}, "claims": {}}
+
+        ents_dict[qid]["labels"] = {wd_utils.lbl_languages[0]: lbl}
+
+    return ents_dict
+
+
+def _order_dependent_qids(sparql_ents, qids, pid, interval, timespan, span):
+    """
+    Finds the locations with different values at the same time, for which the value that's kept depends on the order of claims.
+    """
+    dependent_qids = set()
+    for q in qids:
+        vals_at_t = {}
+        for i, claim in enumerate(sparql_ents[q]["claims"][pid]):
+            if span:
+                ts = (
+                    wd_utils.get_prop_timespan_intersection(
+                        sparql_ents, q, pid, i, timespan, interval
+                    )
+                    or []
+                )
+            else:
+                try:
+                    ts = [
+                        time_utils.truncate_date(
+                            wd_utils.get_formatted_prop_t(sparql_ents, q, pid, i),
+                            interval=interval,
+                        )
+                    ]
+                except Exception:
+                    ts = [None]  # values without times are all assigned to one time
+
+            val = json.dumps(claim["mainsnak"].get("datavalue"), sort_keys=True)
+            for t in ts:
+                vals_at_t.setdefault(t, set()).add(val)
+
+        if any(len(vals) > 1 for vals in vals_at_t.values()):
+            dependent_qids.add(q)
+
+    return dependent_qids
+
+
+def t_to_prop_val_dict(
+    dir_name=None,
+    ents_dict=None,
+    qids=None,
+    pid=None,
+    sub_pid=None,
+    interval=None,
+    timespan=None,
+    ignore_char="",
+    span=False,
+):
+    """
+    Gets a dictionary of property value(s) indexed by time(s) for locations with a SPARQL query.
+
+    Notes
+    -----
+        Takes the same arguments and returns the same dictionary as wd_utils.t_to_prop_val_dict.
+
+        Locations without values are passed to wd_utils.t_to_prop_val_dict so that topic pages are
+        checked and missing data is recorded.
+
+        Locations with different values at the same time are also passed, as the value that's kept
+        depends on the order of their claims, which isn't the order of statements in SPARQL results.
+
+    Parameters
+    ----------
+        ents_dict : wd_utils.EntitiesDict (default=None)
+            A dictionary with keys being Wikidata QIDs and values being their entities.
+
+            Note: entities of locations with values aren't loaded, but those of values are used for labels.
+
+        See wd_utils.t_to_prop_val_dict for the remaining parameters.
+
+    Returns
+    -------
+        t_prop_dict : dict
+            A dictionary of Wikidata properties indexed by their time.
+    """
+    assert not isinstance(
+        sub_pid, str
+    ), "SPARQL queries are only made for properties without a sub_pid qualifier."
+
+    qids = utils._make_var_list(qids)[0]
+    with prof_utils.stage("sparql_prop_vals") as sparql_stage:
+        prop_vals = fetch_prop_vals(pid=pid, qids=qids)
+        sparql_stage.rows = len(prop_vals["qid"])
+
+    sparql_ents = prop_vals_to_ents(
+        pid=pid,
+        prop_vals=prop_vals,
+        val_lbls=wd_utils.resolve_lbls(val_qids(prop_vals), ents_dict=ents_dict),
+    )
+    qids_with_vals = set(prop_vals["qid"])
+    qids_with_vals -= _order_dependent_qids(
+        sparql_ents=sparql_ents,
+        qids=qids_with_vals,
+        pid=pid,
+        interval=interval,
+        timespan=timespan,
+        span=span,
+    )
+
+    t_prop_dict = {}
+    for qids_to_assign, qids_ents_dict in [
+        ([q for q in qids if q in qids_with_vals], sparql_ents),
+        ([q for q in qids if q not in qids_with_vals], ents_dict),
+    ]:
+        if qids_to_assign:
+            t_prop_dict.update(
+                wd_utils.t_to_prop_val_dict(
+                    dir_name=dir_name,
+                    ents_dict=qids_ents_dict,
+                    qids=qids_to_assign,
+                    pid=pid,
+                    sub_pid=sub_pid,
+                    interval=interval,
+                    timespan=timespan,
+                    ignore_char=ignore_char,
+                    span=span,
+                )
+            )
+
+    return {q: t_prop_dict[q] for q in qids}
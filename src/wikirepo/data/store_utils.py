@@ -0,0 +1,616 @@
+"""
+Store Utilities
+---------------
+
+A read-only entity store that many processes can share.
+
+A store is a single file of compact JSON entities followed by an index of their offsets. Stores are
+memory-mapped so that the operating system shares their pages between processes, and entities are
+only decoded when they're accessed. The index is sorted and of fixed-width entries so that ids are
+binary searched within the map rather than the index being loaded.
+
+Entities that are only values of ingested locations are stored with only their labels, and are
+flagged so that wd_utils.EntitiesDict uses them for labels but fetches their full entities.
+
+Layout
+    magic (16 bytes) | index offset, number of entries, id width (8 byte little-endian ints) | entities |
+    index (entries of id (NUL padded to id width), offset and length (8 byte little-endian ints) and flags (1 byte)
+    sorted by id)
+
+Stores can be written from entities that have been loaded, or ingested from a Wikidata JSON dump
+(ex: latest-all.json.gz) with store_utils.ingest_dump.
+
+Contents
+    _write_records,
+    write_store,
+    _open_dump,
+    _dump_chunks,
+    _init_worker,
+    _line_id,
+    _snak_ids,
+    _decode_edges,
+    _decode_records,
+    _decode_lbl_records,
+    _map_chunks,
+    _write_edges,
+    _reachable_qids,
+    ingest_dump
+
+    EntityStore Class
+        __init__,
+        __repr__,
+        _entry,
+        _find,
+        __contains__,
+        __getitem__,
+        __iter__,
+        __len__,
+        __enter__,
+        __exit__,
+        keys,
+        get,
+        is_full_ent,
+        close
+"""
+
+import bz2
+import gzip
+import json
+import mmap
+import multiprocessing
+import os
+import re
+import struct
+from collections import deque
+
+from tqdm.auto import tqdm
+from wikirepo.data import lctn_utils, wd_utils
+
+magic = b"WIKIREPO-STORE-2"
+_header_fmt = "<QQQ"
+_header_size = len(magic) + struct.calcsize(_header_fmt)
+_loc_fmt = "<QQB"
+_lbl_only_flag = 1
+
+# The id of a dump entity, which comes before its labels and claims.
+_id_pattern = re.compile(rb'"id"\s*:\s*"([^"]+)"')
+
+
+def _write_records(path, records):
+    """
+    Writes (id, encoded entity, is label only) records to a store file, which is replaced atomically.
+    """
+    index = {}
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(magic + struct.pack(_header_fmt, 0, 0, 0))
+        offset = _header_size
+        for pq_id, record, lbl_only in records:
+            f.write(record)
+            index[pq_id.encode("utf-8")] = (
+                offset,
+                len(record),
+                _lbl_only_flag if lbl_only else 0,
+            )
+            offset += len(record)
+
+        id_width = max((len(b_id) for b_id in index), default=0)
+        entry_fmt = f"<{id_width}s{_loc_fmt[1:]}"
+        for b_id in sorted(index):
+            f.write(struct.pack(entry_fmt, b_id, *index[b_id]))
+
+        f.seek(len(magic))
+        f.write(struct.pack(_header_fmt, offset, len(index), id_width))
+
+    os.replace(tmp_path, path)
+
+    return len(index)
+
+
+def write_store(path, ents):
+    """
+    Writes entities to a store file, which is replaced atomically.
+
+    Parameters
+    ----------
+        path : str
+            The file to write the store to.
+
+        ents : dict or wd_utils.EntitiesDict
+            Entities indexed by their Wikidata ids.
+
+    Returns
+    -------
+        n_ents : int
+            The number of entities written.
+    """
+    return _write_records(
+        path,
+        (
+            (pq_id, json.dumps(ent, separators=(",", ":")).encode("utf-8"), False)
+            for pq_id, ent in ents.items()
+            if ent is not None
+        ),
+    )
+
+
+def _open_dump(dump_path):
+    """
+    Opens a Wikidata JSON dump given its compression.
+    """
+    opener = {".gz": gzip.open, ".bz2": bz2.open}.get(
+        os.path.splitext(dump_path)[1], open
+    )
+
+    return opener(dump_path, "rb")
+
+
+def _dump_chunks(dump_path, chunk_size):
+    """
+    Streams lists of the encoded entities of a Wikidata JSON dump, which has one entity per line.
+    """
+    chunk = []
+    with _open_dump(dump_path) as f:
+        for line in f:
+            line = line.strip().rstrip(b",")
+            if line in [b"", b"[", b"]"]:
+                continue
+
+            chunk.append(line)
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+
+    if chunk:
+        yield chunk
+
+
+# The arguments of the current ingestion, set in each worker process.
+_worker_args = {}
+
+
+def _init_worker(worker_args):
+    """
+    Sets the arguments of an ingestion in a worker process so that they aren't sent with each chunk.
+    """
+    _worker_args.clear()
+    _worker_args.update(worker_args)
+
+
+def _line_id(line):
+    """
+    Extracts the id of an encoded dump entity without decoding it, returning None if it isn't before the entity's nested values.
+    """
+    match = _id_pattern.search(line)
+    if match is None:
+        return None
+
+    prefix = line[1 : match.start()]
+    if b"{" in prefix or b"[" in prefix:
+        return None  # the id of a nested value
+
+    return match.group(1).decode("utf-8")
+
+
+def _snak_ids(snaks):
+    """
+    Returns the entity ids that are the values of snaks.
+    """
+    ids = []
+    for snak in snaks:
+        val = snak.get("datavalue", {}).get("value")
+        if isinstance(val, dict) and "id" in val:
+            ids.append(val["id"])
+
+    return ids
+
+
+def _decode_edges(lines):
+    """
+    Decodes the 'P150' (contains administrative territorial entity) and topic page edges of dump entities.
+
+    Note: entities without the properties are skipped without being decoded.
+    """
+    edges = []
+    for line in lines:
+        if not any(f'"{pid}"'.encode() in line for pid in wd_utils.structural_pids):
+            continue
+
+        ent = json.loads(line)
+        children = [
+            (child, pid)
+            for pid in wd_utils.structural_pids
+            for child in _snak_ids(
+                claim["mainsnak"] for claim in ent.get("claims", {}).get(pid, [])
+            )
+        ]
+        if children:
+            edges.append((ent["id"], children))
+
+    return edges
+
+
+def _decode_records(lines):
+    """
+    Decodes the dump entities of the ingested QIDs, projecting them and collecting the ids of their values.
+    """
+    records = []
+    val_ids = set()
+    for line in lines:
+        # Only the entities of ingested QIDs are decoded.
+        pq_id = _line_id(line)
+        if pq_id is not None and pq_id not in _worker_args["qids"]:
+            continue
+
+        ent = json.loads(line)
+        if ent["id"] not in _worker_args["qids"]:
+            continue
+
+        ent = wd_utils.project_ent(
+            ent, pids=_worker_args["pids"], languages=_worker_args["languages"]
+        )
+        records.append(
+            (ent["id"], json.dumps(ent, separators=(",", ":")).encode("utf-8"), False)
+        )
+        for claims in ent["claims"].values():
+            for claim in claims:
+                val_ids.update(_snak_ids([claim["mainsnak"]]))
+                for snaks in claim.get("qualifiers", {}).values():
+                    val_ids.update(_snak_ids(snaks))
+
+    return records, val_ids
+
+
+def _decode_lbl_records(lines):
+    """
+    Decodes only the labels of the dump entities that are values of ingested entities.
+    """
+    records = []
+    for line in lines:
+        pq_id = _line_id(line)
+        if pq_id is not None and pq_id not in _worker_args["val_ids"]:
+            continue
+
+        ent = json.loads(line)
+        if ent["id"] not in _worker_args["val_ids"]:
+            continue
+
+        lbl_ent = {
+            "type": ent.get("type"),
+            "id": ent["id"],
+            "labels": {
+                lang: lbl
+                for lang, lbl in ent.get("labels", {}).items()
+                if _worker_args["languages"] is None
+                or lang in _worker_args["languages"]
+            },
+            "claims": {},
+        }
+        records.append(
+            (
+                ent["id"],
+                json.dumps(lbl_ent, separators=(",", ":")).encode("utf-8"),
+                True,
+            )
+        )
+
+    return records
+
+
+def _map_chunks(fxn, chunks, worker_args, processes):
+    """
+    Applies a decode function to chunks in worker processes, yielding the results in order.
+
+    Note: at most two chunks per process are pending so that memory use is constant.
+    """
+    if processes == 1:
+        _init_worker(worker_args)
+        for chunk in chunks:
+            yield fxn(chunk)
+
+        return
+
+    with multiprocessing.Pool(
+        processes, initializer=_init_worker, initargs=(worker_args,)
+    ) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.apply_async(fxn, (chunk,)))
+            if len(pending) >= 2 * processes:
+                yield pending.popleft().get()
+
+        while pending:
+            yield pending.popleft().get()
+
+
+def _write_edges(path, chunk_edges):
+    """
+    Writes the edges of dump entities to a file with a line for each (parent, pid, child).
+    """
+    with open(path, "w", encoding="utf-8") as f:
+        for edges in chunk_edges:
+            for parent, children in edges:
+                for child, pid in children:
+                    f.write(f"{parent}\t{pid}\t{child}\n")
+
+
+def _reachable_qids(edges_path, roots, depth=None):
+    """
+    Finds the QIDs that are reachable from roots through 'P150', with topic pages not adding to the depth.
+
+    Note: edges are streamed from a file of store_utils._write_edges once per level so that they aren't held in memory.
+    """
+    reachable = {q: 0 for q in roots}
+    frontier = set(roots)
+    while frontier:
+        next_frontier = set()
+        with open(edges_path, encoding="utf-8") as f:
+            for line in f:
+                parent, pid, child = line.rstrip("\n").split("\t")
+                if parent not in frontier or child in reachable:
+                    continue
+
+                child_depth = reachable[parent] + (pid == "P150")
+                if depth is not None and child_depth > depth:
+                    continue
+
+                reachable[child] = child_depth
+                next_frontier.add(child)
+
+        frontier = next_frontier
+
+    return set(reachable)
+
+
+def ingest_dump(
+    dump_path,
+    store_path,
+    roots=None,
+    depth=None,
+    pids=None,
+    languages=None,
+    value_lbls=True,
+    processes=None,
+    chunk_size=1000,
+    verbose=True,
+):
+    """
+    Ingests the location entities of a Wikidata JSON dump into a store.
+
+    Notes
+    -----
+        The dump is streamed so that memory use doesn't depend on its size, with the first pass
+        finding the locations that are reachable from roots, the second writing them, and the
+        third (if value_lbls) writing the labels of their values.
+
+        Entities are only decoded if their ids are of those being written, and the edges that
+        locations are found through are spilled to '{store_path}.edges.tmp' while they're followed.
+
+    Parameters
+    ----------
+        dump_path : str
+            A Wikidata JSON dump (ex: latest-all.json.gz), which can be gzip or bz2 compressed.
+
+        store_path : str
+            The file to write the store to.
+
+        roots : list (contains strs) (default=None: the QIDs of lctn_utils.lctn_to_qid_dict())
+            The QIDs from which locations are found through 'P150' (contains administrative territorial entity).
+
+        depth : int (default=None: all levels)
+            The number of 'P150' levels below roots to ingest.
+
+        pids : list (contains strs) (default=None: the PIDs of wd_utils.pid_to_lbl_dict())
+            The properties whose claims are kept, along with wd_utils.structural_pids.
+
+        languages : list (contains strs) (default=None: wd_utils.lbl_languages)
+            The languages whose labels are kept.
+
+        value_lbls : bool (default=True)
+            Whether to also ingest the labels of entities that are values of the kept claims.
+
+        processes : int (default=None: all CPUs)
+            The number of processes that decode entities, with 1 decoding in the current process.
+
+        chunk_size : int (default=1000)
+            The number of entities sent to a process at a time.
+
+        verbose : bool (default=True)
+            Whether to show a tqdm progress bar for each pass.
+
+    Returns
+    -------
+        n_ents : int
+            The number of entities written to the store.
+    """
+    if roots is None:
+        roots = list(lctn_utils.lctn_to_qid_dict().values())
+    if pids is None:
+        pids = list(wd_utils.pid_to_lbl_dict().keys())
+    if languages is None:
+        languages = list(wd_utils.lbl_languages)
+    if processes is None:
+        processes = os.cpu_count() or 1
+
+    # Edges are spilled to a file next to the store rather than being held in memory.
+    edges_path = f"{store_path}.edges.tmp"
+    try:
+        _write_edges(
+            edges_path,
+            tqdm(
+                _map_chunks(
+                    _decode_edges, _dump_chunks(dump_path, chunk_size), {}, processes
+                ),
+                desc="Locations found",
+                unit="chunk",
+                disable=not verbose,
+            ),
+        )
+        qids = _reachable_qids(edges_path=edges_path, roots=roots, depth=depth)
+
+    finally:
+        if os.path.exists(edges_path):
+            os.remove(edges_path)
+
+    worker_args = {"qids": qids, "pids": pids, "languages": languages}
+
+    written_ids = set()
+    val_ids = set()
+
+    def iter_records():
+        for records, chunk_val_ids in tqdm(
+            _map_chunks(
+                _decode_records,
+                _dump_chunks(dump_path, chunk_size),
+                worker_args,
+                processes,
+            ),
+            desc="Locations ingested",
+            unit="chunk",
+            disable=not verbose,
+        ):
+            val_ids.update(chunk_val_ids)
+            for pq_id, record, lbl_only in records:
+                written_ids.add(pq_id)
+                yield pq_id, record, lbl_only
+
+        if value_lbls:
+            lbl_args = {
+                "val_ids": {v for v in val_ids if v not in written_ids},
+                "languages": languages,
+            }
+            for records in tqdm(
+                _map_chunks(
+                    _decode_lbl_records,
+                    _dump_chunks(dump_path, chunk_size),
+                    lbl_args,
+                    processes,
+                ),
+                desc="Value labels ingested",
+                unit="chunk",
+                disable=not verbose,
+            ):
+                yield from records
+
+    return _write_records(store_path, iter_records())
+
+
+class EntityStore:
+    """
+    A memory-mapped, read-only store of entities that are decoded on access.
+
+    Parameters
+    ----------
+        path : str
+            A store file written with store_utils.write_store.
+
+    Notes
+    -----
+        Pass as wd_utils.EntitiesDict(store=...) so that entities are loaded from the store rather than fetched.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        assert (
+            self._mm[: len(magic)] == magic
+        ), f"{path} is not a wikirepo entity store. Please write it with store_utils.write_store."
+
+        self._index_offset, self._n_ents, self._id_width = struct.unpack_from(
+            _header_fmt, self._mm, len(magic)
+        )
+        self._entry_size = self._id_width + struct.calcsize(_loc_fmt)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.path!r})"
+
+    def _entry(self, i):
+        """
+        Returns the encoded id of the i-th entry of the index and the offset of its location.
+        """
+        entry_offset = self._index_offset + i * self._entry_size
+
+        return (
+            self._mm[entry_offset : entry_offset + self._id_width].rstrip(b"\0"),
+            entry_offset + self._id_width,
+        )
+
+    def _find(self, pq_id):
+        """
+        Binary searches the index for the (offset, length, flags) of an entity, returning None if it isn't stored.
+        """
+        if not isinstance(pq_id, str):
+            return None
+
+        b_id = pq_id.encode("utf-8")
+        lo, hi = 0, self._n_ents
+        while lo < hi:
+            mid = (lo + hi) // 2
+            mid_id, loc_offset = self._entry(mid)
+            if mid_id < b_id:
+                lo = mid + 1
+            elif mid_id > b_id:
+                hi = mid
+            else:
+                return struct.unpack_from(_loc_fmt, self._mm, loc_offset)
+
+        return None
+
+    def __contains__(self, pq_id):
+        return self._find(pq_id) is not None
+
+    def __getitem__(self, pq_id):
+        loc = self._find(pq_id)
+        if loc is None:
+            raise KeyError(pq_id)
+
+        offset, length, _ = loc
+
+        return json.loads(self._mm[offset : offset + length].decode("utf-8"))
+
+    def __iter__(self):
+        for i in range(self._n_ents):
+            yield self._entry(i)[0].decode("utf-8")
+
+    def __len__(self):
+        return self._n_ents
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def keys(self):
+        """
+        Provides the Wikidata ids of the entities in the store in the order of the index.
+        """
+        return iter(self)
+
+    def get(self, pq_id, default=None):
+        """
+        Decodes the entity of a Wikidata id if it's in the store.
+        """
+        loc = self._find(pq_id)
+        if loc is None:
+            return default
+
+        offset, length, _ = loc
+
+        return json.loads(self._mm[offset : offset + length].decode("utf-8"))
+
+    def is_full_ent(self, pq_id):
+        """
+        Checks whether the full entity of a Wikidata id is stored rather than only its labels.
+        """
+        loc = self._find(pq_id)
+
+        return loc is not None and not loc[2] & _lbl_only_flag
+
+    def close(self):
+        """
+        Unmaps the store.
+        """
+        self._mm.close()
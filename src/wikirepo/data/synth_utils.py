@@ -0,0 +1,699 @@
+"""
+Synthetic Utilities
+-------------------
+
+A synthetic stand-in for Wikidata that allows for load tests and benchmarks.
+
+Contents
+    _time_val,
+    _snak,
+    _claim,
+    incl_synth_pids,
+    gen_synth_ents,
+    synth_country_qids,
+    write_synth_dump
+
+    SynthServer Class
+        __init__,
+        __repr__,
+        __enter__,
+        __exit__,
+        url,
+        reset_counts,
+        start,
+        stop
+"""
+
+import bz2
+import gzip
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from dateutil.rrule import DAILY, MONTHLY, WEEKLY, YEARLY, rrule
+from wikirepo.data import fetch_utils
+
+first_lctn_id = 900000000
+first_val_id = 950000000
+
+# Property datatypes of the synthetic claims, with all other properties being quantities.
+item_pids = ["P17", "P30", "P36", "P1552"]
+span_item_pids = ["P6", "P463"]
+qualified_item_pids = {"P172": "P1107"}
+string_pids = ["P297", "P300"]
+
+
+def _time_val(d):
+    """
+    Formats a date as a Wikidata time value.
+    """
+    return {
+        "time": f"+{d.year:04d}-{d.month:02d}-{d.day:02d}T00:00:00Z",
+        "timezone": 0,
+        "before": 0,
+        "after": 0,
+        "precision": 11,
+        "calendarmodel": "http://www.wikidata.org/entity/Q1985727",
+    }
+
+
+def _snak(pid, val, datatype):
+    """
+    Generates a Wikidata snak for a value of a given datatype.
+    """
+    if datatype == "quantity":
+        datavalue = {"value": {"amount": f"+{val}", "unit": "1"}, "type": "quantity"}
+
+    elif datatype == "wikibase-item":
+        datavalue = {
+            "value": {"entity-type": "item", "numeric-id": int(val[1:]), "id": val},
+            "type": "wikibase-entityid",
+        }
+
+    elif datatype == "time":
+        datavalue = {"value": _time_val(val), "type": "time"}
+
+    else:
+        datavalue = {"value": val, "type": "string"}
+
+    return {
+        "snaktype": "value",
+        "property": pid,
+        "datavalue": datavalue,
+        "datatype": datatype,
+    }
+
+
+def _claim(qid, pid, val, datatype, qualifiers=None):
+    """
+    Generates a Wikidata statement with optional qualifiers given as {pid: (val, datatype)}.
+    """
+    claim = {
+        "mainsnak": _snak(pid, val, datatype),
+        "type": "statement",
+        "id": f"{qid}${pid}-{val}",
+        "rank": "normal",
+    }
+    if qualifiers:
+        claim["qualifiers"] = {
+            q_pid: [_snak(q_pid, q_val, q_datatype)]
+            for q_pid, (q_val, q_datatype) in qualifiers.items()
+        }
+        claim["qualifiers-order"] = list(qualifiers.keys())
+
+    return claim
+
+
+def incl_synth_pids():
+    """
+    Lists the PIDs that synthetic entities have claims for, which are those of the wikirepo.data modules.
+    """
+    return [
+        "P6",
+        "P17",
+        "P30",
+        "P36",
+        "P172",
+        "P297",
+        "P300",
+        "P463",
+        "P1081",
+        "P1082",
+        "P1125",
+        "P1198",
+        "P1279",
+        "P1552",
+        "P2046",
+        "P2131",
+        "P2132",
+        "P2134",
+        "P2250",
+        "P2299",
+        "P2573",
+        "P3529",
+        "P4010",
+        "P6897",
+        "P8476",
+        "P8477",
+    ]
+
+
+def gen_synth_ents(
+    n_countries=10,
+    depth=1,
+    n_sub_lctns=4,
+    n_claims=10,
+    pids=None,
+    start_date=date(2000, 1, 1),
+    interval="yearly",
+    n_vals=20,
+    n_langs=2,
+    seed=0,
+):
+    """
+    Generates synthetic Wikidata entities of countries and their 'P150' sub-locations.
+
+    Parameters
+    ----------
+        n_countries : int (default=10)
+            The number of depth 0 locations.
+
+        depth : int (default=1)
+            The number of 'P150' (contains administrative territorial entity) levels below each country.
+
+        n_sub_lctns : int (default=4)
+            The number of sub-locations of each location above the given depth.
+
+        n_claims : int (default=10)
+            The number of time qualified claims for each property of each location.
+
+        pids : list (contains strs) (default=None: synth_utils.incl_synth_pids())
+            The properties that locations should have claims for.
+
+        start_date : datetime.date (default=date(2000, 1, 1))
+            The date of the first time qualified claim.
+
+        interval : str (default=yearly)
+            The interval between time qualified claims.
+
+        n_vals : int (default=20)
+            The number of entities that are used as values of item properties.
+
+        n_langs : int (default=2)
+            The number of languages of labels, with English and German being the first.
+
+            Note: larger values allow for entities with sizes closer to those of Wikidata.
+
+        seed : int (default=0)
+            The seed for the random values of the claims.
+
+    Returns
+    -------
+        ents : dict
+            A dictionary with keys being Wikidata ids and values being their entities.
+    """
+    rng = random.Random(seed)
+    if pids is None:
+        pids = incl_synth_pids()
+
+    freq = {"yearly": YEARLY, "monthly": MONTHLY, "weekly": WEEKLY, "daily": DAILY}[
+        interval
+    ]
+    claim_dates = [
+        dt.date() for dt in rrule(freq, dtstart=start_date, count=max(n_claims, 1))
+    ]
+    langs = (["en", "de"] + [f"l{i}" for i in range(max(n_langs - 2, 0))])[:n_langs]
+
+    def gen_ent(pq_id, lbl, claims, ent_type="item"):
+        return {
+            "type": ent_type,
+            "id": pq_id,
+            "labels": {
+                lang: {
+                    "language": lang,
+                    "value": lbl if lang == "en" else f"{lbl} ({lang})",
+                }
+                for lang in langs
+            },
+            "descriptions": {},
+            "aliases": {},
+            "claims": claims,
+            "sitelinks": {},
+            "lastrevid": 1,
+            "modified": "2021-01-01T00:00:00Z",
+        }
+
+    ents = {}
+    val_qids = [f"Q{first_val_id + i}" for i in range(n_vals)]
+    for i, q in enumerate(val_qids):
+        ents[q] = gen_ent(q, f"Value {i}", {})
+
+    for pid in list(pids) + ["P150", "P580", "P582", "P585", "P1107"]:
+        ents[pid] = gen_ent(pid, f"property {pid}", {}, ent_type="property")
+
+    def gen_lctn_claims(qid, sub_qids):
+        claims = {}
+        for pid in pids:
+            if pid in item_pids:
+                claims[pid] = [_claim(qid, pid, rng.choice(val_qids), "wikibase-item")]
+
+            elif pid in span_item_pids:
+                claims[pid] = [
+                    _claim(
+                        qid,
+                        pid,
+                        rng.choice(val_qids),
+                        "wikibase-item",
+                        qualifiers=dict(
+                            [("P580", (claim_dates[j], "time"))]
+                            + (
+                                [("P582", (claim_dates[j + 1], "time"))]
+                                if j + 1 < len(claim_dates)
+                                else []
+                            )
+                        ),
+                    )
+                    for j in range(len(claim_dates))
+                ]
+
+            elif pid in qualified_item_pids:
+                claims[pid] = [
+                    _claim(
+                        qid,
+                        pid,
+                        val_qids[j % n_vals],
+                        "wikibase-item",
+                        qualifiers={
+                            qualified_item_pids[pid]: (
+                                round(rng.random(), 3),
+                                "quantity",
+                            ),
+                            "P585": (claim_dates[-1], "time"),
+                        },
+                    )
+                    for j in range(min(3, n_vals))
+                ]
+
+            elif pid in string_pids:
+                claims[pid] = [_claim(qid, pid, f"S-{qid[1:]}", "string")]
+
+            else:
+                claims[pid] = [
+                    _claim(
+                        qid,
+                        pid,
+                        rng.randint(1, 10**8),
+                        "quantity",
+                        qualifiers={"P585": (d, "time")},
+                    )
+                    for d in claim_dates
+                ]
+
+        if sub_qids:
+            claims["P150"] = [
+                _claim(qid, "P150", sub_q, "wikibase-item") for sub_q in sub_qids
+            ]
+
+        return claims
+
+    next_lctn_id = [first_lctn_id]
+
+    def gen_lctn(lbl, current_depth):
+        qid = f"Q{next_lctn_id[0]}"
+        next_lctn_id[0] += 1
+
+        sub_qids = []
+        if current_depth < depth:
+            sub_qids = [
+                gen_lctn(f"{lbl} Region {j}", current_depth + 1)
+                for j in range(n_sub_lctns)
+            ]
+
+        ents[qid] = gen_ent(qid, lbl, gen_lctn_claims(qid, sub_qids))
+
+        return qid
+
+    for i in range(n_countries):
+        gen_lctn(f"Synthland {i}", 0)
+
+    return ents
+
+
+def synth_country_qids(ents):
+    """
+    Returns the depth 0 location QIDs of generated synthetic entities.
+    """
+    lctn_qids = [
+        q
+        for q in ents.keys()
+        if q[0] == "Q" and first_lctn_id <= int(q[1:]) < first_val_id
+    ]
+    sub_qids = {
+        claim["mainsnak"]["datavalue"]["value"]["id"]
+        for q in lctn_qids
+        for claim in ents[q]["claims"].get("P150", [])
+    }
+
+    return [q for q in lctn_qids if q not in sub_qids]
+
+
+def write_synth_dump(ents, path):
+    """
+    Writes entities in the format of Wikidata JSON dumps, compressed if path ends in '.gz' or '.bz2'.
+
+    Note: dumps are a JSON array with one entity per line.
+    """
+    opener = {".gz": gzip.open, ".bz2": bz2.open}.get(os.path.splitext(path)[1], open)
+    lines = [json.dumps(ent, separators=(",", ":")) for ent in ents.values()]
+    with opener(path, "wt", encoding="utf-8") as f:
+        f.write("[\n" + ",\n".join(lines) + "\n]\n")
+
+
+class SynthServer:
+    """
+    A local HTTP stand-in for Wikidata that serves synthetic entities.
+
+    Notes
+    -----
+        Serves 'wiki/Special:EntityData/{id}.json' and 'w/api.php?action=wbgetentities' requests, as well as
+        'sparql' requests for queries generated by sparql_utils.gen_prop_query.
+
+        Use as a context manager, with url being the base_url for a wikidata.client.Client.
+
+    Parameters
+    ----------
+        ents : dict
+            Entities as generated by synth_utils.gen_synth_ents.
+
+        latency : float (default=0.0)
+            Seconds that each response is delayed by.
+
+        error_rate : float (default=0.0)
+            The fraction of requests that should fail.
+
+        error_code : int or str (default=429)
+            The HTTP status of failed requests, or 'maxlag' for Wikidata's maxlag API error.
+
+        retry_after : int (default=1)
+            The value of the Retry-After header of failed requests.
+
+        seed : int (default=0)
+            The seed for which requests fail.
+
+        redirects : dict (default=None)
+            Ids whose 'wiki/Special:EntityData' requests are redirected (303) to those of other ids,
+            as for entities that have been merged.
+    """
+
+    def __init__(
+        self,
+        ents,
+        latency=0.0,
+        error_rate=0.0,
+        error_code=429,
+        retry_after=1,
+        seed=0,
+        redirects=None,
+        host="127.0.0.1",
+        port=0,
+    ):
+        self.ents = ents
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_code = error_code
+        self.retry_after = retry_after
+        self.redirects = redirects or {}
+        self.host = host
+        self.port = port
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._httpd = None
+        self._thread = None
+        self.reset_counts()
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.url!r})"
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @property
+    def url(self):
+        """
+        The base url of the server.
+        """
+        return f"http://{self.host}:{self.port}/"
+
+    def reset_counts(self):
+        """
+        Resets the counts of connections, requests, served entities, errors and bytes sent.
+        """
+        self.n_connections = 0
+        self.n_requests = 0
+        self.n_ents_served = 0
+        self.n_errors = 0
+        self.n_bytes_sent = 0
+        self.requested_ids = []
+
+    def start(self):
+        """
+        Starts serving on a background thread.
+        """
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # allows for keep-alive connections
+            # Headers and bodies are written separately, which Nagle's algorithm delays on kept-alive connections.
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def setup(self):
+                super().setup()
+                with server._lock:
+                    server.n_connections += 1
+
+            def do_GET(self):
+                server._handle(self)
+
+            def do_POST(self):
+                server._handle(self)
+
+        self._httpd = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._httpd.daemon_threads = True
+        self.port = self._httpd.server_address[1]
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops the server.
+        """
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+    def _send(self, handler, status, body, headers=None):
+        payload = json.dumps(body).encode("utf-8") if body is not None else b""
+        if "gzip" in handler.headers.get("Accept-Encoding", ""):
+            payload = gzip.compress(payload, compresslevel=1)
+            headers = dict(headers or {}, **{"Content-Encoding": "gzip"})
+
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json; charset=utf-8")
+        handler.send_header("Content-Length", str(len(payload)))
+        for k, v in (headers or {}).items():
+            handler.send_header(k, str(v))
+        handler.end_headers()
+
+        # Counted before writing so that counts are final once a client has its response.
+        with self._lock:
+            self.n_bytes_sent += len(payload)
+
+        handler.wfile.write(payload)
+
+    def _handle(self, handler):
+        if self.latency:
+            time.sleep(self.latency)
+
+        parsed = urlparse(handler.path)
+        params = {k: v[-1] for k, v in parse_qs(parsed.query).items()}
+        if handler.command == "POST":
+            length = int(handler.headers.get("Content-Length", 0))
+            body = handler.rfile.read(length).decode("utf-8")
+            params.update({k: v[-1] for k, v in parse_qs(body).items()})
+
+        with self._lock:
+            self.n_requests += 1
+            fail = self.error_rate > 0 and self._rng.random() < self.error_rate
+            if fail:
+                self.n_errors += 1
+
+        if fail:
+            if self.error_code == "maxlag":
+                self._send(
+                    handler,
+                    200,
+                    {
+                        "error": {
+                            "code": "maxlag",
+                            "info": f"Waiting for a database server: {self.retry_after} seconds lagged.",
+                            "lag": self.retry_after,
+                        }
+                    },
+                    headers={"Retry-After": self.retry_after, "X-Database-Lag": 1},
+                )
+            else:
+                self._send(
+                    handler,
+                    self.error_code,
+                    {"error": {"code": "synthetic-error"}},
+                    headers={"Retry-After": self.retry_after},
+                )
+            return
+
+        if parsed.path.startswith("/wiki/Special:EntityData/"):
+            pq_id = parsed.path.split("/")[-1].split(".")[0]
+            if pq_id in self.redirects:
+                self._send(
+                    handler,
+                    303,
+                    None,
+                    headers={
+                        "Location": f"/wiki/Special:EntityData/{self.redirects[pq_id]}.json"
+                    },
+                )
+            elif pq_id in self.ents:
+                self._count_served([pq_id])
+                self._send(handler, 200, {"entities": {pq_id: self.ents[pq_id]}})
+            else:
+                self._send(handler, 400, {"error": "Invalid ID"})
+
+        elif parsed.path == "/w/api.php" and params.get("action") == "wbgetentities":
+            ids = [i for i in params.get("ids", "").split("|") if i]
+            props = params["props"].split("|") if "props" in params else None
+            languages = (
+                params["languages"].split("|") if "languages" in params else None
+            )
+
+            ents = {}
+            for pq_id in ids:
+                if pq_id in self.ents:
+                    ents[pq_id] = fetch_utils.filter_ent_props(
+                        self.ents[pq_id], props=props, languages=languages
+                    )
+                else:
+                    ents[pq_id] = {"id": pq_id, "missing": ""}
+
+            self._count_served([i for i in ids if "missing" not in ents[i]])
+            self._send(handler, 200, {"entities": ents, "success": 1})
+
+        elif parsed.path == "/sparql" and "query" in params:
+            bindings = self._sparql_bindings(params["query"])
+            self._send(
+                handler,
+                200,
+                {
+                    "head": {
+                        "vars": ["item", "statement", "value", "unit", "precision"]
+                        + [
+                            v
+                            for t_pid in ["P585", "P580", "P582"]
+                            for v in [t_pid, f"{t_pid}_precision"]
+                        ]
+                    },
+                    "results": {"bindings": bindings},
+                },
+            )
+
+        else:
+            self._send(handler, 404, {"error": "Unknown endpoint"})
+
+    def _sparql_bindings(self, query):
+        """
+        Answers a query generated by sparql_utils.gen_prop_query with the bindings of the matching statements.
+
+        Note: statement IRIs are UUIDs as on Wikidata, so statements aren't ordered as their claims are,
+        somevalue statements have blank node values, and quantities without units have the unit 'Q199'.
+        """
+        entity_prefix = "http://www.wikidata.org/entity/"
+        xsd_prefix = "http://www.w3.org/2001/XMLSchema#"
+        pid = re.search(r"\?item p:(P\d+) \?statement", query).group(1)
+        qids = re.findall(
+            r"wd:(Q\d+)", re.search(r"VALUES \?item \{([^}]*)\}", query).group(1)
+        )
+        page = re.search(r"LIMIT (\d+) OFFSET (\d+)", query)
+
+        def time_binding(snak):
+            return {
+                "type": "literal",
+                "datatype": xsd_prefix + "dateTime",
+                "value": snak["datavalue"]["value"]["time"].lstrip("+"),
+            }
+
+        def precision_binding(snak):
+            return {
+                "type": "literal",
+                "datatype": xsd_prefix + "integer",
+                "value": str(snak["datavalue"]["value"]["precision"]),
+            }
+
+        bindings = []
+        for q in sorted(set(qids), key=lambda q: entity_prefix + q):
+            if q not in self.ents:
+                continue
+
+            for i, claim in enumerate(self.ents[q]["claims"].get(pid, [])):
+                datavalue = claim["mainsnak"].get("datavalue")
+                if claim["mainsnak"].get("snaktype") == "somevalue":
+                    value = {"type": "bnode", "value": f"t{q}{pid}{i}"}
+                elif datavalue is None:
+                    continue
+
+                elif datavalue["type"] == "wikibase-entityid":
+                    value = {
+                        "type": "uri",
+                        "value": entity_prefix + datavalue["value"]["id"],
+                    }
+                elif datavalue["type"] == "quantity":
+                    value = {
+                        "type": "literal",
+                        "datatype": xsd_prefix + "decimal",
+                        "value": datavalue["value"]["amount"].lstrip("+"),
+                    }
+                elif datavalue["type"] == "time":
+                    value = time_binding(claim["mainsnak"])
+                else:
+                    value = {"type": "literal", "value": datavalue["value"]}
+
+                statement_uuid = str(uuid.uuid5(uuid.NAMESPACE_URL, f"{q}${pid}${i}"))
+                binding = {
+                    "item": {"type": "uri", "value": entity_prefix + q},
+                    "statement": {
+                        "type": "uri",
+                        "value": f"{entity_prefix}statement/{q}-{statement_uuid.upper()}",
+                    },
+                    "value": value,
+                }
+                if value.get("datatype") == xsd_prefix + "decimal":
+                    unit = datavalue["value"]["unit"]
+                    binding["unit"] = {
+                        "type": "uri",
+                        "value": entity_prefix + "Q199" if unit == "1" else unit,
+                    }
+                elif value.get("datatype") == xsd_prefix + "dateTime":
+                    binding["precision"] = precision_binding(claim["mainsnak"])
+
+                for t_pid in ["P585", "P580", "P582"]:
+                    snaks = claim.get("qualifiers", {}).get(t_pid, [])
+                    if snaks:
+                        binding[t_pid] = time_binding(snaks[0])
+                        binding[f"{t_pid}_precision"] = precision_binding(snaks[0])
+
+                bindings.append(binding)
+
+        # ORDER BY ?item ?statement
+        bindings.sort(key=lambda b: (b["item"]["value"], b["statement"]["value"]))
+        if page is not None:
+            limit, offset = int(page.group(1)), int(page.group(2))
+            bindings = bindings[offset : offset + limit]
+
+        return bindings
+
+    def _count_served(self, pq_ids):
+        with self._lock:
+            self.n_ents_served += len(pq_ids)
+            self.requested_ids.extend(pq_ids)
@@ -5,11 +5,25 @@
 Utility functions for accessing and storing Wikidata information.
 
 Contents
+    set_transport,
+    set_pid_cache_dir,
+    set_lbl_languages,
+    set_max_lbls,
+    _trim_lbls,
+    pid_to_lbl_dict,
+    project_ent,
+    fetch_ent,
     load_ent,
+    load_pid_ent,
     check_in_ents_dict,
+    load_ents,
     is_wd_id,
     prop_has_many_entries,
+    _pick_lbl,
+    resolve_lbls,
+    prefetch_prop_lbls,
     get_lbl,
+    get_val_lbl,
     get_prop,
     get_prop_id,
     get_prop_lbl,
@@ -34,22 +48,369 @@
     t_to_prop_val_dict,
     t_to_prop_val_dict_dict
 
+    _Flight Class
+        __init__
+
     EntitiesDict Class
         __init__,
         __repr__,
         __str__,
+        __contains__,
+        __iter__,
+        __getitem__,
+        __setitem__,
+        __delitem__,
+        __eq__,
+        __ne__,
+        __or__,
+        __ior__,
+        get,
+        pop,
+        popitem,
+        setdefault,
+        copy,
+        __copy__,
+        discard,
+        items,
+        values,
+        update,
+        clear,
+        _ent_size,
+        _evict,
+        _in_store,
+        _store_lbls,
+        _stored_revision,
+        set_projection,
+        refresh,
         key_lbls,
+        _record_hit,
+        _record_fetch,
+        _record_coalesced,
+        _record_lbl_fetch,
+        stats,
+        reset_stats,
+        export_stats,
         _print
 """
 
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from collections.abc import ItemsView, Mapping, ValuesView
+from itertools import islice
 from datetime import date, datetime
 
 import numpy as np
 from wikidata.client import Client
 from wikirepo import utils
-from wikirepo.data import time_utils
+from wikirepo.data import coverage_utils, fetch_utils, prof_utils, time_utils
 
 client = Client()
+# All fetches are rate limited and retried over keep-alive connections, with wbgetentities requests
+# backing off when Wikidata is lagged.
+transport = fetch_utils.ScheduledTransport(
+    fetch_utils.PooledTransport(base_url=client.base_url, maxlag=5)
+)
+
+# Property entities are shared by all EntitiesDicts as they don't vary between queries.
+pid_ents = {}
+# A directory in which property entities are persisted between sessions, with None for memory only.
+pid_cache_dir = os.environ.get("WIKIREPO_PID_CACHE_DIR")
+
+# Labels of entities that are only needed for their labels (ex: values of properties), indexed by
+# QID and then language. These are kept apart from EntitiesDicts so full entities needn't be stored.
+lbls_dict = {}
+# The maximum number of entities whose labels are kept in lbls_dict, with the oldest being dropped first.
+max_lbls = 100000
+# The languages of labels in order of preference.
+lbl_languages = ["en", "de"]
+
+# Fetches that are in progress, indexed by transport and id, so that concurrent fetches of an id share one request.
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+# Properties that projected entities always keep: 'P150' (contains administrative territorial entity)
+# for sub-locations, and 'P2633' (geography of topic) and 'P8744' (economy of topic) for topic pages.
+structural_pids = ["P150", "P2633", "P8744"]
+
+# The topic page properties of directories, whose values are checked for properties that locations don't have.
+topic_pids = {"economic": "P8744", "geographic": "P2633"}
+
+
+def set_transport(new_transport=None):
+    """
+    Sets the transport through which all entities are fetched.
+
+    Parameters
+    ----------
+        new_transport : fetch_utils transport (default=None: a fetch_utils.ScheduledTransport of Wikidata)
+            An object with get(pq_id) and get_many(pq_ids, props=None, languages=None) methods that return entities.
+
+            Note 1: fetch_utils.RecordTransport and fetch_utils.ReplayTransport allow for offline use.
+
+            Note 2: wrap other transports in fetch_utils.ScheduledTransport for rate limiting and retries.
+
+    Returns
+    -------
+        old_transport : fetch_utils transport
+            The previous transport so that it can be reset.
+    """
+    global transport
+    old_transport = transport
+    if new_transport is None:
+        new_transport = fetch_utils.ScheduledTransport(
+            fetch_utils.PooledTransport(base_url=client.base_url, maxlag=5)
+        )
+
+    transport = new_transport
+    # Entities and labels could differ for the new transport.
+    pid_ents.clear()
+    lbls_dict.clear()
+
+    return old_transport
+
+
+def set_pid_cache_dir(cache_dir=None):
+    """
+    Sets the directory in which property entities are persisted between sessions.
+
+    Parameters
+    ----------
+        cache_dir : str (default=None: memory only)
+            The directory to which property entities are written as '{pid}.json.gz'.
+
+            Note: the WIKIREPO_PID_CACHE_DIR environment variable sets the initial directory.
+
+    Returns
+    -------
+        old_cache_dir : str or None
+            The previous directory so that it can be reset.
+    """
+    global pid_cache_dir
+    old_cache_dir = pid_cache_dir
+    pid_cache_dir = cache_dir
+
+    return old_cache_dir
+
+
+def set_lbl_languages(languages=None):
+    """
+    Sets the languages of labels in order of preference.
+
+    Parameters
+    ----------
+        languages : list (contains strs) (default=None: ['en', 'de'])
+            Language codes, with the first that an entity has a label for being used.
+
+    Returns
+    -------
+        old_languages : list (contains strs)
+            The previous languages so that they can be reset.
+    """
+    global lbl_languages
+    old_languages = lbl_languages
+    if languages is None:
+        languages = ["en", "de"]
+
+    lbl_languages = list(languages)
+    lbls_dict.clear()  # cached labels only include the previous languages
+
+    return old_languages
+
+
+def set_max_lbls(n_lbls=100000):
+    """
+    Sets the maximum number of entities whose labels are kept in wd_utils.lbls_dict.
+
+    Parameters
+    ----------
+        n_lbls : int (default=100000)
+            The number of entities, with the labels that were fetched first being dropped once it's exceeded.
+
+    Returns
+    -------
+        old_max_lbls : int
+            The previous maximum so that it can be reset.
+    """
+    assert n_lbls > 0, "'n_lbls' must be positive."
+    global max_lbls
+    old_max_lbls = max_lbls
+    max_lbls = n_lbls
+    _trim_lbls()
+
+    return old_max_lbls
+
+
+def _trim_lbls():
+    """
+    Drops the labels that were fetched first from wd_utils.lbls_dict until it has at most wd_utils.max_lbls entities.
+    """
+    n_over = len(lbls_dict) - max_lbls
+    if n_over > 0:
+        for q in list(islice(lbls_dict, n_over)):
+            del lbls_dict[q]
+
+
+def pid_to_lbl_dict():
+    """
+    Queries a dictionary that links the PIDs used by wikirepo.data to their English labels.
+
+    Note: wd_utils.get_lbl uses these labels so that property entities needn't be fetched.
+    """
+    return {
+        "P6": "head of government",
+        "P17": "country",
+        "P30": "continent",
+        "P36": "capital",
+        "P150": "contains the administrative territorial entity",
+        "P172": "ethnic group",
+        "P297": "ISO 3166-1 alpha-2 code",
+        "P300": "ISO 3166-2 code",
+        "P463": "member of",
+        "P580": "start time",
+        "P582": "end time",
+        "P585": "point in time",
+        "P1081": "Human Development Index",
+        "P1082": "population",
+        "P1107": "proportion",
+        "P1125": "Gini coefficient",
+        "P1198": "unemployment rate",
+        "P1279": "inflation rate",
+        "P1552": "has characteristic",
+        "P2046": "area",
+        "P2131": "nominal GDP",
+        "P2132": "nominal GDP per capita",
+        "P2134": "total reserves",
+        "P2250": "life expectancy",
+        "P2299": "PPP GDP per capita",
+        "P2573": "number of out-of-school children",
+        "P2633": "geography of topic",
+        "P3529": "median income",
+        "P4010": "GDP (PPP)",
+        "P6897": "literacy rate",
+        "P8476": "BTI Governance Index",
+        "P8477": "BTI Status Index",
+        "P8744": "economy of topic",
+    }
+
+
+def project_ent(ent, pids=None, languages=None):
+    """
+    Strips an entity down to the labels and claims that are needed for a query.
+
+    Parameters
+    ----------
+        ent : dict
+            A Wikidata entity.
+
+        pids : list (contains strs) (default=None: all claims)
+            The properties whose claims should be kept, along with wd_utils.structural_pids.
+
+        languages : list (contains strs) (default=None: all labels)
+            The languages whose labels should be kept.
+
+    Returns
+    -------
+        projected_ent : dict
+            The entity without sitelinks, descriptions, aliases and the claims and labels not asked for.
+    """
+    projected_ent = {
+        k: ent[k] for k in ["type", "id", "lastrevid", "modified"] if k in ent
+    }
+    projected_ent["labels"] = {
+        lang: lbl
+        for lang, lbl in ent.get("labels", {}).items()
+        if languages is None or lang in languages
+    }
+    projected_ent["claims"] = {
+        pid: claims
+        for pid, claims in ent.get("claims", {}).items()
+        if pids is None or pid in pids or pid in structural_pids
+    }
+
+    return projected_ent
+
+
+def fetch_ent(pq_id, ents_dict=None, cached=True):
+    """
+    Fetches an entity through the current transport.
+
+    Parameters
+    ----------
+        pq_id : str
+            The Wikidata id of the entity.
+
+        ents_dict : wd_utils.EntitiesDict : optional (default=None)
+            A dictionary whose fetch statistics should be updated.
+
+        cached : bool (default=True)
+            Whether the entity will be stored in ents_dict, or is fetched each time (ex: PIDs).
+
+    Returns
+    -------
+        ent : dict
+            The entity of pq_id.
+
+    Notes
+    -----
+        Concurrent fetches of the same id are coalesced, with all callers waiting on the first's request.
+    """
+    # Fetches through different transports (ex: of different Wikibase instances) aren't coalesced.
+    fetch_transport = transport
+    flight_key = (fetch_transport, pq_id)
+    with _in_flight_lock:
+        flight = _in_flight.get(flight_key)
+        is_leader = flight is None
+        if is_leader:
+            flight = _in_flight[flight_key] = _Flight()
+
+    if not is_leader:
+        flight.done.wait()
+        if isinstance(ents_dict, EntitiesDict):
+            ents_dict._record_coalesced()
+        if flight.error is not None:
+            raise flight.error
+
+        return flight.ent
+
+    try:
+        with prof_utils.stage("fetch") as fetch_stage:
+            start = time.perf_counter()
+            ent, n_bytes = fetch_utils.get_sized(fetch_transport, pq_id)
+            fetch_time = time.perf_counter() - start
+            fetch_stage.rows = 1
+
+        flight.ent = ent
+
+    except Exception as e:
+        flight.error = e
+        raise e
+
+    finally:
+        with _in_flight_lock:
+            del _in_flight[flight_key]
+        flight.done.set()
+
+    if isinstance(ents_dict, EntitiesDict):
+        # Transports can download compressed entities, so their decoded size is also recorded.
+        ents_dict._record_fetch(
+            pq_id=pq_id,
+            fetch_time=fetch_time,
+            n_bytes=n_bytes,
+            cached=cached,
+            ent_bytes=(
+                len(json.dumps(ent, separators=(",", ":")).encode("utf-8"))
+                if ent is not None
+                else 0
+            ),
+        )
+
+    return ent
 
 
 def load_ent(ents_dict, pq_id):
@@ -57,19 +418,94 @@ def load_ent(ents_dict, pq_id):
     Loads an entity.
     """
     if pq_id[0] == "Q":
-        if pq_id not in ents_dict.keys():
+        if pq_id not in ents_dict:
             check_in_ents_dict(ents_dict, pq_id)
+
+        elif isinstance(ents_dict, EntitiesDict):
+            ents_dict._record_hit()
+
         return ents_dict[pq_id]
 
-    return client.get(pq_id, load=True).data
+    return load_pid_ent(ents_dict, pq_id)
+
+
+def load_pid_ent(ents_dict, pid):
+    """
+    Loads a property entity from the shared cache, the persistent cache, or the transport.
+    """
+    if pid in pid_ents:
+        if isinstance(ents_dict, EntitiesDict):
+            ents_dict._record_hit()
+
+        return pid_ents[pid]
+
+    if pid_cache_dir is not None and os.path.exists(
+        fetch_utils.fixture_path(pid_cache_dir, pid)
+    ):
+        ent = fetch_utils.read_fixture(pid_cache_dir, pid)
+        if isinstance(ents_dict, EntitiesDict):
+            ents_dict._record_hit()
+
+    else:
+        ent = fetch_ent(pid, ents_dict=ents_dict, cached=False)
+        if pid_cache_dir is not None and ent is not None:
+            fetch_utils.write_fixture(pid_cache_dir, pid, ent)
+
+    pid_ents[pid] = ent
+
+    return ent
 
 
 def check_in_ents_dict(ents_dict, qid):
     """
     Checks an the provided entity dictionary and adds to it if not present.
     """
-    if ents_dict is not None and qid not in ents_dict.keys():
-        ents_dict[qid] = client.get(qid, load=True).data
+    if ents_dict is not None and qid not in ents_dict:
+        ents_dict[qid] = fetch_ent(qid, ents_dict=ents_dict)
+
+
+def load_ents(ents_dict, qids):
+    """
+    Loads the entities of QIDs, fetching those that aren't in ents_dict in batches.
+
+    Parameters
+    ----------
+        ents_dict : wd_utils.EntitiesDict
+            A dictionary to which fetched entities are added and whose stats are updated.
+
+        qids : list (contains strs)
+            Wikidata QIDs.
+
+    Returns
+    -------
+        n_fetched : int
+            The number of entities that were fetched.
+
+            Note: QIDs that Wikidata doesn't return are left to be fetched individually when loaded.
+    """
+    qids_to_fetch = [q for q in dict.fromkeys(qids) if q not in ents_dict]
+    if not qids_to_fetch:
+        return 0
+
+    with prof_utils.stage("fetch_batch") as batch_stage:
+        start = time.perf_counter()
+        ents = transport.get_many(qids_to_fetch)
+        fetch_time = (time.perf_counter() - start) / len(qids_to_fetch)
+        batch_stage.rows = len(ents)
+
+    for q in qids_to_fetch:
+        if ents.get(q) is not None:
+            if isinstance(ents_dict, EntitiesDict):
+                ents_dict._record_fetch(
+                    pq_id=q,
+                    fetch_time=fetch_time,
+                    n_bytes=len(
+                        json.dumps(ents[q], separators=(",", ":")).encode("utf-8")
+                    ),
+                )
+            ents_dict[q] = ents[q]
+
+    return len(ents)
 
 
 def is_wd_id(var):
@@ -99,23 +535,138 @@ def prop_has_many_entries(prop_ent):
 def print_not_available(ents_dict=None, qid=None, pid=None, extra_msg=""):
     """
     Notify the user that a given property is not available for a given subject.
+
+    Note: queries instead record missing data via coverage_utils.record_missing, which doesn't fetch labels.
     """
     print(
         f"{get_lbl(ents_dict, qid)} '{qid}' currently does not have the '{get_lbl(ents_dict, pid)}' property '{pid}'{extra_msg}."
     )
 
 
+def _pick_lbl(lbls, pq_id):
+    """
+    Picks a label by the order of wd_utils.lbl_languages from a dictionary of labels indexed by language.
+    """
+    for lang in lbl_languages:
+        if lang in lbls:
+            lbl = lbls[lang]
+            return lbl["value"] if isinstance(lbl, dict) else lbl
+
+    raise KeyError(f"'{pq_id}' does not have a label in {', '.join(lbl_languages)}.")
+
+
+def resolve_lbls(qids, ents_dict=None):
+    """
+    Resolves the labels of QIDs, fetching only the labels of those that haven't been loaded.
+
+    Parameters
+    ----------
+        qids : list (contains strs)
+            Wikidata QIDs.
+
+        ents_dict : wd_utils.EntitiesDict : optional (default=None)
+            A dictionary whose entities are used if loaded and whose stats are updated.
+
+    Returns
+    -------
+        qid_lbls : dict
+            A dictionary of labels indexed by QID, with None for those without a label in wd_utils.lbl_languages.
+    """
+    qids_to_fetch = []
+    for q in dict.fromkeys(qids):
+        if q in lbls_dict or (ents_dict is not None and q in ents_dict):
+            continue
+
+        store_lbls = (
+            ents_dict._store_lbls(q) if isinstance(ents_dict, EntitiesDict) else None
+        )
+        if store_lbls is not None:
+            lbls_dict[q] = store_lbls
+        else:
+            qids_to_fetch.append(q)
+
+    if qids_to_fetch:
+        with prof_utils.stage("fetch_lbls") as lbls_stage:
+            ents = transport.get_many(
+                qids_to_fetch, props=["labels"], languages=lbl_languages
+            )
+            lbls_stage.rows = len(ents)
+
+        for q in qids_to_fetch:
+            lbls_dict[q] = {
+                lang: lbl["value"]
+                for lang, lbl in ents.get(q, {}).get("labels", {}).items()
+            }
+
+        if isinstance(ents_dict, EntitiesDict):
+            ents_dict._record_lbl_fetch(n_lbls=len(qids_to_fetch))
+
+    qid_lbls = {}
+    for q in qids:
+        if ents_dict is not None and q in ents_dict:
+            lbls = ents_dict[q]["labels"]
+        else:
+            lbls = lbls_dict[q]
+
+        try:
+            qid_lbls[q] = _pick_lbl(lbls, q)
+        except KeyError:
+            qid_lbls[q] = None
+
+    _trim_lbls()
+
+    return qid_lbls
+
+
+def prefetch_prop_lbls(ents_dict, qids, pid, sub_pid=None):
+    """
+    Resolves the labels of all QID values of a property and its qualifier for locations in a single batch.
+    """
+    val_qids = []
+    for q in qids:
+        for claim in load_ent(ents_dict, q)["claims"].get(pid, []):
+            snaks = [claim["mainsnak"]]
+            if isinstance(sub_pid, str):
+                snaks += claim.get("qualifiers", {}).get(sub_pid, [])
+
+            for snak in snaks:
+                val = snak.get("datavalue", {}).get("value")
+                if isinstance(val, dict) and "id" in val:
+                    val_qids.append(val["id"])
+
+    if val_qids:
+        resolve_lbls(val_qids, ents_dict=ents_dict)
+
+
 def get_lbl(ents_dict=None, pq_id=None):
     """
-    Gets an English label of a Wikidata entity.
+    Gets a label of a Wikidata entity given the languages in wd_utils.lbl_languages (default English then German).
     """
     if ents_dict is None and pq_id is None:
         return
 
-    try:
-        return load_ent(ents_dict, pq_id)["labels"]["en"]["value"]
-    except KeyError:
-        return load_ent(ents_dict, pq_id)["labels"]["de"]["value"]
+    if pq_id[0] == "P":
+        pid_lbl = pid_to_lbl_dict().get(pq_id)
+        if pid_lbl is not None and lbl_languages[0] == "en":
+            return pid_lbl
+
+    return _pick_lbl(load_ent(ents_dict, pq_id)["labels"], pq_id)
+
+
+def get_val_lbl(ents_dict, qid):
+    """
+    Gets a label of a Wikidata entity that's the value of a property.
+
+    Note: only the label is fetched if the entity isn't in ents_dict.
+    """
+    if qid in ents_dict:
+        return get_lbl(ents_dict=ents_dict, pq_id=qid)
+
+    lbl = resolve_lbls([qid], ents_dict=ents_dict)[qid]
+    if lbl is None:
+        raise KeyError(f"'{qid}' does not have a label in {', '.join(lbl_languages)}.")
+
+    return lbl
 
 
 def get_prop(ents_dict, qid, pid):
@@ -139,9 +690,9 @@ def get_prop_lbl(ents_dict, qid, pid, i):
     """
     Gets a label of an indexed property label of a Wikidata entity.
     """
-    return get_lbl(
+    return get_val_lbl(
         ents_dict=ents_dict,
-        pq_id=get_prop_id(ents_dict=ents_dict, qid=qid, pid=pid, i=i),
+        qid=get_prop_id(ents_dict=ents_dict, qid=qid, pid=pid, i=i),
     )
 
 
@@ -151,9 +702,9 @@ def get_prop_val(ents_dict, qid, pid, i, ignore_char=""):
     """
     try:
         # Check to see if the value is a QID.
-        val = get_lbl(
+        val = get_val_lbl(
             ents_dict=ents_dict,
-            pq_id=get_prop(ents_dict=ents_dict, qid=qid, pid=pid)[i]["mainsnak"][
+            qid=get_prop(ents_dict=ents_dict, qid=qid, pid=pid)[i]["mainsnak"][
                 "datavalue"
             ]["value"]["id"],
         ).replace(ignore_char, "")
@@ -216,9 +767,9 @@ def get_prop_qualifier_val(ents_dict, qid, pid, sub_pid, i, ignore_char=""):
     """
     try:
         # Check to see if the value is a QID.
-        val = get_lbl(
+        val = get_val_lbl(
             ents_dict=ents_dict,
-            pq_id=get_prop(ents_dict=ents_dict, qid=qid, pid=pid)[i]["qualifiers"][
+            qid=get_prop(ents_dict=ents_dict, qid=qid, pid=pid)[i]["qualifiers"][
                 sub_pid
             ][0]["datavalue"]["value"]["id"],
         ).replace(ignore_char, "")
@@ -410,10 +961,8 @@ def dir_to_topic_page(dir_name=None, ents_dict=None, qid=None):
             The qid for an existing topic for the location or None to cancel later steps.
     """
     # Needs sub-topics for other wikirepo directories.
-    name_to_topic_pid_dict = {"economic": "P8744", "geographic": "P2633"}
-
-    if dir_name in name_to_topic_pid_dict:
-        topic_pid = name_to_topic_pid_dict[dir_name]
+    if dir_name in topic_pids:
+        topic_pid = topic_pids[dir_name]
 
         if topic_pid in load_ent(ents_dict, qid)["claims"].keys():
             return get_prop_id(ents_dict, qid, topic_pid, i=0)
@@ -490,7 +1039,7 @@ def check_for_pid_topic_page(
         qid = topic_qid
 
     else:
-        print_not_available(ents_dict=ents_dict, qid=qid, pid=pid, extra_msg="")
+        coverage_utils.record_missing(qid=qid, pid=pid, reason="missing_property")
         # Assign no date for on interval or the most recent time in the
         # timespan with np.nan as a placeholder.
         if interval is None and timespan is None:
@@ -578,6 +1127,8 @@ def t_to_prop_val_dict(
             A dictionary of Wikidata properties indexed by their time.
     """
     qids = utils._make_var_list(qids)[0]
+    # Labels of QID values are resolved in a single batch rather than by fetching each value's entity.
+    prefetch_prop_lbls(ents_dict=ents_dict, qids=qids, pid=pid, sub_pid=sub_pid)
 
     if interval != None:
         included_times = [
@@ -644,6 +1195,11 @@ def t_to_prop_val_dict(
                     if included_times is None or t in included_times:
                         t_p_d[t] = get_val(ents_dict, q, pid, sub_pid, i, ignore_char)
 
+        if skip_assignment == False and not t_p_d:
+            coverage_utils.record_missing(
+                qid=orig_qid or q, pid=pid, reason="no_values_in_timespan"
+            )
+
         if orig_qid is None:
             t_prop_dict[q] = t_p_d
         else:
@@ -713,6 +1269,8 @@ def t_to_prop_val_dict_dict(
             A dictionary of Wikidata properties indexed by their time.
     """
     qids = utils._make_var_list(qids)[0]
+    # Labels of QID values are resolved in a single batch rather than by fetching each value's entity.
+    prefetch_prop_lbls(ents_dict=ents_dict, qids=qids, pid=pid, sub_pid=sub_pid)
 
     if interval is None:
         # Triggers acceptance of a all values so that the most recent can be selected.
@@ -783,6 +1341,11 @@ def t_to_prop_val_dict_dict(
                             get_prop_val(ents_dict, q, pid, i, ignore_char)
                         ] = get_val(ents_dict, q, pid, sub_pid, i, ignore_char)
 
+        if skip_assignment == False and not t_p_d:
+            coverage_utils.record_missing(
+                qid=orig_qid or q, pid=pid, reason="no_values_in_timespan"
+            )
+
         if orig_qid is None:
             t_prop_dict[q] = t_p_d
         else:
@@ -791,17 +1354,107 @@ def t_to_prop_val_dict_dict(
     return t_prop_dict
 
 
+class _Flight:
+    """
+    A fetch in progress whose result is shared with the callers waiting on it.
+    """
+
+    __slots__ = ["done", "ent", "error"]
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.ent = None
+        self.error = None
+
+
+# The value of entities that have been evicted from an EntitiesDict to its spill directory.
+_spilled_ent = object()
+
+
 class EntitiesDict(dict):
     """
     A dictionary for storing WikiData entities.
 
     Keywords are QIDs, and values are QID entities.
+
+    Parameters
+    ----------
+        max_bytes : int (default=None: no limit)
+            The size of entities that are kept in memory, with the least recently used being evicted to disk.
+
+            Note: sizes are those of downloaded JSON, which is several times less than their size in memory.
+
+        spill_dir : str (default=None: a temporary directory)
+            The directory that evicted entities are written to and reloaded from.
+
+        store : store_utils.EntityStore (default=None)
+            A read-only store that entities are loaded from before being fetched.
+
+            Note: entities from the store are never written to spill_dir, as they're reloaded from the store.
+            Entities that the store only has labels for are fetched when loaded.
+
+        checkpoint_dir : str (default=None)
+            A directory that fetched entities are written to as they're stored, and that entities
+            from earlier sessions are loaded from on access so that interrupted queries can resume.
+
+            Note: this is also the spill directory if max_bytes is set.
     """
 
-    __slots__ = ()
+    __slots__ = (
+        "_stats",
+        "_projection",
+        "_projected",
+        "_max_bytes",
+        "_spill_dir",
+        "_on_disk",
+        "_store",
+        "_from_store",
+        "_stale",
+        "_checkpoint",
+        "_lru",
+        "_n_resident_bytes",
+        "_last_fetch",
+        "_lock",
+        "__weakref__",
+    )
 
-    def __init__(self, *args, **kwargs):
-        super(EntitiesDict, self).__init__(*args, **kwargs)
+    def __init__(
+        self,
+        *args,
+        max_bytes=None,
+        spill_dir=None,
+        store=None,
+        checkpoint_dir=None,
+        **kwargs,
+    ):
+        assert (
+            spill_dir is None or checkpoint_dir is None
+        ), "Entities are spilled to checkpoint_dir, so please only pass one of spill_dir and checkpoint_dir."
+
+        self._projection = None
+        # The projections that stored entities have been stripped to indexed by QID.
+        self._projected = {}
+        self._max_bytes = max_bytes
+        self._spill_dir = spill_dir if checkpoint_dir is None else checkpoint_dir
+        self._on_disk = set()
+        self._store = store
+        self._from_store = set()
+        # QIDs whose entities in the store are outdated, and so are fetched instead.
+        self._stale = set()
+        self._checkpoint = checkpoint_dir is not None
+        # Resident QIDs and their sizes from least to most recently used.
+        self._lru = OrderedDict()
+        self._n_resident_bytes = 0
+        self._last_fetch = None
+        self._lock = threading.RLock()
+        self.reset_stats()
+        super(EntitiesDict, self).__init__()
+        if self._checkpoint:
+            for qid in fetch_utils.ReplayTransport(checkpoint_dir).recorded_ids():
+                super(EntitiesDict, self).__setitem__(qid, _spilled_ent)
+                self._on_disk.add(qid)
+
+        self.update(*args, **kwargs)
 
     def __repr__(self):
         return "%s" % self.__class__
@@ -815,16 +1468,658 @@ def __str__(self):
     Because of the potential size, print() has been disabled.
 
     All other dictionary methods are included, as well as:
+        set_projection - strips stored entities down to the claims and labels a query needs
+        refresh - re-downloads the entities whose revisions have changed
+        discard - removes entities so that they're fetched again, including those of the store
         key_lbls - a list of labels of the QID keys
+        stats - counts and timings of fetches and cache lookups
+        reset_stats - sets all statistics to zero
+        export_stats - writes statistics in the Prometheus text format
         _print - prints the full dictionary
+
+    EntitiesDict(max_bytes=...) evicts the least recently used entities to disk and reloads them on demand.
+    EntitiesDict(store=...) loads entities from a store_utils.EntityStore on access, with the labels
+    of entities that the store only has labels for being used without their full entities being fetched.
+    EntitiesDict(checkpoint_dir=...) persists fetched entities so that interrupted queries resume.
+
+    Entities can be loaded and stored from many threads, with lookups, stores and statistics being
+    made under a lock. Other methods (ex: set_projection, refresh) should be called from one thread.
     """
 
+    def __contains__(self, qid):
+        return super(EntitiesDict, self).__contains__(qid) or self._in_store(qid)
+
+    def __iter__(self):
+        # Overriding dict.__iter__ has dict(), {**} and dict.update copy via keys and __getitem__,
+        # so spilled entities are loaded rather than their placeholder being copied.
+        return iter(self.keys())
+
+    def __getitem__(self, qid):
+        with self._lock:
+            if not super(EntitiesDict, self).__contains__(qid) and self._in_store(qid):
+                self._stats["n_store_reads"] += 1
+                self.__setitem__(qid, self._store[qid], _from_store=True)
+
+            ent = super(EntitiesDict, self).__getitem__(qid)
+            if ent is _spilled_ent:
+                if qid in self._from_store:
+                    ent = self._store[qid]
+                    self._stats["n_store_reads"] += 1
+                else:
+                    ent = fetch_utils.read_fixture(self._spill_dir, qid)
+                    self._stats["n_reloads"] += 1
+
+                self.__setitem__(
+                    qid,
+                    ent,
+                    _on_disk=qid in self._on_disk,
+                    _from_store=qid in self._from_store,
+                )
+                ent = super(EntitiesDict, self).__getitem__(qid)
+
+            elif qid in self._lru:
+                self._lru.move_to_end(qid)
+
+            return ent
+
+    def __setitem__(self, qid, ent, _on_disk=False, _from_store=False):
+        with self._lock:
+            if self._projection is not None and ent is not None:
+                ent = project_ent(ent, **self._projection)
+                self._projected[qid] = self._projection
+            else:
+                self._projected.pop(qid, None)
+
+            if qid in self._lru:
+                self._n_resident_bytes -= self._lru.pop(qid)
+            if not _on_disk:
+                self._on_disk.discard(qid)
+            if _from_store:
+                self._from_store.add(qid)
+            else:
+                self._from_store.discard(qid)
+
+            super(EntitiesDict, self).__setitem__(qid, ent)
+
+            if (
+                self._checkpoint
+                and not _on_disk
+                and not _from_store
+                and ent is not None
+            ):
+                fetch_utils.write_fixture(self._spill_dir, qid, ent)
+                self._on_disk.add(qid)
+
+            if self._max_bytes is not None:
+                self._lru[qid] = self._ent_size(qid, ent)
+                self._n_resident_bytes += self._lru[qid]
+                self._evict()
+
+    def __delitem__(self, qid):
+        with self._lock:
+            super(EntitiesDict, self).__delitem__(qid)
+            self._from_store.discard(qid)
+            self._projected.pop(qid, None)
+            if qid in self._lru:
+                self._n_resident_bytes -= self._lru.pop(qid)
+            if qid in self._on_disk:
+                self._on_disk.discard(qid)
+                os.remove(fetch_utils.fixture_path(self._spill_dir, qid))
+
+    def __eq__(self, other):
+        if not isinstance(other, Mapping):
+            return NotImplemented
+
+        return dict(self.items()) == dict(other.items())
+
+    def __ne__(self, other):
+        eq = self.__eq__(other)
+
+        return eq if eq is NotImplemented else not eq
+
+    def __or__(self, other):
+        if not isinstance(other, Mapping):
+            return NotImplemented
+
+        ents_dict = self.copy()
+        ents_dict.update(other)
+
+        return ents_dict
+
+    def __ior__(self, other):
+        self.update(other)
+
+        return self
+
+    def get(self, qid, default=None):
+        return self[qid] if qid in self else default
+
+    def pop(self, qid, *default):
+        # Only stored entities are removed, as store_utils.EntityStore is read-only.
+        if not super(EntitiesDict, self).__contains__(qid):
+            if default:
+                return default[0]
+
+            raise KeyError(qid)
+
+        ent = self[qid]
+        del self[qid]
+
+        return ent
+
+    def popitem(self):
+        if not len(self):
+            raise KeyError("popitem(): EntitiesDict is empty")
+
+        qid = next(reversed(self.keys()))
+
+        return qid, self.pop(qid)
+
+    def setdefault(self, qid, default=None):
+        if qid not in self:
+            self[qid] = default
+
+        return self[qid]
+
+    def copy(self):
+        """
+        Copies the dictionary with the same memory budget, store and projection.
+
+        Note: spilled entities are written to a new spill directory, and checkpoints aren't copied.
+        """
+        ents_dict = EntitiesDict(max_bytes=self._max_bytes, store=self._store)
+        ents_dict._projection = self._projection
+        for qid in list(self.keys()):
+            ents_dict.__setitem__(qid, self[qid], _from_store=qid in self._from_store)
+
+        ents_dict._projected = dict(self._projected)
+        ents_dict._stale = set(self._stale)
+
+        return ents_dict
+
+    def __copy__(self):
+        return self.copy()
+
+    def discard(self, qids):
+        """
+        Removes the entities of QIDs so that they're fetched again, with those of the store no longer being loaded from it.
+
+        Note: pop and del only remove the entities held by the dictionary, as the store is read-only.
+        """
+        for qid in utils._make_var_list(qids)[0]:
+            if super(EntitiesDict, self).__contains__(qid):
+                del self[qid]
+
+            if self._store is not None and qid in self._store:
+                self._stale.add(qid)
+
+    def items(self):
+        # Views that load spilled entities, rather than those of dict that have their placeholder.
+        return ItemsView(self)
+
+    def values(self):
+        return ValuesView(self)
+
+    def update(self, *args, **kwargs):
+        for qid, ent in dict(*args, **kwargs).items():
+            self[qid] = ent
+
+    def clear(self):
+        with self._lock:
+            super(EntitiesDict, self).clear()
+            self._lru.clear()
+            self._from_store.clear()
+            self._projected.clear()
+            self._n_resident_bytes = 0
+            # Checkpoints are kept so that later sessions can still resume from them.
+            if not self._checkpoint:
+                for qid in self._on_disk:
+                    os.remove(fetch_utils.fixture_path(self._spill_dir, qid))
+            self._on_disk.clear()
+
+    def _ent_size(self, qid, ent):
+        """
+        Estimates the size of an entity, using the bytes downloaded for it if it was just fetched.
+        """
+        if ent is None:
+            return 0
+
+        if (
+            self._last_fetch is not None
+            and self._last_fetch[0] == qid
+            and self._projection is None
+        ):
+            return self._last_fetch[1]
+
+        return len(json.dumps(ent, separators=(",", ":")))
+
+    def _evict(self):
+        """
+        Writes the least recently used entities to the spill directory until the resident size is within max_bytes.
+
+        Note: the most recently used entity is always kept in memory.
+        """
+        while self._n_resident_bytes > self._max_bytes and len(self._lru) > 1:
+            qid, size = self._lru.popitem(last=False)
+            self._n_resident_bytes -= size
+            if qid not in self._on_disk and qid not in self._from_store:
+                if self._spill_dir is None:
+                    self._spill_dir = tempfile.mkdtemp(prefix="wikirepo_ents_")
+                    weakref.finalize(
+                        self, shutil.rmtree, self._spill_dir, ignore_errors=True
+                    )
+
+                fetch_utils.write_fixture(
+                    self._spill_dir, qid, super(EntitiesDict, self).__getitem__(qid)
+                )
+                self._on_disk.add(qid)
+
+            super(EntitiesDict, self).__setitem__(qid, _spilled_ent)
+            self._stats["n_evictions"] += 1
+
+    def _in_store(self, qid):
+        """
+        Checks whether the full entity of a QID can be loaded from the store, which it can't once discarded.
+        """
+        return (
+            self._store is not None
+            and qid not in self._stale
+            and self._store.is_full_ent(qid)
+        )
+
+    def _store_lbls(self, qid):
+        """
+        Returns the labels of a QID that the store only has labels for indexed by language, or None.
+        """
+        if (
+            self._store is None
+            or qid in self._stale
+            or qid not in self._store
+            or self._store.is_full_ent(qid)
+        ):
+            return None
+
+        self._stats["n_store_reads"] += 1
+
+        return {lang: lbl["value"] for lang, lbl in self._store[qid]["labels"].items()}
+
+    def _stored_revision(self, qid):
+        """
+        Returns the revision id of a stored entity, reading spilled and store entities without reloading them.
+        """
+        if not super(EntitiesDict, self).__contains__(qid):
+            ent = self._store[qid]
+            self._stats["n_store_reads"] += 1
+
+        else:
+            ent = super(EntitiesDict, self).__getitem__(qid)
+            if ent is _spilled_ent and qid in self._from_store:
+                ent = self._store[qid]
+                self._stats["n_store_reads"] += 1
+
+            elif ent is _spilled_ent:
+                ent = fetch_utils.read_fixture(self._spill_dir, qid)
+                self._stats["n_reloads"] += 1
+
+        return None if ent is None else ent.get("lastrevid")
+
+    def set_projection(self, pids=None, languages=None):
+        """
+        Sets the claims and labels that entities are stripped down to when stored.
+
+        Notes
+        -----
+            Stored entities are stripped in place if they include the new projection, and those that
+            were stripped to a projection that doesn't include it are removed so that they're fetched
+            again with the parts they're missing. Entities that were stored in full are kept.
+
+        Parameters
+        ----------
+            pids : list (contains strs) (default=None: all claims)
+                The properties whose claims should be kept, along with wd_utils.structural_pids.
+
+            languages : list (contains strs) (default=None: all labels)
+                The languages whose labels should be kept.
+
+            Note: projection is turned off if both pids and languages are None.
+
+        Returns
+        -------
+            old_projection : dict or None
+                The previous projection as kwargs of set_projection so that it can be reset.
+        """
+        old_projection = self._projection
+        if pids is None and languages is None:
+            projection = None
+        else:
+            projection = {
+                "pids": None if pids is None else sorted(set(pids)),
+                "languages": None if languages is None else list(languages),
+            }
+
+        def _includes(ent_projection):
+            return projection is not None and all(
+                ent_projection[k] is None
+                or (
+                    projection[k] is not None
+                    and set(projection[k]) <= set(ent_projection[k])
+                )
+                for k in projection
+            )
+
+        for qid, ent_projection in list(self._projected.items()):
+            if not _includes(ent_projection):
+                del self[qid]
+
+        self._projection = projection
+        if projection is not None:
+            # Evicted entities are projected when they're reloaded.
+            for qid, ent in list(dict.items(self)):
+                if ent is not None and ent is not _spilled_ent:
+                    self.__setitem__(
+                        qid,
+                        ent,
+                        _on_disk=qid in self._on_disk,
+                        _from_store=qid in self._from_store,
+                    )
+
+        return old_projection
+
+    def refresh(self, qids=None):
+        """
+        Re-downloads the stored entities that have changed on Wikidata.
+
+        Notes
+        -----
+            Only the revision ids of entities are fetched in batches to find those that are stale,
+            with entities that no longer exist being removed.
+
+        Parameters
+        ----------
+            qids : list (contains strs) (default=None: all stored entities)
+                The QIDs to revalidate.
+
+        Returns
+        -------
+            refreshed_qids : list (contains strs)
+                The QIDs that were re-downloaded or removed.
+        """
+        if qids is None:
+            qids = [q for q in self.keys() if q[0] == "Q"]
+        else:
+            qids = [q for q in utils._make_var_list(qids)[0] if q in self]
+
+        with prof_utils.stage("refresh") as refresh_stage:
+            start = time.perf_counter()
+            infos = transport.get_many(qids, props=["info"])
+            self._stats["n_revalidated"] += len(qids)
+            self._stats["fetch_time_s"] += time.perf_counter() - start
+
+            revisions = {q: self._stored_revision(q) for q in qids}
+            stale_qids = [
+                q
+                for q in qids
+                if q not in infos
+                or revisions[q] is None
+                or infos[q].get("lastrevid") != revisions[q]
+            ]
+            if stale_qids:
+                start = time.perf_counter()
+                ents = transport.get_many(stale_qids)
+                self._stats["fetch_time_s"] += time.perf_counter() - start
+                for q in stale_qids:
+                    if q in ents:
+                        ent_bytes = len(
+                            json.dumps(ents[q], separators=(",", ":")).encode("utf-8")
+                        )
+                        self._stats["n_fetches"] += 1
+                        self._stats["n_bytes"] += ent_bytes
+                        self._stats["n_ent_bytes"] += ent_bytes
+                        self[q] = ents[q]
+
+                    else:
+                        self.discard(q)
+
+            self._stats["n_refreshed"] += len(stale_qids)
+            refresh_stage.rows = len(stale_qids)
+
+        return stale_qids
+
     def key_lbls(self):
         """
         Provides a list of the labels of all entities within the dictionary.
         """
         return [get_lbl(ents_dict=self, pq_id=q) for q in self.keys()]
 
+    def _record_hit(self):
+        """
+        Records that an entity was loaded from the dictionary.
+        """
+        with self._lock:
+            self._stats["n_hits"] += 1
+
+    def _record_fetch(self, pq_id, fetch_time, n_bytes, cached=True, ent_bytes=None):
+        """
+        Records a fetch of an entity, with cached fetches being misses of the dictionary.
+
+        Note: ent_bytes is the size of the entity's JSON, which is n_bytes if it wasn't compressed.
+        """
+        if ent_bytes is None:
+            ent_bytes = n_bytes
+
+        with self._lock:
+            self._stats["n_fetches"] += 1
+            self._stats["n_bytes"] += n_bytes
+            self._stats["n_ent_bytes"] += ent_bytes
+            self._last_fetch = (pq_id, ent_bytes)
+            self._stats["fetch_time_s"] += fetch_time
+            self._stats["fetch_latencies"][pq_id] = (
+                self._stats["fetch_latencies"].get(pq_id, 0.0) + fetch_time
+            )
+            if cached:
+                self._stats["n_misses"] += 1
+            else:
+                self._stats["n_uncached_fetches"] += 1
+
+    def _record_coalesced(self):
+        """
+        Records a fetch that shared the request of a concurrent fetch of the same id.
+        """
+        with self._lock:
+            self._stats["n_coalesced"] += 1
+
+    def _record_lbl_fetch(self, n_lbls):
+        """
+        Records a batched fetch of labels.
+        """
+        with self._lock:
+            self._stats["n_lbl_fetches"] += n_lbls
+
+    def stats(self):
+        """
+        Provides the fetch and cache statistics of the dictionary.
+
+        Returns
+        -------
+            stats : dict
+                n_ents : the number of stored entities
+                n_hits, n_misses : lookups of QIDs that were or weren't stored
+                n_uncached_fetches : fetches of entities that aren't stored in the dictionary (PIDs)
+                n_lbl_fetches : labels fetched via wd_utils.resolve_lbls rather than full entities
+                n_evictions, n_reloads : entities written to and read from the spill directory
+                n_store_reads : entities decoded from the store
+                n_coalesced : fetches that waited on a concurrent fetch of the same id
+                n_revalidated, n_refreshed : entities whose revisions were checked and that were re-downloaded
+                n_resident_ents, n_resident_bytes : entities in memory and their size if max_bytes is set
+                n_fetches, n_bytes, fetch_time_s : totals for all fetches, with n_bytes being downloaded bytes
+                n_ent_bytes : the size of the JSON of fetched entities, which is n_bytes before compression
+                hit_rate, mean_fetch_latency_s, max_fetch_latency_s : derived statistics
+                fetch_latencies : the total fetch time of each id
+        """
+        stats = {k: v for k, v in self._stats.items() if k != "fetch_latencies"}
+        stats["n_ents"] = len(self)
+        stats["n_resident_ents"] = len(self) - sum(
+            ent is _spilled_ent for ent in dict.values(self)
+        )
+        stats["n_resident_bytes"] = self._n_resident_bytes
+
+        n_lookups = stats["n_hits"] + stats["n_misses"]
+        stats["hit_rate"] = stats["n_hits"] / n_lookups if n_lookups else None
+
+        latencies = self._stats["fetch_latencies"].values()
+        stats["mean_fetch_latency_s"] = (
+            stats["fetch_time_s"] / stats["n_fetches"] if stats["n_fetches"] else None
+        )
+        stats["max_fetch_latency_s"] = max(latencies) if latencies else None
+        stats["fetch_latencies"] = dict(self._stats["fetch_latencies"])
+
+        return stats
+
+    def reset_stats(self):
+        """
+        Sets all fetch and cache statistics to zero.
+        """
+        self._stats = {
+            "n_hits": 0,
+            "n_misses": 0,
+            "n_uncached_fetches": 0,
+            "n_lbl_fetches": 0,
+            "n_evictions": 0,
+            "n_reloads": 0,
+            "n_store_reads": 0,
+            "n_coalesced": 0,
+            "n_revalidated": 0,
+            "n_refreshed": 0,
+            "n_fetches": 0,
+            "n_bytes": 0,
+            "n_ent_bytes": 0,
+            "fetch_time_s": 0.0,
+            "fetch_latencies": {},
+        }
+
+    def export_stats(self, path=None, prefix="wikirepo_ents", per_id=False):
+        """
+        Exports the statistics in the Prometheus text format (ex: for node_exporter's textfile collector).
+
+        Parameters
+        ----------
+            path : str (default=None)
+                A file to write the statistics to, which is replaced atomically.
+
+            prefix : str (default=wikirepo_ents)
+                The prefix of all metric names.
+
+            per_id : bool (default=False)
+                Whether to include the fetch latency of each id as a labeled metric.
+
+        Returns
+        -------
+            text : str
+                The statistics in the Prometheus text format.
+        """
+        stats = self.stats()
+        metrics = [
+            ("entities", "gauge", "Entities stored.", stats["n_ents"]),
+            ("hits_total", "counter", "Lookups of stored entities.", stats["n_hits"]),
+            ("misses_total", "counter", "Lookups of unstored QIDs.", stats["n_misses"]),
+            (
+                "uncached_fetches_total",
+                "counter",
+                "Fetches of entities that aren't stored.",
+                stats["n_uncached_fetches"],
+            ),
+            (
+                "lbl_fetches_total",
+                "counter",
+                "Labels fetched without their entities.",
+                stats["n_lbl_fetches"],
+            ),
+            (
+                "resident_entities",
+                "gauge",
+                "Entities in memory.",
+                stats["n_resident_ents"],
+            ),
+            (
+                "evictions_total",
+                "counter",
+                "Entities evicted to disk.",
+                stats["n_evictions"],
+            ),
+            (
+                "reloads_total",
+                "counter",
+                "Entities reloaded from disk.",
+                stats["n_reloads"],
+            ),
+            (
+                "store_reads_total",
+                "counter",
+                "Entities decoded from the store.",
+                stats["n_store_reads"],
+            ),
+            (
+                "coalesced_total",
+                "counter",
+                "Fetches that waited on a concurrent fetch of the same id.",
+                stats["n_coalesced"],
+            ),
+            (
+                "revalidated_total",
+                "counter",
+                "Revisions of stored entities checked.",
+                stats["n_revalidated"],
+            ),
+            (
+                "refreshed_total",
+                "counter",
+                "Stale entities re-downloaded.",
+                stats["n_refreshed"],
+            ),
+            ("fetches_total", "counter", "Entities fetched.", stats["n_fetches"]),
+            ("fetch_bytes_total", "counter", "Bytes downloaded.", stats["n_bytes"]),
+            (
+                "fetch_entity_bytes_total",
+                "counter",
+                "Bytes of the JSON of fetched entities.",
+                stats["n_ent_bytes"],
+            ),
+            (
+                "fetch_seconds_total",
+                "counter",
+                "Time spent fetching.",
+                stats["fetch_time_s"],
+            ),
+        ]
+
+        lines = []
+        for name, metric_type, help_text, val in metrics:
+            lines += [
+                f"# HELP {prefix}_{name} {help_text}",
+                f"# TYPE {prefix}_{name} {metric_type}",
+                f"{prefix}_{name} {val}",
+            ]
+
+        if per_id:
+            name = f"{prefix}_fetch_seconds"
+            lines += [
+                f"# HELP {name} Time spent fetching each id.",
+                f"# TYPE {name} gauge",
+            ]
+            lines += [
+                f'{name}{{id="{pq_id}"}} {t}'
+                for pq_id, t in stats["fetch_latencies"].items()
+            ]
+
+        text = "\n".join(lines) + "\n"
+        if path is not None:
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w") as f:
+                f.write(text)
+            os.replace(tmp_path, path)
+
+        return text
+
     def _print(self):
         """
         Prints the full entities dictionary (not advisable).
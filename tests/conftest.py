@@ -1,27 +1,53 @@
 """
 Fixtures
 --------
+
+Note: entities are replayed from tests/fixtures/entities once entities have been recorded there, with tests
+failing on entities that haven't been recorded. Entities are otherwise queried live from Wikidata, with tests
+of them being skipped if it can't be reached.
+
+    Record it via: WIKIREPO_FIXTURES=record pytest
+    Force replays via: WIKIREPO_FIXTURES=replay pytest
+    Force live queries via: WIKIREPO_FIXTURES=live pytest
 """
 
+import os
 from datetime import date
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
 
 import pytest
 import wikirepo
-from wikirepo.data import data_utils, lctn_utils, wd_utils
+from wikidata.client import Client
+from wikirepo.data import (
+    data_utils,
+    fetch_utils,
+    lctn_utils,
+    sparql_utils,
+    synth_utils,
+    wd_utils,
+)
+
+fixture_dir = os.path.join(os.path.dirname(__file__), "fixtures", "entities")
+n_recorded = len(fetch_utils.ReplayTransport(fixture_dir).recorded_ids())
+# Live queries are the default until a corpus has been recorded.
+fixtures_mode = os.environ.get("WIKIREPO_FIXTURES", "replay" if n_recorded else "live")
+assert fixtures_mode in [
+    "replay",
+    "record",
+    "live",
+], "WIKIREPO_FIXTURES must be one of 'replay', 'record' or 'live'."
+
+if fixtures_mode == "record":
+    wd_utils.set_transport(fetch_utils.RecordTransport(fixture_dir))
+elif fixtures_mode == "replay":
+    # Entities that haven't been recorded raise rather than being fetched live.
+    wd_utils.set_transport(fetch_utils.ReplayTransport(fixture_dir))
 
-entities_dict = wd_utils.EntitiesDict()
 countries = ["Germany"]
-depth = 0
 timespan = (date(2009, 1, 1), date(2010, 1, 1))
 interval = "yearly"
-
-# Test of values for a given timespan.
-df_timespan = wikirepo.data.query(
-    ents_dict=entities_dict,
-    locations=countries,
-    depth=depth,
-    timespan=timespan,
-    interval=interval,
+query_props = dict(
     demographic_props=[
         "ethnic_div",
         "life_expectancy",
@@ -53,94 +79,111 @@
     ],
     political_props="executive",
     misc_props="country_abbr",
-    verbose=True,
 )
 
-# Test of most recent values.
-df_most_recent = wikirepo.data.query(
-    ents_dict=entities_dict,
-    locations=countries,
-    depth=depth,
-    timespan=None,
-    interval=None,
-    demographic_props=[
-        "ethnic_div",
-        "life_expectancy",
-        "literacy",
-        "out_of_school_children",
-        "population",
-    ],
-    economic_props=[
-        "gdp_ppp",
-        "gini",
-        "inflation_rate",
-        "median_income",
-        "nom_gdp_per_cap",
-        "nom_gdp",
-        "ppp_gdp_per_cap",
-        "total_reserves",
-        "unemployment",
-    ],
-    electoral_poll_props=False,
-    electoral_result_props=False,
-    geographic_props=["area", "continent", "country",],
-    institutional_props=[
-        "bti_gov_idx",
-        "bti_status_idx",
-        "capital",
-        "fh_category",
-        "human_dev_idx",
-        "org_membership",
-    ],
-    political_props="executive",
-    misc_props="country_abbr",
-    verbose=True,
-)
-df_most_recent = data_utils.split_col_val_dates(df_most_recent, col="population")
-
-entities_dict_bundeslands = wd_utils.EntitiesDict()
-depth = 1
-sub_lctns = True
-bundeslands_dict = lctn_utils.gen_lctns_dict(
-    ents_dict=entities_dict_bundeslands,
-    depth=depth,
-    locations=countries,
-    sub_lctns=sub_lctns,
-    timespan=timespan,
-    interval=interval,
-    verbose=True,
-)
-df_bundeslands = wikirepo.data.query(
-    ents_dict=entities_dict_bundeslands,
-    locations=bundeslands_dict,
-    depth=depth,
-    timespan=timespan,
-    interval=interval,
-    demographic_props="population",
-    economic_props=False,
-    electoral_poll_props=False,
-    electoral_result_props=False,
-    geographic_props=False,
-    institutional_props="capital",
-    political_props=False,
-    misc_props="sub_country_abbr",
-    verbose=True,
-)
-
-
-@pytest.fixture(params=[entities_dict])
-def ents_dict(request):
-    return request.param
-
 
-@pytest.fixture(params=[bundeslands_dict])
-def lctns_dict(request):
-    return request.param
-
-
-@pytest.fixture(params=[df_bundeslands])
-def df(request):
-    return request.param
+@pytest.fixture(scope="session")
+def wikidata():
+    # Tests of Wikidata entities are skipped if entities are queried live without a connection.
+    if fixtures_mode == "live":
+        try:
+            urlopen(
+                Request("https://www.wikidata.org/", method="HEAD"), timeout=10
+            ).close()
+
+        except HTTPError:
+            pass  # Wikidata can be reached
+
+        except OSError as e:
+            pytest.skip(f"Wikidata can't be reached for live queries: {e}")
+
+
+@pytest.fixture(scope="session")
+def entities_dict(wikidata):
+    return wd_utils.EntitiesDict()
+
+
+@pytest.fixture(scope="session")
+def df_timespan(entities_dict):
+    # Test of values for a given timespan.
+    return wikirepo.data.query(
+        ents_dict=entities_dict,
+        locations=countries,
+        depth=0,
+        timespan=timespan,
+        interval=interval,
+        verbose=True,
+        **query_props,
+    )
+
+
+@pytest.fixture(scope="session")
+def df_most_recent(entities_dict):
+    # Test of most recent values.
+    df_most_recent = wikirepo.data.query(
+        ents_dict=entities_dict,
+        locations=countries,
+        depth=0,
+        timespan=None,
+        interval=None,
+        verbose=True,
+        **query_props,
+    )
+
+    return data_utils.split_col_val_dates(df_most_recent, col="population")
+
+
+@pytest.fixture(scope="session")
+def entities_dict_bundeslands(wikidata):
+    return wd_utils.EntitiesDict()
+
+
+@pytest.fixture(scope="session")
+def bundeslands_dict(entities_dict_bundeslands):
+    return lctn_utils.gen_lctns_dict(
+        ents_dict=entities_dict_bundeslands,
+        depth=1,
+        locations=countries,
+        sub_lctns=True,
+        timespan=timespan,
+        interval=interval,
+        verbose=True,
+    )
+
+
+@pytest.fixture(scope="session")
+def df_bundeslands(entities_dict_bundeslands, bundeslands_dict):
+    return wikirepo.data.query(
+        ents_dict=entities_dict_bundeslands,
+        locations=bundeslands_dict,
+        depth=1,
+        timespan=timespan,
+        interval=interval,
+        demographic_props="population",
+        economic_props=False,
+        electoral_poll_props=False,
+        electoral_result_props=False,
+        geographic_props=False,
+        institutional_props="capital",
+        political_props=False,
+        misc_props="sub_country_abbr",
+        verbose=True,
+    )
+
+
+@pytest.fixture
+def ents_dict(entities_dict, df_timespan, df_most_recent):
+    return entities_dict
+
+
+@pytest.fixture
+def lctns_dict(bundeslands_dict):
+    return bundeslands_dict
+
+
+@pytest.fixture
+def df(df_bundeslands):
+    return df_bundeslands
 
 
 @pytest.fixture(params=["Q183"])
@@ -156,3 +199,53 @@ def pop_pid(request):
 @pytest.fixture(params=["P6"])
 def exec_pid(request):
     return request.param
+
+
+@pytest.fixture(scope="session")
+def synth_ents():
+    return synth_utils.gen_synth_ents(
+        n_countries=3, depth=2, n_sub_lctns=2, n_claims=3, seed=42
+    )
+
+
+@pytest.fixture(scope="session")
+def synth_server(synth_ents):
+    with synth_utils.SynthServer(synth_ents) as server:
+        yield server
+
+
+@pytest.fixture
+def synth_transport(synth_server):
+    # Fetches entities from the synthetic server for the duration of a test.
+    synth_server.reset_counts()
+    old_transport = wd_utils.set_transport(
+        fetch_utils.ClientTransport(Client(base_url=synth_server.url))
+    )
+    yield synth_server
+    wd_utils.set_transport(old_transport)
+
+
+@pytest.fixture
+def fresh_synth_server(request):
+    # A server of entities that are generated for a test so that they can be changed, with the arguments
+    # of synth_utils.gen_synth_ents being passed via @pytest.mark.parametrize(..., indirect=True).
+    ents = synth_utils.gen_synth_ents(**getattr(request, "param", {}))
+    with synth_utils.SynthServer(ents) as server:
+        old_transport = wd_utils.set_transport(
+            fetch_utils.ClientTransport(Client(base_url=server.url))
+        )
+        old_endpoint = sparql_utils.set_endpoint(f"{server.url}sparql")
+        old_scheduler = sparql_utils.set_scheduler(
+            fetch_utils.ScheduledTransport(rate=None)
+        )
+        try:
+            yield server
+
+        finally:
+            sparql_utils.set_scheduler(old_scheduler)
+            sparql_utils.set_endpoint(old_endpoint)
+            wd_utils.set_transport(old_transport)
+
+
+def pytest_report_header(config):
+    return f"wikirepo fixtures: {fixtures_mode} ({n_recorded} recorded entities in {fixture_dir})"
@@ -0,0 +1,131 @@
+"""
+Cache Utilities Tests
+---------------------
+"""
+
+import os
+from datetime import date
+
+import pandas as pd
+import pytest
+import wikirepo
+from wikirepo.data import cache_utils, data_utils, lctn_utils, synth_utils, wd_utils
+
+
+def test_spec_key():
+    key = cache_utils.spec_key(
+        locations="Germany",
+        depth=0,
+        timespan=(date(2009, 1, 1), date(2010, 1, 1)),
+        interval="yearly",
+        dir_indexes={"demographic": ["population"], "geographic": None},
+    )
+    assert key == cache_utils.spec_key(
+        locations=["Q183"],
+        depth=0,
+        timespan=((2009, 1, 1), (2010, 1, 1)),
+        interval="yearly",
+        dir_indexes={
+            "geographic": data_utils.incl_dir_idxs(dir_name="geographic"),
+            "demographic": ["population"],
+        },
+    )
+    assert key != cache_utils.spec_key(
+        locations="Germany",
+        depth=0,
+        timespan=(date(2008, 1, 1), date(2010, 1, 1)),
+        interval="yearly",
+        dir_indexes={"demographic": ["population"], "geographic": None},
+    )
+
+
+@pytest.mark.parametrize(
+    "fresh_synth_server",
+    [dict(n_countries=2, depth=1, n_sub_lctns=2, seed=1)],
+    indirect=True,
+)
+def test_query_cache(fresh_synth_server, tmp_path):
+    server = fresh_synth_server
+    ents = server.ents
+    cache_dir = str(tmp_path / "results")
+    lctns_dict = lctn_utils.gen_lctns_dict(
+        ents_dict=wd_utils.EntitiesDict(),
+        locations=synth_utils.synth_country_qids(ents),
+        depth=1,
+        verbose=False,
+    )
+    query_kwargs = dict(
+        locations=lctns_dict,
+        depth=1,
+        demographic_props="population",
+        institutional_props="capital",
+        cache_dir=cache_dir,
+        verbose=False,
+    )
+
+    # Results of SPARQL queries aren't cached, as their revisions aren't known.
+    wikirepo.data.query(ents_dict=wd_utils.EntitiesDict(), sparql=True, **query_kwargs)
+    assert not os.path.exists(cache_dir)
+
+    df = wikirepo.data.query(ents_dict=wd_utils.EntitiesDict(), **query_kwargs)
+    assert len(os.listdir(cache_dir)) == 2
+
+    # Only revision ids are fetched for a cached result, including when profiling or using SPARQL.
+    server.reset_counts()
+    df_cached = wikirepo.data.query(ents_dict=wd_utils.EntitiesDict(), **query_kwargs)
+    pd.testing.assert_frame_equal(df_cached, df)
+    assert df_cached.attrs == df.attrs
+    assert server.n_requests == 1
+
+    server.reset_counts()
+    df_cached, df_report = wikirepo.data.query(
+        ents_dict=wd_utils.EntitiesDict(), profile=True, **query_kwargs
+    )
+    pd.testing.assert_frame_equal(df_cached, df)
+    assert "read_cache" in list(df_report["stage"])
+    assert server.n_requests == 1
+
+    server.reset_counts()
+    df_cached = wikirepo.data.query(
+        ents_dict=wd_utils.EntitiesDict(), sparql=True, **query_kwargs
+    )
+    pd.testing.assert_frame_equal(df_cached, df)
+    assert server.n_requests == 1
+
+    # Missing data isn't cached, so it's collected from a recomputed result.
+    server.reset_counts()
+    df_recomputed, missing = wikirepo.data.query(
+        ents_dict=wd_utils.EntitiesDict(), coverage=True, **query_kwargs
+    )
+    pd.testing.assert_frame_equal(df_recomputed, df)
+    assert server.n_ents_served > 0
+
+    # A new revision of a contributing entity invalidates the result.
+    sub_qid = lctn_utils.get_qids_at_depth(lctns_dict, depth=1)[0]
+    ents[sub_qid] = dict(ents[sub_qid], lastrevid=2)
+    server.reset_counts()
+    df_recomputed = wikirepo.data.query(
+        ents_dict=wd_utils.EntitiesDict(), **query_kwargs
+    )
+    pd.testing.assert_frame_equal(df_recomputed, df)
+    assert server.n_ents_served > 0
+
+
+def test_write_df(tmp_path):
+    df = pd.DataFrame({"qid": ["Q1", "Q2"], "population": [1, 2]})
+    df.attrs["wikirepo"] = {"depth": 0}
+
+    # Columns of mixed types can't be written as Parquet, so they're pickled.
+    df_mixed = df.assign(capital=["Berlin", 1])
+    df_path = cache_utils._write_df(df_mixed, str(tmp_path / "mixed"))
+    assert df_path.endswith(".pkl")
+    pd.testing.assert_frame_equal(cache_utils._read_df(df_path), df_mixed)
+
+    # attrs are stored in the metadata of cache entries rather than with frames.
+    assert cache_utils._read_df(df_path).attrs == {}
+
+    pytest.importorskip("pyarrow")
+    df_path = cache_utils._write_df(df, str(tmp_path / "df"))
+    assert df_path.endswith(".parquet")
+    assert set(os.listdir(str(tmp_path))) == {"mixed.pkl", "df.parquet"}
+    pd.testing.assert_frame_equal(cache_utils._read_df(df_path), df)
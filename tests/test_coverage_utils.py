@@ -0,0 +1,75 @@
+import logging
+import threading
+from datetime import date
+
+import wikirepo
+from wikirepo.data import coverage_utils, lctn_utils, synth_utils, wd_utils
+
+
+def test_record_missing(caplog):
+    # Missing data is only logged outside of a collector.
+    with caplog.at_level(logging.DEBUG, logger="wikirepo.data.coverage_utils"):
+        coverage_utils.record_missing("Q1", "P1082", "missing_property")
+    assert "Q1 P1082 missing_property" in caplog.text
+
+    with coverage_utils.collecting() as missing:
+        coverage_utils.record_missing("Q1", "P1082", "missing_property")
+        coverage_utils.record_missing("Q1", "P1082", "missing_property")
+        coverage_utils.record_missing("Q2", "P150", "missing_sub_lctns")
+
+    assert coverage_utils._active_collector.get() is None
+    assert len(missing) == 3
+    assert missing.report().values.tolist() == [
+        ["Q1", "P1082", "missing_property"],
+        ["Q2", "P150", "missing_sub_lctns"],
+    ]
+
+
+def test_collecting_threads():
+    # Collectors that are active in different threads don't collect each other's missing data.
+    barrier = threading.Barrier(2)
+    collectors = [coverage_utils.MissingData(), coverage_utils.MissingData()]
+
+    def collect(i):
+        with coverage_utils.collecting(collectors[i]):
+            barrier.wait()
+            coverage_utils.record_missing(f"Q{i}", "P1082", "missing_property")
+            barrier.wait()
+
+    threads = [threading.Thread(target=collect, args=(i,)) for i in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert collectors[0] == [("Q0", "P1082", "missing_property")]
+    assert collectors[1] == [("Q1", "P1082", "missing_property")]
+
+
+def test_query_coverage(synth_ents, synth_transport):
+    timespan = (date(2010, 1, 1), date(2011, 1, 1))
+    country_qids = synth_utils.synth_country_qids(synth_ents)
+    lctns_dict = lctn_utils.gen_lctns_dict(
+        ents_dict=wd_utils.EntitiesDict(),
+        locations=country_qids,
+        depth=0,
+        timespan=timespan,
+        interval="yearly",
+        verbose=False,
+    )
+    synth_transport.reset_counts()
+
+    df, df_missing = wikirepo.data.query(
+        locations=lctns_dict,
+        depth=0,
+        timespan=timespan,
+        interval="yearly",
+        demographic_props="population",
+        verbose=False,
+        coverage=True,
+    )
+    assert df["population"].isnull().all()
+    assert set(df_missing["qid"]) == set(country_qids)
+    assert set(df_missing["reason"]) == {"no_values_in_timespan"}
+    # Only the locations themselves are fetched, and no labels for reporting.
+    assert set(synth_transport.requested_ids) == set(country_qids)
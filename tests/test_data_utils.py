@@ -3,7 +3,11 @@
 --------------------
 """
 
-from wikirepo.data import data_utils
+from datetime import date
+
+import numpy as np
+import pandas as pd
+from wikirepo.data import data_utils, lctn_utils
 
 
 def test_interp_by_subset(df):
@@ -13,6 +17,37 @@ def test_interp_by_subset(df):
     assert df_interp["sub_abbr"].isnull().values.any() == False
 
 
+def test_interp_by_subset_cols():
+    df = pd.DataFrame(
+        {
+            "location": ["Germany"] * 3 + ["France"] * 3,
+            "year": ["2010", "2009", "2008"] * 2,
+            "population": [3.0, np.nan, 1.0, np.nan, 5.0, np.nan],
+            "area": [np.nan, 2.0, np.nan, 4.0, np.nan, np.nan],
+        }
+    )
+    df_interp = data_utils.interp_by_subset(
+        df=df, depth=0, col_name=["population", "area"], method="linear"
+    )
+
+    assert list(df_interp.index) == list(df.index)
+    assert df_interp["population"].iloc[:3].tolist() == [3.0, 2.0, 1.0]
+    assert np.isnan(df_interp["population"].iloc[3])  # no values across locations
+    assert df_interp["population"].iloc[4:].tolist() == [5.0, 5.0]
+    assert df_interp["area"].tolist()[1:3] == [2.0, 2.0]
+    assert np.isnan(df_interp["area"].iloc[0])
+
+    df_pad = data_utils.interp_by_subset(
+        df=df,
+        depth=0,
+        col_name=["population", "area"],
+        method="pad",
+        limit_direction="both",
+    )
+    assert df_pad["population"].tolist() == [3.0, 3.0, 3.0, 5.0, 5.0, 5.0]
+    assert df_pad["area"].tolist() == [2.0, 2.0, 2.0, 4.0, 4.0, 4.0]
+
+
 def test_sum_df_prop_vals(df):
     df.loc[
         df.loc[(df["sub_lctn"] == "Berlin") & (df["year"] == "2009")].index,
@@ -67,3 +102,132 @@ def test_sum_df_prop_vals(df):
         < df.loc[df.loc[df["sub_lctn"] == "Berlin"].index[0], "population"]
     )
     assert "Hamburg" not in list(df_test["sub_lctn"])
+
+
+def test_assign_to_column_most_recent():
+    df = pd.DataFrame(
+        {
+            "location": ["Germany", "France"],
+            "qid": ["Q183", "Q142"],
+            "population": [np.nan, np.nan],
+        }
+    )
+    props = {
+        "Q183": {date(2011, 1, 1): 80219695, date(2019, 1, 1): 83019200, "no date": 1},
+        "Q142": {"no date": 67000000},
+    }
+    df_assigned = data_utils.assign_to_column(
+        df=df,
+        locations=["Germany", "France"],
+        depth=0,
+        col_name="population",
+        props=props,
+        assign="most_recent",
+    )
+
+    assert list(df_assigned["population"]) == [83019200, 67000000]
+    assert df_assigned.loc[0, "population_date"] == date(2019, 1, 1)
+    assert pd.isnull(df_assigned.loc[1, "population_date"])
+
+
+def test_rollup_df_prop_vals():
+    lctns_dict = lctn_utils.LocationsDict(
+        {
+            "Q183": {
+                "lbl": "Germany",
+                "sub_lctns": {
+                    "Q1": {
+                        "lbl": "A",
+                        "sub_lctns": {"Q11": {"lbl": "A1"}, "Q12": {"lbl": "A2"}},
+                    },
+                    "Q2": {"lbl": "B", "sub_lctns": {"Q21": {"lbl": "B1"}}},
+                },
+            }
+        }
+    )
+    df = pd.DataFrame(
+        {
+            "location": ["Germany"] * 6,
+            "sub_lctn": ["A", "A", "A", "A", "B", "B"],
+            "sub_sub_lctn": ["A1", "A1", "A2", "A2", "B1", "B1"],
+            "qid": ["Q11", "Q11", "Q12", "Q12", "Q21", "Q21"],
+            "year": ["2010", "2009"] * 3,
+            "population": [10, 20, 30, np.nan, 5, 5],
+            "gdp": [1.0, 2.0, 3.0, 4.0, np.nan, np.nan],
+        }
+    )
+
+    df_sum = data_utils.rollup_df_prop_vals(
+        df=df, lctns_dict=lctns_dict, prop_cols=["population", "gdp"], agg="sum"
+    )
+    df_germany = df_sum[df_sum["qid"] == "Q183"].set_index("year")
+    assert df_germany.loc["2010", "population"] == 45
+    assert df_germany.loc["2009", "population_n_sub_lctns"] == 2
+    assert df_germany.loc["2009", "n_sub_lctns"] == 3
+    assert set(df_sum["depth"]) == {0, 1}
+    assert list(df_sum.columns[:3]) == ["location", "sub_lctn", "qid"]
+
+    df_weighted = data_utils.rollup_df_prop_vals(
+        df=df,
+        lctns_dict=lctns_dict,
+        prop_cols="gdp",
+        agg="weighted_mean",
+        weight_col="population",
+    )
+    df_a = df_weighted[df_weighted["qid"] == "Q1"].set_index("year")
+    assert df_a.loc["2010", "gdp"] == 2.5
+    assert df_a.loc["2009", "gdp"] == 2.0
+    assert np.isnan(df_weighted.set_index(["qid", "year"]).loc[("Q2", "2010"), "gdp"])
+
+
+def test_split_col_val_dates():
+    df = pd.DataFrame(
+        {
+            "location": ["Germany", "France", "Italy"],
+            "population": ["83019200 (2019-01-01)", "12.5 (no date)", np.nan],
+        }
+    )
+    df_split = data_utils.split_col_val_dates(df=df, col="population")
+
+    assert list(df_split.columns) == ["location", "population", "population_date"]
+    assert df_split.loc[0, "population"] == 83019200
+    assert df_split.loc[1, "population"] == 12.5
+    assert df_split.loc[0, "population_date"] == "2019-01-01"
+    assert pd.isnull(df_split.loc[2, "population_date"])
+
+
+def test_set_df_dtypes():
+    df = pd.DataFrame(
+        {
+            "location": ["Germany", "Germany", "France", "France"],
+            "qid": ["Q183", "Q183", "Q142", "Q142"],
+            "population": [
+                "83019200 (2019-01-01)",
+                np.nan,
+                "67000000 (no date)",
+                "67000000 (no date)",
+            ],
+            "life_exp": [80.9, 81.1, np.nan, 82.5],
+            "executive": [
+                "Angela Merkel",
+                "Angela Merkel",
+                "Emmanuel Macron",
+                "Emmanuel Macron",
+            ],
+        }
+    )
+    df_typed = data_utils.set_df_dtypes(df=df, depth=0, interval=None)
+
+    assert df_typed["location"].dtype.name == "category"
+    assert df_typed["qid"].dtype.name == "category"
+    assert df_typed["population"].dtype.name == "Int64"
+    assert df_typed["population"].iloc[0] == 83019200
+    assert list(df_typed.columns).index("population_date") == 3
+    assert df_typed["population_date"].iloc[0] == pd.Timestamp(2019, 1, 1)
+    assert pd.isnull(df_typed["population_date"].iloc[2])
+    assert df_typed["life_exp"].dtype.name == "Float64"
+    assert df_typed["executive"].dtype.name == "category"
+
+    df_lists = pd.DataFrame({"languages": [["de"], ["de"], np.nan, ["fr", "de"]]})
+    typed_lists = data_utils._to_typed_series(df_lists["languages"])
+    assert typed_lists.dtype.kind == "O"
@@ -0,0 +1,205 @@
+"""
+Fetch Utilities Tests
+---------------------
+"""
+
+import json
+import socket
+import threading
+import time
+from urllib.error import HTTPError
+
+import pytest
+from wikidata.client import Client
+from wikirepo.data import fetch_utils, synth_utils, wd_utils
+
+
+class DictTransport:
+    def __init__(self, ents):
+        self.ents = ents
+        self.calls = 0
+
+    def get(self, pq_id):
+        self.calls += 1
+        return self.ents[pq_id]
+
+    def get_many(self, pq_ids, props=None, languages=None):
+        return {
+            pq_id: fetch_utils.filter_ent_props(
+                self.get(pq_id), props=props, languages=languages
+            )
+            for pq_id in pq_ids
+        }
+
+
+class TimeoutTransport(DictTransport):
+    def __init__(self, ents, n_timeouts):
+        super().__init__(ents)
+        self.n_timeouts = n_timeouts
+
+    def get(self, pq_id):
+        self.calls += 1
+        if self.calls <= self.n_timeouts:
+            raise socket.timeout("timed out")
+
+        return self.ents[pq_id]
+
+
+def test_record_replay(tmp_path):
+    ents = {
+        "Q183": {"id": "Q183", "labels": {"en": {"value": "Germany"}}, "claims": {}},
+        "P1082": {"id": "P1082", "labels": {"en": {"value": "population"}}},
+    }
+    fixture_dir = str(tmp_path / "entities")
+    record = fetch_utils.RecordTransport(fixture_dir, transport=DictTransport(ents))
+    assert record.get("Q183") == ents["Q183"]
+    assert record.get_many(["P1082"]) == {"P1082": ents["P1082"]}
+
+    replay = fetch_utils.ReplayTransport(fixture_dir)
+    assert replay.recorded_ids() == ["P1082", "Q183"]
+    assert replay.get("Q183") == ents["Q183"]
+
+    # Recordings are deterministic.
+    with open(fetch_utils.fixture_path(fixture_dir, "Q183"), "rb") as f:
+        first_recording = f.read()
+    record.get("Q183")
+    with open(fetch_utils.fixture_path(fixture_dir, "Q183"), "rb") as f:
+        assert f.read() == first_recording
+
+    with pytest.raises(FileNotFoundError):
+        replay.get("Q64")
+
+    old_transport = wd_utils.set_transport(replay)
+    try:
+        ents_dict = wd_utils.EntitiesDict()
+        assert wd_utils.get_lbl(ents_dict, "Q183") == "Germany"
+        assert wd_utils.get_lbl(ents_dict, "P1082") == "population"
+        assert "Q183" in ents_dict.keys()
+
+    finally:
+        wd_utils.set_transport(old_transport)
+
+
+def test_client_transport_headers(synth_ents, synth_server):
+    client = Client(base_url=synth_server.url)
+    client.opener.addheaders = [("X-Other", "1")]
+    transport = fetch_utils.ClientTransport(client)
+    qid = synth_utils.synth_country_qids(synth_ents)[0]
+    assert transport.get(qid) == synth_ents[qid]
+
+    # The opener's headers are left as they are for its other users.
+    assert client.opener.addheaders == [("X-Other", "1")]
+
+
+def test_scheduled_transport_retries(synth_ents):
+    qids = [q for q in synth_ents if q.startswith("Q9000")][:10]
+    with synth_utils.SynthServer(
+        synth_ents, error_rate=0.5, retry_after=0, seed=1
+    ) as server:
+        scheduled = fetch_utils.ScheduledTransport(
+            fetch_utils.ClientTransport(Client(base_url=server.url)),
+            rate=None,
+            max_retries=20,
+            backoff=0.001,
+            seed=0,
+        )
+        assert [scheduled.get(q) for q in qids] == [synth_ents[q] for q in qids]
+        assert scheduled.get_many(qids) == {q: synth_ents[q] for q in qids}
+        assert server.n_errors > 0
+        assert scheduled.n_retries == server.n_errors
+
+    with synth_utils.SynthServer(
+        synth_ents, error_rate=1.0, error_code="maxlag", retry_after=0
+    ) as server:
+        scheduled = fetch_utils.ScheduledTransport(
+            fetch_utils.ClientTransport(Client(base_url=server.url), maxlag=5),
+            rate=None,
+            max_retries=2,
+            backoff=0.001,
+        )
+        with pytest.raises(fetch_utils.MaxlagError):
+            scheduled.get_many(qids)
+        assert server.n_requests == 3
+
+    # Errors that can't succeed are raised without retrying.
+    with synth_utils.SynthServer(synth_ents, error_rate=1.0, error_code=404) as server:
+        scheduled = fetch_utils.ScheduledTransport(
+            fetch_utils.ClientTransport(Client(base_url=server.url)), rate=None
+        )
+        with pytest.raises(HTTPError):
+            scheduled.get(qids[0])
+        assert server.n_requests == 1
+
+    # Socket timeouts, which aren't TimeoutErrors before Python 3.10, are retried.
+    scheduled = fetch_utils.ScheduledTransport(
+        TimeoutTransport(synth_ents, n_timeouts=2), rate=None, backoff=0.001
+    )
+    assert scheduled.get(qids[0]) == synth_ents[qids[0]]
+    assert scheduled.n_retries == 2
+
+
+def test_scheduled_transport_rate():
+    ents = {"Q1": {"id": "Q1"}}
+    scheduled = fetch_utils.ScheduledTransport(DictTransport(ents), rate=100, burst=1)
+    start = time.perf_counter()
+    for _ in range(11):
+        scheduled.get("Q1")
+
+    # The first request uses the burst, and the other 10 wait for tokens at 100 per second.
+    assert time.perf_counter() - start >= 0.09
+    assert scheduled.wait_time_s > 0
+
+    # Counts are kept under the lock when requests are made from many threads.
+    scheduled = fetch_utils.ScheduledTransport(DictTransport(ents), rate=None)
+    threads = [
+        threading.Thread(target=lambda: [scheduled.get("Q1") for _ in range(100)])
+        for _ in range(8)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert scheduled.n_requests == 800
+
+
+def test_pooled_transport(synth_ents):
+    qids = [q for q in synth_ents if q.startswith("Q9000")][:10]
+    with synth_utils.SynthServer(synth_ents) as server:
+        pooled = fetch_utils.PooledTransport(base_url=server.url, pool_size=2)
+        for q in qids:
+            ent, n_bytes = pooled.get_sized(q)
+            assert ent == synth_ents[q]
+
+        assert pooled.get("Q1") is None
+        assert pooled.get_many(qids, props=["labels"], languages=["en"])[qids[0]][
+            "labels"
+        ] == {"en": synth_ents[qids[0]]["labels"]["en"]}
+
+        # Requests reuse one connection, with responses being gzipped.
+        assert server.n_connections == pooled.n_connections == 1
+        assert server.n_bytes_sent < sum(len(json.dumps(synth_ents[q])) for q in qids)
+
+        pooled.close()
+        pooled.get(qids[0])
+        assert server.n_connections == 2
+
+
+def test_pooled_transport_redirects(synth_ents):
+    qid = synth_utils.synth_country_qids(synth_ents)[0]
+    redirects = {"Q1": "Q2", "Q2": qid, "Q3": "Q4", "Q4": "Q3"}
+    with synth_utils.SynthServer(synth_ents, redirects=redirects) as server:
+        pooled = fetch_utils.PooledTransport(base_url=server.url)
+
+        # Redirects are followed on the pooled connection.
+        assert pooled.get("Q1") == synth_ents[qid]
+        assert server.n_requests == 3
+        assert pooled.n_connections == 1
+
+        # Redirect loops fail after fetch_utils.max_redirects hops.
+        server.reset_counts()
+        with pytest.raises(HTTPError) as e:
+            pooled.get("Q3")
+        assert e.value.code == 303
+        assert server.n_requests == fetch_utils.max_redirects + 1
+
+        pooled.close()
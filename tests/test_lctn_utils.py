@@ -41,3 +41,14 @@ def test_LocationsDict(ents_dict, lctns_dict):
     assert lctns_dict.get_depth() == 1
     assert lctns_dict.get_qids_at_depth(depth=0) == ["Q183"]
     assert isinstance(lctns_dict.key_lbls_at_depth(ents_dict=ents_dict, depth=0), list)
+
+
+def test_iter_qid_paths():
+    lctns_dict = lctn_utils.LocationsDict(
+        {"Q183": {"lbl": "Germany", "sub_lctns": {"Q64": {"lbl": "Berlin"}}}}
+    )
+    assert list(lctn_utils.iter_qid_paths(lctns_dict)) == [
+        ("Q183", ["Q183"], "Germany"),
+        ("Q64", ["Q183", "Q64"], "Berlin"),
+    ]
+    assert lctns_dict.get_qid_paths() == {"Q183": ["Q183"], "Q64": ["Q183", "Q64"]}
@@ -0,0 +1,167 @@
+"""
+Plan Utilities Tests
+--------------------
+"""
+
+import json
+from datetime import date
+
+import pytest
+import wikirepo
+from wikirepo.data import fetch_utils, lctn_utils, plan_utils, synth_utils, wd_utils
+
+query_kwargs = dict(
+    depth=2,
+    demographic_props="population",
+    economic_props=False,
+    electoral_poll_props=False,
+    electoral_result_props=False,
+    geographic_props=False,
+    institutional_props="capital",
+    political_props=False,
+    misc_props=False,
+    verbose=False,
+)
+
+
+def test_query_explain(synth_ents, synth_transport, capsys):
+    lctns_dict = lctn_utils.gen_lctns_dict(
+        ents_dict=wd_utils.EntitiesDict(),
+        locations=synth_utils.synth_country_qids(synth_ents),
+        depth=2,
+        verbose=False,
+    )
+    synth_transport.reset_counts()
+    plan = wikirepo.data.query(
+        ents_dict=wd_utils.EntitiesDict(),
+        locations=lctns_dict,
+        explain=True,
+        **query_kwargs
+    )
+
+    assert isinstance(plan, plan_utils.QueryPlan)
+    assert synth_transport.n_requests == 0
+    assert plan["pids"] == ["P1082", "P36"]
+    assert plan["n_fetches"]["locations"] == 3 * 4
+    assert plan["n_unresolved"] == 3 * 4
+    assert plan["n_rows"] == 3 * 4
+    assert "estimated rows: 12" in capsys.readouterr().out
+
+
+def test_execute_plan(synth_ents, synth_transport):
+    lctns_dict = lctn_utils.gen_lctns_dict(
+        ents_dict=wd_utils.EntitiesDict(),
+        locations=synth_utils.synth_country_qids(synth_ents),
+        depth=2,
+        verbose=False,
+    )
+    ents_dict = wd_utils.EntitiesDict()
+    plan = plan_utils.plan_query(
+        ents_dict=ents_dict,
+        locations=lctns_dict,
+        depth=2,
+        dir_indexes={"demographic": ["population"], "institutional": ["capital"]},
+    )
+    wd_utils.lbls_dict.clear()
+    synth_transport.reset_counts()
+    plan_utils.execute_plan(plan, ents_dict)
+
+    # One batch of locations that both directories share, and one of the labels of capitals.
+    assert synth_transport.n_requests == 2
+    assert plan["n_unresolved"] == 0
+    assert set(plan["val_qids"]) == {
+        synth_ents[q]["claims"]["P36"][0]["mainsnak"]["datavalue"]["value"]["id"]
+        for q in plan["qids"]
+    }
+
+    # Extraction then only reads from ents_dict.
+    synth_transport.reset_counts()
+    df = wikirepo.data.query(ents_dict=ents_dict, locations=lctns_dict, **query_kwargs)
+    assert synth_transport.n_requests == 0
+    assert df["capital"].notnull().all()
+
+
+@pytest.mark.parametrize(
+    "fresh_synth_server",
+    [dict(n_countries=3, depth=2, n_sub_lctns=2, n_claims=3, seed=42)],
+    indirect=True,
+)
+def test_estimate_query(fresh_synth_server):
+    server = fresh_synth_server
+    country_qids = synth_utils.synth_country_qids(server.ents)
+    timespan = (date(2000, 1, 1), date(2000, 12, 1))
+    estimate_kwargs = dict(
+        depth=2,
+        timespan=timespan,
+        interval="monthly",
+        demographic_props="population",
+        institutional_props="capital",
+    )
+
+    server.reset_counts()
+    estimate = wikirepo.data.estimate_query(
+        ents_dict=wd_utils.EntitiesDict(), locations=country_qids, **estimate_kwargs
+    )
+    # Sub-locations are counted from the 'P150' values of the 3 countries and their 6 regions,
+    # which are queried without their entities being fetched.
+    assert server.n_requests == estimate["n_count_requests"] == 2
+    assert server.n_ents_served == 0
+    assert estimate["n_locations"] == 3 * 4
+    assert estimate["n_times"] == 12
+    assert estimate["n_fetches"]["hierarchy"] == 3 + 6
+    assert estimate["n_fetches"]["locations"] == 3 * 4
+
+    ents_dict = wd_utils.EntitiesDict()
+    lctns_dict = lctn_utils.gen_lctns_dict(
+        ents_dict=ents_dict,
+        locations=country_qids,
+        depth=2,
+        timespan=timespan,
+        interval="monthly",
+        verbose=False,
+    )
+    estimate_dict = wikirepo.data.estimate_query(
+        ents_dict=ents_dict, locations=lctns_dict, **estimate_kwargs
+    )
+    assert estimate_dict["n_count_requests"] == 0
+    assert estimate_dict["n_fetches"]["hierarchy"] == 0
+    assert estimate_dict["wall_s"] > 0
+
+    df = wikirepo.data.query(
+        ents_dict=ents_dict,
+        locations=lctns_dict,
+        **dict(query_kwargs, timespan=timespan, interval="monthly")
+    )
+    assert len(df) == estimate["n_rows"] == estimate_dict["n_rows"]
+
+
+def test_estimate_query_ent_bytes(synth_ents, synth_server):
+    country_qids = synth_utils.synth_country_qids(synth_ents)
+    pooled = fetch_utils.PooledTransport(base_url=synth_server.url)
+    old_transport = wd_utils.set_transport(pooled)
+    try:
+        ents_dict = wd_utils.EntitiesDict()
+        for q in country_qids:
+            wd_utils.load_ent(ents_dict, q)
+
+    finally:
+        wd_utils.set_transport(old_transport)
+        pooled.close()
+
+    # Entities are downloaded gzipped, with memory being estimated from their decoded size.
+    stats = ents_dict.stats()
+    ent_bytes = sum(
+        len(json.dumps(synth_ents[q], separators=(",", ":")).encode("utf-8"))
+        for q in country_qids
+    )
+    assert stats["n_ent_bytes"] == ent_bytes > stats["n_bytes"]
+
+    estimate = wikirepo.data.estimate_query(
+        ents_dict=ents_dict,
+        locations=country_qids,
+        depth=1,
+        demographic_props="population",
+    )
+    n_ents = estimate["n_fetches"]["locations"] + estimate["n_fetches"]["topic pages"]
+    assert n_ents > 0
+    assert estimate["memory_mb"] >= round(n_ents * ent_bytes / 3 / 1024**2, 3)
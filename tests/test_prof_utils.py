@@ -0,0 +1,85 @@
+import threading
+
+import wikirepo
+from wikirepo.data import lctn_utils, prof_utils, synth_utils, wd_utils
+
+
+def test_stage():
+    # Stages outside of a profiler are no-ops.
+    with prof_utils.stage("outside") as outside_stage:
+        outside_stage.rows = 1
+
+    events = []
+    profiler = prof_utils.Profiler(callback=events.append)
+    with prof_utils.profiling(profiler):
+        with prof_utils.stage("outer", module="demographic.population") as s:
+            for _ in range(2):
+                with prof_utils.stage("inner") as inner_stage:
+                    inner_stage.rows = 3
+            s.rows = 6
+
+    assert prof_utils._active_profiler.get() is None
+    assert set(profiler.keys()) == {
+        ("outer", "demographic.population"),
+        ("inner", "demographic.population"),
+    }
+    assert profiler[("inner", "demographic.population")]["calls"] == 2
+    assert profiler[("inner", "demographic.population")]["rows"] == 6
+    assert [e["stage"] for e in events] == ["inner", "inner", "outer"]
+
+    outer = profiler[("outer", "demographic.population")]
+    inner = profiler[("inner", "demographic.population")]
+    assert abs(outer["time_s"] - outer["self_s"] - inner["time_s"]) < 1e-9
+
+    df_report = profiler.report()
+    assert list(df_report["stage"]) == ["outer", "inner"]
+
+
+def test_profiling_threads():
+    # Profilers that are active in different threads don't record each other's stages.
+    barrier = threading.Barrier(2)
+    profilers = [prof_utils.Profiler(), prof_utils.Profiler()]
+
+    def profile(i):
+        with prof_utils.profiling(profilers[i]):
+            barrier.wait()
+            with prof_utils.stage(f"stage_{i}"):
+                barrier.wait()
+
+    threads = [threading.Thread(target=profile, args=(i,)) for i in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert list(profilers[0]) == [("stage_0", None)]
+    assert list(profilers[1]) == [("stage_1", None)]
+
+
+def test_query_profile(synth_ents, synth_transport):
+    lctns_dict = lctn_utils.gen_lctns_dict(
+        ents_dict=wd_utils.EntitiesDict(),
+        locations=synth_utils.synth_country_qids(synth_ents),
+        depth=1,
+        verbose=False,
+    )
+    df, df_report = wikirepo.data.query(
+        locations=lctns_dict,
+        depth=1,
+        demographic_props="population",
+        institutional_props="capital",
+        verbose=False,
+        profile=True,
+    )
+    stages = set(zip(df_report["stage"], df_report["module"]))
+    for stage in ["gen_base_df", "t_to_prop_val_dict", "assign_to_column"]:
+        assert (stage, "demographic.population") in stages
+
+    # Entities are fetched in batches by the plan before any module is queried.
+    fetch_stages = df_report[df_report["stage"] == "fetch_batch"]
+    assert fetch_stages["module"].isnull().all()
+    assert ("fetch", "demographic.population") not in stages
+
+    df_merge_stage = df_report[df_report["stage"] == "pd.merge"]
+    assert df_merge_stage["module"].isnull().all()
+    assert df_report.loc[df_report["stage"] == "query", "rows"].iloc[0] == len(df)
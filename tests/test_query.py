@@ -0,0 +1,16 @@
+"""
+Query Tests
+-----------
+"""
+
+import pandas as pd
+
+
+def test_query_timespan(df_timespan):
+    assert isinstance(df_timespan, pd.DataFrame)
+    assert list(df_timespan["year"]) == ["2010", "2009"]
+
+
+def test_query_most_recent(df_most_recent):
+    assert isinstance(df_most_recent, pd.DataFrame)
+    assert "population_date" in df_most_recent.columns
@@ -0,0 +1,130 @@
+"""
+Refresh Tests
+-------------
+"""
+
+import json
+from datetime import date
+
+import pandas as pd
+import pytest
+import wikirepo
+from wikirepo.data import (
+    cache_utils,
+    lctn_utils,
+    prof_utils,
+    store_utils,
+    synth_utils,
+    wd_utils,
+)
+
+query_kwargs = dict(
+    depth=1,
+    interval="yearly",
+    demographic_props="population",
+    institutional_props="capital",
+    verbose=False,
+)
+
+
+@pytest.mark.parametrize(
+    "fresh_synth_server",
+    [dict(n_countries=3, depth=1, n_sub_lctns=2, seed=2)],
+    indirect=True,
+)
+def test_refresh(fresh_synth_server, tmp_path):
+    server = fresh_synth_server
+    ents = server.ents
+    country_qids = synth_utils.synth_country_qids(ents)
+    timespan = (date(2000, 1, 1), date(2002, 1, 1))
+    store_path = str(tmp_path / "ents.store")
+    store_utils.write_store(store_path, ents)
+
+    lctns_dict = lctn_utils.gen_lctns_dict(
+        ents_dict=wd_utils.EntitiesDict(),
+        locations=country_qids,
+        depth=1,
+        verbose=False,
+    )
+    df_previous = wikirepo.data.query(
+        ents_dict=wd_utils.EntitiesDict(),
+        locations=lctn_utils.LocationsDict(
+            {q: lctns_dict[q] for q in country_qids[:2]}
+        ),
+        timespan=(date(2000, 1, 1), date(2001, 1, 1)),
+        **query_kwargs
+    )
+
+    # A new year and a new country.
+    df_refresh = wikirepo.data.refresh(
+        df_previous, timespan=timespan, locations=lctns_dict, verbose=False
+    )
+    df = wikirepo.data.query(
+        ents_dict=wd_utils.EntitiesDict(),
+        locations=lctns_dict,
+        timespan=timespan,
+        **query_kwargs
+    )
+    pd.testing.assert_frame_equal(df_refresh, df)
+
+    # Only revision ids are fetched if nothing has changed.
+    server.reset_counts()
+    pd.testing.assert_frame_equal(wikirepo.data.refresh(df_refresh, verbose=False), df)
+    assert server.n_requests == 1
+
+    # The rows of a location with a new revision are queried again.
+    sub_qid = lctn_utils.get_qids_at_depth(lctns_dict, depth=1)[0]
+    claims = dict(ents[sub_qid]["claims"])
+    claims["P1082"] = [
+        dict(
+            claims["P1082"][0],
+            mainsnak=synth_utils._snak("P1082", 7, "quantity"),
+        )
+    ] + claims["P1082"][1:]
+    ents[sub_qid] = dict(ents[sub_qid], claims=claims, lastrevid=2)
+
+    server.reset_counts()
+    profiler = prof_utils.Profiler()
+    with prof_utils.profiling(profiler):
+        df_refresh_changed = wikirepo.data.refresh(df_refresh, verbose=False)
+    # One request for revision ids, and one for the changed location, with only its population being queried again.
+    assert server.n_requests == 2
+    modules = {module for _, module in profiler}
+    assert "demographic.population" in modules
+    assert "institutional.capital" not in modules
+    df = wikirepo.data.query(
+        ents_dict=wd_utils.EntitiesDict(),
+        locations=lctns_dict,
+        timespan=timespan,
+        **query_kwargs
+    )
+    pd.testing.assert_frame_equal(df_refresh_changed, df)
+    assert 7 in list(df_refresh_changed["population"])
+
+    # Changed entities are fetched rather than read from an outdated store, including when spilled.
+    with store_utils.EntityStore(store_path) as store:
+        ents_dict = wd_utils.EntitiesDict(max_bytes=1, store=store)
+        for q in lctn_utils.get_qids_at_depth(lctns_dict, depth=1):
+            wd_utils.load_ent(ents_dict, q)
+
+        pd.testing.assert_frame_equal(
+            wikirepo.data.refresh(df_refresh, ents_dict=ents_dict, verbose=False), df
+        )
+        assert ents_dict[sub_qid]["lastrevid"] == 2
+
+    # No module is queried again for a new revision whose claims haven't changed.
+    ents[sub_qid] = dict(ents[sub_qid], lastrevid=3)
+    server.reset_counts()
+    profiler = prof_utils.Profiler()
+    with prof_utils.profiling(profiler):
+        df_refresh = wikirepo.data.refresh(df_refresh_changed, verbose=False)
+    pd.testing.assert_frame_equal(df_refresh, df)
+    assert server.n_requests == 2
+    assert {module for _, module in profiler} == {None}
+
+    # The spec in attrs is JSON-safe, with all rows being queried again if the state of a result isn't kept.
+    assert json.loads(json.dumps(df_refresh.attrs)) == df_refresh.attrs
+    cache_utils.refresh_states.clear()
+    server.reset_counts()
+    pd.testing.assert_frame_equal(wikirepo.data.refresh(df_refresh, verbose=False), df)
+    assert server.n_ents_served > 0
@@ -0,0 +1,224 @@
+"""
+SPARQL Utilities Tests
+----------------------
+"""
+
+import json
+import threading
+from datetime import date
+
+import pandas as pd
+import pytest
+import wikirepo
+from wikidata.client import Client
+from wikirepo.data import fetch_utils, lctn_utils, sparql_utils, synth_utils, wd_utils
+
+
+@pytest.fixture
+def synth_endpoint(synth_transport):
+    old_endpoint = sparql_utils.set_endpoint(f"{synth_transport.url}sparql")
+    old_scheduler = sparql_utils.set_scheduler(
+        fetch_utils.ScheduledTransport(rate=None)
+    )
+    yield synth_transport
+    sparql_utils.set_scheduler(old_scheduler)
+    sparql_utils.set_endpoint(old_endpoint)
+
+
+def test_extracting_threads():
+    # Extracting with SPARQL in one thread doesn't change the backend of queries in others.
+    barrier = threading.Barrier(2)
+    active = [None, None]
+
+    def extract(i):
+        with sparql_utils.extracting(i == 0):
+            barrier.wait()
+            active[i] = sparql_utils._active.get()
+            barrier.wait()
+
+    threads = [threading.Thread(target=extract, args=(i,)) for i in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert active == [True, False]
+    assert sparql_utils._active.get() == False
+
+
+def test_fetch_prop_vals(synth_ents, synth_endpoint, monkeypatch):
+    monkeypatch.setattr(sparql_utils, "page_size", 2)
+    qids = synth_utils.synth_country_qids(synth_ents)[:2]
+    prop_vals = sparql_utils.fetch_prop_vals(pid="P1082", qids=qids)
+
+    # 3 claims for each location over pages of 2 rows, with the last page being empty.
+    assert prop_vals["qid"] == [qids[0]] * 3 + [qids[1]] * 3
+    assert synth_endpoint.n_requests == 4
+    assert prop_vals["value_type"] == ["quantity"] * 6
+    # Statements are ordered by their UUIDs rather than as their claims are.
+    assert sorted(t["time"] for t in prop_vals["P585"][:3]) == [
+        f"+{y}-01-01T00:00:00Z" for y in [2000, 2001, 2002]
+    ]
+    assert prop_vals["P580"] == [None] * 6
+
+    ents_dict = sparql_utils.prop_vals_to_ents(pid="P1082", prop_vals=prop_vals)
+    claims = synth_ents[qids[0]]["claims"]["P1082"]
+    assert sorted(
+        wd_utils.get_prop_val(ents_dict, qids[0], "P1082", i) for i in range(3)
+    ) == sorted(int(c["mainsnak"]["datavalue"]["value"]["amount"]) for c in claims)
+
+
+@pytest.mark.parametrize(
+    "fresh_synth_server",
+    [dict(n_countries=1, depth=0, n_claims=2, pids=["P2046"], seed=3)],
+    indirect=True,
+)
+def test_fetch_prop_vals_units(fresh_synth_server):
+    # The units of quantities and the precisions of times are those of the statements.
+    ents = fresh_synth_server.ents
+    qid = synth_utils.synth_country_qids(ents)[0]
+    claims = ents[qid]["claims"]["P2046"]
+    square_km = "http://www.wikidata.org/entity/Q712226"
+    claims[0]["mainsnak"]["datavalue"]["value"]["unit"] = square_km
+    claims[0]["qualifiers"]["P585"][0]["datavalue"]["value"]["precision"] = 9
+
+    prop_vals = sparql_utils.fetch_prop_vals(pid="P2046", qids=[qid])
+    sparql_ents = sparql_utils.prop_vals_to_ents(pid="P2046", prop_vals=prop_vals)
+
+    def t(claim):
+        return claim["qualifiers"]["P585"][0]["datavalue"]["value"]["time"]
+
+    for sparql_claim, claim in zip(
+        sorted(sparql_ents[qid]["claims"]["P2046"], key=t), sorted(claims, key=t)
+    ):
+        assert sparql_claim["mainsnak"]["datavalue"] == claim["mainsnak"]["datavalue"]
+        for key in ["time", "precision"]:
+            assert (
+                sparql_claim["qualifiers"]["P585"][0]["datavalue"]["value"][key]
+                == claim["qualifiers"]["P585"][0]["datavalue"]["value"][key]
+            )
+
+
+def test_request_retries(synth_ents, monkeypatch):
+    # Queries that fail with a retryable status are retried by sparql_utils.scheduler.
+    monkeypatch.setattr(sparql_utils, "page_size", 1)
+    qids = synth_utils.synth_country_qids(synth_ents)
+    with synth_utils.SynthServer(
+        synth_ents, error_rate=0.5, retry_after=0, seed=1
+    ) as server:
+        old_endpoint = sparql_utils.set_endpoint(f"{server.url}sparql")
+        scheduler = fetch_utils.ScheduledTransport(rate=None, backoff=0.01, seed=1)
+        old_scheduler = sparql_utils.set_scheduler(scheduler)
+        try:
+            prop_vals = sparql_utils.fetch_prop_vals(pid="P1082", qids=qids)
+
+        finally:
+            sparql_utils.set_scheduler(old_scheduler)
+            sparql_utils.set_endpoint(old_endpoint)
+
+    assert server.n_errors > 0
+    assert scheduler.n_retries == server.n_errors
+    assert prop_vals["qid"] == [q for q in qids for _ in range(3)]
+
+
+@pytest.mark.parametrize("interval", [None, "yearly"])
+def test_query_sparql(synth_ents, synth_endpoint, interval):
+    timespan = (date(2000, 1, 1), date(2002, 1, 1)) if interval else None
+    lctns_dict = lctn_utils.gen_lctns_dict(
+        ents_dict=wd_utils.EntitiesDict(),
+        locations=synth_utils.synth_country_qids(synth_ents),
+        depth=2,
+        timespan=timespan,
+        interval=interval,
+        verbose=False,
+    )
+    query_kwargs = dict(
+        locations=lctns_dict,
+        depth=2,
+        timespan=timespan,
+        interval=interval,
+        demographic_props="population",
+        economic_props=False,
+        electoral_poll_props=False,
+        electoral_result_props=False,
+        geographic_props=False,
+        institutional_props="capital",
+        political_props="executive",
+        misc_props=False,
+        verbose=False,
+    )
+
+    synth_endpoint.reset_counts()
+    df = wikirepo.data.query(ents_dict=wd_utils.EntitiesDict(), **query_kwargs)
+    n_ents_served = synth_endpoint.n_ents_served
+
+    synth_endpoint.reset_counts()
+    df_sparql = wikirepo.data.query(
+        ents_dict=wd_utils.EntitiesDict(), sparql=True, **query_kwargs
+    )
+
+    pd.testing.assert_frame_equal(df_sparql, df)
+    # Only the labels of values are fetched, rather than the entities of each location.
+    assert synth_endpoint.n_ents_served < n_ents_served
+
+
+def test_query_sparql_statement_order(synth_ents):
+    ents = json.loads(json.dumps(synth_ents))
+    qids = synth_utils.synth_country_qids(ents)
+    # Undated values, for which the entity path keeps the last claim.
+    ents[qids[0]]["claims"]["P1082"] += [
+        synth_utils._claim(qids[0], "P1082", v, "quantity") for v in [11, 12, 13]
+    ]
+    # An unknown value, which is NaN in both paths.
+    ents[qids[1]]["claims"]["P1082"].append(
+        dict(
+            synth_utils._claim(
+                qids[1], "P1082", 0, "quantity", {"P585": (date(2003, 1, 1), "time")}
+            ),
+            mainsnak={"snaktype": "somevalue", "property": "P1082"},
+        )
+    )
+
+    with synth_utils.SynthServer(ents) as server:
+        old_transport = wd_utils.set_transport(
+            fetch_utils.ClientTransport(Client(base_url=server.url))
+        )
+        old_endpoint = sparql_utils.set_endpoint(f"{server.url}sparql")
+        old_scheduler = sparql_utils.set_scheduler(
+            fetch_utils.ScheduledTransport(rate=None)
+        )
+        try:
+            prop_vals = sparql_utils.fetch_prop_vals(pid="P1082", qids=qids[1:2])
+            assert prop_vals["value_type"].count(None) == 1
+
+            lctns_dict = lctn_utils.gen_lctns_dict(
+                ents_dict=wd_utils.EntitiesDict(),
+                locations=qids,
+                depth=0,
+                verbose=False,
+            )
+            for timespan, interval in [
+                (None, None),
+                ((date(2000, 1, 1), date(2003, 1, 1)), "yearly"),
+            ]:
+                query_kwargs = dict(
+                    locations=lctns_dict,
+                    depth=0,
+                    timespan=timespan,
+                    interval=interval,
+                    demographic_props="population",
+                    verbose=False,
+                )
+                pd.testing.assert_frame_equal(
+                    wikirepo.data.query(
+                        ents_dict=wd_utils.EntitiesDict(), sparql=True, **query_kwargs
+                    ),
+                    wikirepo.data.query(
+                        ents_dict=wd_utils.EntitiesDict(), **query_kwargs
+                    ),
+                )
+
+        finally:
+            sparql_utils.set_scheduler(old_scheduler)
+            sparql_utils.set_endpoint(old_endpoint)
+            wd_utils.set_transport(old_transport)
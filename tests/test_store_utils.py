@@ -0,0 +1,134 @@
+import json
+import os
+
+import pytest
+from wikirepo.data import store_utils, synth_utils, wd_utils
+
+
+def test_entity_store(synth_ents, tmp_path):
+    path = str(tmp_path / "ents.store")
+    assert store_utils.write_store(path, synth_ents) == len(synth_ents)
+
+    with store_utils.EntityStore(path) as store:
+        assert len(store) == len(synth_ents)
+        # Ids are indexed in sorted order so that they're binary searched.
+        assert list(store.keys()) == sorted(synth_ents.keys())
+        for q in synth_ents:
+            assert q in store
+            assert store[q] == synth_ents[q]
+        assert store.get("Q1") is None
+        assert "Q1" not in store and None not in store
+        with pytest.raises(KeyError):
+            store["Q1"]
+
+    empty_path = str(tmp_path / "empty.store")
+    assert store_utils.write_store(empty_path, {}) == 0
+    with store_utils.EntityStore(empty_path) as store:
+        assert len(store) == 0 and list(store) == []
+        assert "Q1" not in store
+
+    with open(path, "wb") as f:
+        f.write(b"not a store")
+    with pytest.raises(AssertionError):
+        store_utils.EntityStore(path)
+
+
+def test_entities_dict_store(synth_ents, synth_transport, tmp_path):
+    path = str(tmp_path / "ents.store")
+    store_utils.write_store(path, synth_ents)
+    qids = [q for q in synth_ents if q.startswith("Q9000")][:4]
+
+    spill_dir = tmp_path / "spill"
+    ents_dict = wd_utils.EntitiesDict(
+        max_bytes=1, spill_dir=str(spill_dir), store=store_utils.EntityStore(path)
+    )
+    for q in qids + qids:
+        assert wd_utils.load_ent(ents_dict, q) == synth_ents[q]
+        assert wd_utils.get_lbl(ents_dict, q) == synth_ents[q]["labels"]["en"]["value"]
+
+    # Entities are decoded from the store rather than fetched, and aren't spilled.
+    assert synth_transport.n_requests == 0
+    assert ents_dict.stats()["n_store_reads"] == 8
+    assert not os.path.exists(str(spill_dir))
+
+    # Discarded entities are fetched rather than loaded from the store.
+    ents_dict.discard(qids[:2])
+    assert qids[0] not in ents_dict and qids[2] in ents_dict
+    assert wd_utils.load_ent(ents_dict, qids[0]) == synth_ents[qids[0]]
+    assert synth_transport.requested_ids == [qids[0]]
+
+
+@pytest.mark.parametrize("ext, processes", [(".json.gz", 1), (".json.bz2", 2)])
+def test_ingest_dump(synth_ents, synth_transport, tmp_path, ext, processes):
+    dump_path = str(tmp_path / f"latest-all{ext}")
+    synth_utils.write_synth_dump(synth_ents, dump_path)
+
+    root = synth_utils.synth_country_qids(synth_ents)[0]
+    store_path = str(tmp_path / "ents.store")
+    n_ents = store_utils.ingest_dump(
+        dump_path,
+        store_path,
+        roots=[root],
+        depth=1,
+        pids=["P1082", "P36"],
+        processes=processes,
+        chunk_size=5,
+        verbose=False,
+    )
+
+    # Edges are only spilled while locations are found.
+    assert sorted(os.listdir(str(tmp_path))) == sorted(
+        [f"latest-all{ext}", "ents.store"]
+    )
+
+    with store_utils.EntityStore(store_path) as store:
+        assert len(store) == n_ents
+        # The root and its sub-locations, with their sub-locations only having labels.
+        lctn_qids = [q for q in store.keys() if store[q]["claims"]]
+        assert len(lctn_qids) == 1 + 2
+        assert len([q for q in store.keys() if q.startswith("Q9000")]) == 1 + 2 + 4
+        assert set(store[root]["claims"].keys()) == {"P1082", "P36", "P150"}
+        assert set(store[root]["labels"].keys()) == {"en", "de"}
+
+        # Values are stored with only their labels.
+        val_qid = store[root]["claims"]["P36"][0]["mainsnak"]["datavalue"]["value"][
+            "id"
+        ]
+        assert store[val_qid]["claims"] == {}
+        assert store[val_qid]["labels"] == synth_ents[val_qid]["labels"]
+        assert not store.is_full_ent(val_qid)
+        assert store.is_full_ent(root)
+
+        # Label-only entities are used for labels, with their full entities being fetched.
+        wd_utils.lbls_dict.pop(val_qid, None)
+        ents_dict = wd_utils.EntitiesDict(store=store)
+        assert root in ents_dict and val_qid not in ents_dict
+        assert (
+            wd_utils.get_val_lbl(ents_dict, val_qid)
+            == synth_ents[val_qid]["labels"]["en"]["value"]
+        )
+        assert synth_transport.n_requests == 0
+        assert wd_utils.load_ent(ents_dict, val_qid) == synth_ents[val_qid]
+        assert synth_transport.n_requests == 1
+
+
+def test_decode_records(synth_ents, monkeypatch):
+    assert store_utils._line_id(b'{"type":"item","id":"Q1","claims":{}}') == "Q1"
+    assert store_utils._line_id(b'{"claims":{"P1":[{"id":"Q1$1"}]},"id":"Q1"}') is None
+
+    # Only the entities of ingested QIDs are decoded.
+    lines = [
+        json.dumps(ent, separators=(",", ":")).encode("utf-8")
+        for ent in synth_ents.values()
+    ]
+    root = synth_utils.synth_country_qids(synth_ents)[0]
+    store_utils._init_worker({"qids": {root}, "pids": ["P1082"], "languages": ["en"]})
+
+    decoded = []
+    loads = json.loads
+    monkeypatch.setattr(
+        store_utils.json, "loads", lambda s: decoded.append(s) or loads(s)
+    )
+    records, _ = store_utils._decode_records(lines)
+    assert [r[0] for r in records] == [root]
+    assert len(decoded) == 1
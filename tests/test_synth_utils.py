@@ -0,0 +1,123 @@
+import json
+from datetime import date
+from urllib.request import urlopen
+
+import wikirepo
+from wikidata.client import Client
+from wikirepo.data import fetch_utils, lctn_utils, synth_utils, wd_utils
+
+
+def test_gen_synth_ents(synth_ents):
+    country_qids = synth_utils.synth_country_qids(synth_ents)
+    assert len(country_qids) == 3
+
+    country = synth_ents[country_qids[0]]
+    assert country["labels"]["en"]["value"] == "Synthland 0"
+    assert len(country["claims"]["P150"]) == 2
+    assert len(country["claims"]["P1082"]) == 3
+    assert "P585" in country["claims"]["P1082"][0]["qualifiers"]
+    assert "P1082" in synth_ents
+
+    # 3 countries with 2 sub-locations each over 2 levels.
+    lctn_qids = [q for q in synth_ents if q.startswith("Q9000")]
+    assert len(lctn_qids) == 3 * (1 + 2 + 4)
+
+    assert synth_utils.gen_synth_ents(seed=1) == synth_utils.gen_synth_ents(seed=1)
+
+
+def test_synth_server(synth_ents, synth_server):
+    synth_server.reset_counts()
+    qid = synth_utils.synth_country_qids(synth_ents)[0]
+
+    with urlopen(f"{synth_server.url}wiki/Special:EntityData/{qid}.json") as r:
+        assert json.loads(r.read())["entities"][qid] == synth_ents[qid]
+
+    transport = fetch_utils.ClientTransport(Client(base_url=synth_server.url))
+    ents = transport.get_many([qid, "Q1"], props=["labels"], languages=["de"])
+    assert list(ents.keys()) == [qid]
+    assert ents[qid]["labels"] == {
+        "de": {"language": "de", "value": "Synthland 0 (de)"}
+    }
+    assert "claims" not in ents[qid]
+
+    assert synth_server.n_requests == 2
+    assert synth_server.n_ents_served == 2
+
+
+def test_synth_server_errors(synth_ents):
+    qid = synth_utils.synth_country_qids(synth_ents)[0]
+    with synth_utils.SynthServer(synth_ents, error_rate=1.0, retry_after=3) as server:
+        try:
+            urlopen(f"{server.url}wiki/Special:EntityData/{qid}.json")
+            assert False
+
+        except Exception as e:
+            assert e.code == 429
+            assert e.headers["Retry-After"] == "3"
+
+        assert server.n_errors == 1
+
+
+def test_query_synth(synth_ents, synth_transport):
+    country_qids = synth_utils.synth_country_qids(synth_ents)
+    ents_dict = wd_utils.EntitiesDict()
+    lctns_dict = lctn_utils.gen_lctns_dict(
+        ents_dict=ents_dict, locations=country_qids, depth=2, verbose=False
+    )
+    assert len(lctns_dict.key_lbls_list()) == 3 * (1 + 2 + 4)
+
+    df = wikirepo.data.query(
+        ents_dict=ents_dict,
+        locations=lctns_dict,
+        depth=2,
+        timespan=None,
+        interval=None,
+        demographic_props="population",
+        economic_props=False,
+        electoral_poll_props=False,
+        electoral_result_props=False,
+        geographic_props=False,
+        institutional_props="capital",
+        political_props=False,
+        misc_props=False,
+        verbose=False,
+    )
+    assert len(df) == 3 * 4
+    assert df["population"].notnull().all()
+    assert synth_transport.n_requests > 0
+
+
+def test_query_synth_depth_0(synth_ents, synth_transport):
+    timespan = (date(2000, 1, 1), date(2002, 1, 1))
+    ents_dict = wd_utils.EntitiesDict()
+    lctns_dict = lctn_utils.gen_lctns_dict(
+        ents_dict=ents_dict,
+        locations=synth_utils.synth_country_qids(synth_ents),
+        depth=0,
+        timespan=timespan,
+        interval="yearly",
+        verbose=False,
+    )
+
+    df = wikirepo.data.query(
+        ents_dict=ents_dict,
+        locations=lctns_dict,
+        depth=0,
+        timespan=timespan,
+        interval="yearly",
+        demographic_props="population",
+        economic_props=False,
+        electoral_poll_props=False,
+        electoral_result_props=False,
+        geographic_props=False,
+        institutional_props=False,
+        political_props=False,
+        misc_props=False,
+        verbose=False,
+    )
+    assert list(df["location"].unique()) == [
+        "Synthland 0",
+        "Synthland 1",
+        "Synthland 2",
+    ]
+    assert list(df["year"].unique()) == ["2002", "2001", "2000"]
@@ -3,12 +3,21 @@
 ------------------------
 """
 
-from wikirepo.data import wd_utils
+import copy
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import wikirepo
+from wikidata.client import Client
+from wikirepo.data import fetch_utils, lctn_utils, synth_utils, wd_utils
 
 entities_dict = wd_utils.EntitiesDict()
 
 
-def test_load_ent(qid):
+def test_load_ent(wikidata, qid):
     wd_utils.load_ent(ents_dict=entities_dict, pq_id=qid)
 
 
@@ -60,3 +69,295 @@ def test_get_prop_val(ents_dict, qid, pop_pid, exec_pid):
         ),
         str,
     )
+
+
+def test_entities_dict_stats(synth_ents, synth_transport, tmp_path):
+    qid = synth_utils.synth_country_qids(synth_ents)[0]
+    ents_dict = wd_utils.EntitiesDict()
+    for _ in range(3):
+        wd_utils.load_ent(ents_dict=ents_dict, pq_id=qid)
+    wd_utils.load_ent(ents_dict=ents_dict, pq_id="P1082")
+
+    stats = ents_dict.stats()
+    assert stats["n_ents"] == 1
+    assert stats["n_hits"] == 2
+    assert stats["n_misses"] == 1
+    assert stats["n_uncached_fetches"] == 1
+    assert stats["n_fetches"] == synth_transport.n_requests == 2
+    assert stats["n_bytes"] == synth_transport.n_bytes_sent
+    assert set(stats["fetch_latencies"].keys()) == {qid, "P1082"}
+
+    path = str(tmp_path / "ents.prom")
+    text = ents_dict.export_stats(path=path, per_id=True)
+    assert "wikirepo_ents_fetches_total 2" in text
+    assert f'wikirepo_ents_fetch_seconds{{id="{qid}"}}' in text
+    with open(path) as f:
+        assert f.read() == text
+
+    ents_dict.reset_stats()
+    assert ents_dict.stats()["n_fetches"] == 0
+
+
+def test_load_pid_ent(synth_transport, tmp_path):
+    ents_dict = wd_utils.EntitiesDict()
+    # Labels of the PIDs used by wikirepo.data are bundled.
+    assert wd_utils.get_lbl(ents_dict, "P1082") == "population"
+    assert synth_transport.n_requests == 0
+
+    for _ in range(3):
+        wd_utils.load_ent(ents_dict, "P1082")
+    assert synth_transport.n_requests == 1
+    assert ents_dict.stats()["n_hits"] == 2
+
+    old_cache_dir = wd_utils.set_pid_cache_dir(str(tmp_path))
+    try:
+        wd_utils.load_ent(ents_dict, "P2046")
+        wd_utils.pid_ents.clear()
+        assert wd_utils.load_ent(ents_dict, "P2046")["id"] == "P2046"
+        assert synth_transport.n_requests == 2
+
+    finally:
+        wd_utils.set_pid_cache_dir(old_cache_dir)
+
+
+def test_resolve_lbls(synth_ents, synth_transport):
+    ents_dict = wd_utils.EntitiesDict()
+    qid = synth_utils.synth_country_qids(synth_ents)[0]
+    wd_utils.load_ent(ents_dict, qid)
+    n_claims = len(wd_utils.get_prop(ents_dict, qid, "P36"))
+    synth_transport.reset_counts()
+
+    # Labels of values are fetched in a single batch without their entities.
+    wd_utils.prefetch_prop_lbls(ents_dict=ents_dict, qids=[qid], pid="P36")
+    vals = [wd_utils.get_prop_val(ents_dict, qid, "P36", i) for i in range(n_claims)]
+    assert all(v.startswith("Value ") for v in vals)
+    assert synth_transport.n_requests == 1
+    assert list(ents_dict.keys()) == [qid]
+    assert ents_dict.stats()["n_lbl_fetches"] > 0
+
+    old_languages = wd_utils.set_lbl_languages(["fr", "de"])
+    try:
+        assert all(
+            wd_utils.get_prop_val(ents_dict, qid, "P36", i).endswith("(de)")
+            for i in range(n_claims)
+        )
+
+    finally:
+        wd_utils.set_lbl_languages(old_languages)
+
+    # Labels that were fetched first are dropped once the cap is exceeded.
+    val_qids = [
+        claim["mainsnak"]["datavalue"]["value"]["id"]
+        for claim in synth_ents[qid]["claims"]["P36"]
+    ]
+    old_max_lbls = wd_utils.set_max_lbls(1)
+    try:
+        qid_lbls = wd_utils.resolve_lbls(val_qids)
+        assert all(qid_lbls[q].startswith("Value ") for q in val_qids)
+        assert list(wd_utils.lbls_dict) == val_qids[-1:]
+
+    finally:
+        wd_utils.set_max_lbls(old_max_lbls)
+
+
+def test_set_projection(synth_ents, synth_transport):
+    qid = synth_utils.synth_country_qids(synth_ents)[0]
+    ents_dict = wd_utils.EntitiesDict()
+    wd_utils.load_ent(ents_dict, qid)
+    assert "P1082" in ents_dict[qid]["claims"]
+
+    # Stored entities are stripped in place, with structural properties being kept.
+    ents_dict.set_projection(pids=["P36"], languages=["en"])
+    assert set(ents_dict[qid]["claims"].keys()) == {"P36", "P150"}
+    assert list(ents_dict[qid]["labels"].keys()) == ["en"]
+    assert wd_utils.get_lbl(ents_dict, qid) == "Synthland 0"
+
+    # Widening the projection removes entities so that they're fetched again.
+    ents_dict.set_projection(pids=["P36", "P1082"], languages=["en"])
+    assert qid not in ents_dict
+    wd_utils.load_ent(ents_dict, qid)
+    assert set(ents_dict[qid]["claims"].keys()) == {"P36", "P1082", "P150"}
+
+    # Narrowing keeps entities, and turning projection off removes the stripped ones.
+    ents_dict.set_projection(pids=["P36"], languages=["en"])
+    assert set(ents_dict[qid]["claims"].keys()) == {"P36", "P150"}
+    ents_dict.set_projection()
+    assert qid not in ents_dict
+
+
+def test_query_project(synth_ents, synth_transport):
+    lctns_dict = lctn_utils.gen_lctns_dict(
+        ents_dict=wd_utils.EntitiesDict(),
+        locations=synth_utils.synth_country_qids(synth_ents),
+        depth=0,
+        verbose=False,
+    )
+    ents_dict = wd_utils.EntitiesDict()
+    wikirepo.data.query(
+        ents_dict=ents_dict,
+        locations=lctns_dict,
+        depth=0,
+        demographic_props="population",
+        project=True,
+        verbose=False,
+    )
+    assert ents_dict._projection is None
+
+    # A later query of other properties with the same dictionary isn't limited to the first's.
+    query_kwargs = dict(
+        locations=lctns_dict, depth=0, geographic_props="area", verbose=False
+    )
+    df = wikirepo.data.query(ents_dict=ents_dict, **query_kwargs)
+    assert df["area_km2"].notnull().all()
+    pd.testing.assert_frame_equal(
+        df, wikirepo.data.query(ents_dict=wd_utils.EntitiesDict(), **query_kwargs)
+    )
+
+
+def test_entities_dict_max_bytes(synth_ents, synth_transport, tmp_path):
+    qids = [q for q in synth_ents if q.startswith("Q9000")][:4]
+    ent_size = len(json.dumps(synth_ents[qids[0]], separators=(",", ":")))
+    ents_dict = wd_utils.EntitiesDict(
+        max_bytes=int(2.5 * ent_size), spill_dir=str(tmp_path)
+    )
+    for q in qids:
+        wd_utils.load_ent(ents_dict, q)
+
+    stats = ents_dict.stats()
+    assert stats["n_ents"] == 4
+    assert stats["n_resident_ents"] == 2
+    assert stats["n_evictions"] == 2
+
+    # Evicted entities are reloaded from disk rather than fetched again.
+    assert ents_dict[qids[0]] == synth_ents[qids[0]]
+    assert ents_dict.stats()["n_reloads"] == 1
+    assert synth_transport.n_requests == 4
+    assert dict(ents_dict.items()) == {q: synth_ents[q] for q in qids}
+
+    # Copies, views and comparisons have the entities rather than the placeholder of spilled ones.
+    items = ents_dict.items()
+    assert len(items) == 4 and list(items) == list(items)
+    assert list(ents_dict.values()) == [synth_ents[q] for q in qids]
+    assert dict(ents_dict) == {**ents_dict} == {q: synth_ents[q] for q in qids}
+    assert ents_dict == {q: synth_ents[q] for q in qids}
+    assert dict(copy.copy(ents_dict)) == dict(ents_dict | {}) == dict(ents_dict)
+
+    # Popping keeps the budget's bookkeeping, with further entities still being evicted.
+    ents_copy = ents_dict.copy()
+    spilled_qid = next(
+        q for q in qids if dict.get(ents_dict, q) is wd_utils._spilled_ent
+    )
+    assert ents_dict.pop(spilled_qid) == synth_ents[spilled_qid]
+    assert ents_dict.pop(spilled_qid, None) is None
+    assert ents_dict.popitem()[0] == qids[-1]
+    assert spilled_qid not in ents_dict._lru
+    for q in qids:
+        ents_dict.setdefault(q, synth_ents[q])
+    assert dict(ents_dict.items()) == {q: synth_ents[q] for q in qids}
+    assert ents_dict.stats()["n_resident_bytes"] <= int(2.5 * ent_size)
+
+    ents_dict.clear()
+    assert os.listdir(str(tmp_path)) == []
+    assert dict(ents_copy.items()) == {q: synth_ents[q] for q in qids}
+
+
+def test_refresh(synth_ents):
+    ents = json.loads(json.dumps(synth_ents))
+    qids = [q for q in ents if q.startswith("Q9000")][:5]
+    with synth_utils.SynthServer(ents) as server:
+        old_transport = wd_utils.set_transport(
+            fetch_utils.ClientTransport(Client(base_url=server.url))
+        )
+        try:
+            ents_dict = wd_utils.EntitiesDict()
+            for q in qids:
+                wd_utils.load_ent(ents_dict, q)
+
+            ents[qids[0]]["lastrevid"] += 1
+            ents[qids[0]]["labels"]["en"]["value"] = "Renamed"
+            server.reset_counts()
+
+            # One metadata request and one request for the changed entity.
+            assert ents_dict.refresh() == [qids[0]]
+            assert server.n_requests == 2
+            assert wd_utils.get_lbl(ents_dict, qids[0]) == "Renamed"
+
+            server.reset_counts()
+            assert ents_dict.refresh(qids[1:]) == []
+            assert server.n_requests == 1
+            assert ents_dict.stats()["n_revalidated"] == 5 + 4
+
+            # Revisions of spilled entities are read without reloading them into memory.
+            ents_dict = wd_utils.EntitiesDict(max_bytes=1)
+            for q in qids:
+                wd_utils.load_ent(ents_dict, q)
+            spilled_qids = [
+                q for q in qids if dict.get(ents_dict, q) is wd_utils._spilled_ent
+            ]
+            assert len(spilled_qids) == 4
+            n_evictions = ents_dict.stats()["n_evictions"]
+
+            assert ents_dict.refresh() == []
+            assert ents_dict.stats()["n_evictions"] == n_evictions
+            assert [
+                q for q in qids if dict.get(ents_dict, q) is wd_utils._spilled_ent
+            ] == spilled_qids
+
+        finally:
+            wd_utils.set_transport(old_transport)
+
+
+def test_entities_dict_checkpoint(synth_ents, synth_transport, tmp_path):
+    qids = [q for q in synth_ents if q.startswith("Q9000")][:3]
+    ents_dict = wd_utils.EntitiesDict(checkpoint_dir=str(tmp_path))
+    for q in qids[:2]:
+        wd_utils.load_ent(ents_dict, q)
+
+    # A new session resumes from the checkpoint, only fetching what wasn't loaded.
+    synth_transport.reset_counts()
+    ents_dict = wd_utils.EntitiesDict(checkpoint_dir=str(tmp_path))
+    assert set(ents_dict.keys()) == set(qids[:2])
+    for q in qids:
+        assert wd_utils.load_ent(ents_dict, q) == synth_ents[q]
+    assert synth_transport.requested_ids == [qids[2]]
+
+    # Clearing the dictionary keeps its checkpoints.
+    ents_dict.clear()
+    ents_dict = wd_utils.EntitiesDict(checkpoint_dir=str(tmp_path))
+    assert set(ents_dict.keys()) == set(qids)
+
+
+def test_fetch_ent_coalescing(synth_ents):
+    qid = synth_utils.synth_country_qids(synth_ents)[0]
+    with synth_utils.SynthServer(synth_ents, latency=0.2) as server:
+        old_transport = wd_utils.set_transport(
+            fetch_utils.ClientTransport(Client(base_url=server.url))
+        )
+        try:
+            ents_dict = wd_utils.EntitiesDict()
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                ents = list(
+                    executor.map(lambda _: wd_utils.load_ent(ents_dict, qid), range(8))
+                )
+
+            # All threads share the first thread's request.
+            assert all(ent == synth_ents[qid] for ent in ents)
+            assert server.n_requests == 1
+            assert ents_dict.stats()["n_coalesced"] == 7
+
+            # Fetches through another transport don't share the request.
+            with synth_utils.SynthServer(synth_ents) as other_server:
+                with ThreadPoolExecutor(max_workers=1) as executor:
+                    future = executor.submit(wd_utils.fetch_ent, qid)
+                    time.sleep(0.05)
+                    wd_utils.set_transport(
+                        fetch_utils.ClientTransport(Client(base_url=other_server.url))
+                    )
+                    assert wd_utils.fetch_ent(qid) == synth_ents[qid]
+                    assert future.result() == synth_ents[qid]
+
+                assert other_server.n_requests == 1
+                assert server.n_requests == 2
+
+        finally:
+            wd_utils.set_transport(old_transport)